@@ -0,0 +1,172 @@
+"""Background removal of deleted accounts for Warbler.
+
+Deleting an account only sets `users.deleted_at`, which hides it at once.
+The purge then removes the account's likes, follows, timeline entries and
+messages a batch at a time. Each batch is one set-based DELETE, picked by
+primary key, committed on its own, so no single transaction locks all of a
+prolific account's rows. The counters other users keep of the deleted rows
+are adjusted in the same transaction as each batch.
+
+The rows still left are the progress: an interrupted purge picks up where it
+stopped when run again. Once the account's rows are gone the user row is
+deleted, and the ondelete=cascade foreign keys sweep up anything written
+after its batch ran (`flask reconcile-counts` repairs the counts of those).
+Run it with:
+
+    flask purge-deleted-users
+"""
+
+from collections import Counter, defaultdict
+
+from models import db, Follow, Like, Message, TimelineEntry, User
+
+
+def get_deleted_user_ids():
+    """Get the ids of deleted accounts still to be purged, oldest first."""
+
+    return db.session.scalars(
+        db.select(User.id)
+        .where(User.deleted_at.is_not(None))
+        .order_by(User.deleted_at)
+    ).all()
+
+
+def _delete_batch(model, criteria, batch_size, returning=None):
+    """Delete up to `batch_size` rows of `model` matching `criteria`.
+
+    Returns the deleted rows' `returning` columns (by default, their
+    primary key).
+    """
+
+    primary_key = model.__table__.primary_key.columns
+    batch = db.select(*primary_key).where(*criteria).limit(batch_size)
+
+    return db.session.execute(
+        db.delete(model)
+        .where(db.tuple_(*primary_key).in_(batch))
+        .returning(*(returning or primary_key))
+        .execution_options(synchronize_session=False)
+    ).all()
+
+
+def _take_off_counts(user_ids, counter):
+    """Take one off each user's `counter` for every time they appear in
+    `user_ids`, with one UPDATE per distinct amount."""
+
+    by_amount = defaultdict(list)
+
+    for user_id, amount in Counter(user_ids).items():
+        by_amount[amount].append(user_id)
+
+    for amount, ids in by_amount.items():
+        User.adjust_counts(ids, **{counter: -amount})
+
+
+def _purge_likes(user_id, batch_size):
+    return len(_delete_batch(
+        Like, [Like.user_liking_id == user_id], batch_size))
+
+
+def _purge_likes_of_messages(user_id, batch_size):
+    rows = _delete_batch(
+        Like,
+        [Like.message_being_liked_id.in_(
+            db.select(Message.id).where(Message.user_id == user_id))],
+        batch_size,
+        returning=[Like.user_liking_id],
+    )
+    _take_off_counts([row.user_liking_id for row in rows], 'likes_count')
+
+    return len(rows)
+
+
+def _purge_following(user_id, batch_size):
+    rows = _delete_batch(
+        Follow,
+        [Follow.user_following_id == user_id],
+        batch_size,
+        returning=[Follow.user_being_followed_id],
+    )
+    _take_off_counts(
+        [row.user_being_followed_id for row in rows], 'followers_count')
+
+    return len(rows)
+
+
+def _purge_followers(user_id, batch_size):
+    rows = _delete_batch(
+        Follow,
+        [Follow.user_being_followed_id == user_id],
+        batch_size,
+        returning=[Follow.user_following_id],
+    )
+    _take_off_counts(
+        [row.user_following_id for row in rows], 'following_count')
+
+    return len(rows)
+
+
+def _purge_timeline_entries(user_id, batch_size):
+    # Both the user's own timeline and their messages in others'
+    return len(_delete_batch(
+        TimelineEntry,
+        [db.or_(TimelineEntry.user_id == user_id,
+                TimelineEntry.author_id == user_id)],
+        batch_size,
+    ))
+
+
+def _purge_messages(user_id, batch_size):
+    return len(_delete_batch(
+        Message, [Message.user_id == user_id], batch_size))
+
+
+# In order: messages go once their likes and timeline entries have, so
+# deleting them cascades to nothing
+PURGE_STEPS = [
+    ('likes', _purge_likes),
+    ('likes of messages', _purge_likes_of_messages),
+    ('following', _purge_following),
+    ('followers', _purge_followers),
+    ('timeline entries', _purge_timeline_entries),
+    ('messages', _purge_messages),
+]
+
+
+def purge_user(user_id, batch_size, on_progress=None):
+    """Remove a deleted account and everything that points at it.
+
+    Commits after every batch of at most `batch_size` rows. `on_progress`,
+    if given, is called with (user_id, step name, rows deleted) after each
+    batch that deleted something.
+    """
+
+    for name, purge_batch in PURGE_STEPS:
+        while True:
+            num_deleted = purge_batch(user_id, batch_size)
+            db.session.commit()
+
+            if not num_deleted:
+                break
+
+            if on_progress:
+                on_progress(user_id, name, num_deleted)
+
+    db.session.execute(
+        db.delete(User)
+        .where(User.id == user_id)
+        .where(User.deleted_at.is_not(None))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def purge_deleted_users(batch_size, on_progress=None):
+    """Purge every deleted account. Returns how many were purged."""
+
+    user_ids = get_deleted_user_ids()
+
+    for user_id in user_ids:
+        purge_user(user_id, batch_size, on_progress)
+
+    return len(user_ids)
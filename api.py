@@ -0,0 +1,311 @@
+"""Versioned JSON API for Warbler.
+
+Serves what the HTML pages show, from the same queries, for clients that
+would otherwise scrape the pages. Requests are authenticated by the login
+session, as the pages are.
+
+    GET /api/v1/timeline                 the logged in user's home timeline
+    GET /api/v1/timeline/unseen          how many of its messages are new
+    GET /api/v1/users/<id>               a profile
+    GET /api/v1/users/<id>/followers     a user's followers
+    GET /api/v1/users/<id>/likes         the messages a user has liked
+    GET /api/v1/messages/<id>            a message
+
+Lists are {"data": [...], "next_cursor": ...}. Pass `next_cursor` back as
+`cursor` for the next page (it's null on the last one), and `limit` to set
+the page size, up to API_PAGE_SIZE_MAX. Single items are {"data": {...}}.
+Errors are {"error": ...}.
+
+Sparse fieldsets: `fields[message]=id,text` and `fields[user]=id,username`
+pick the fields of each message and user returned. Fields that need a
+query of their own (whether the logged in user likes a message, or follows
+a user) are only looked up when asked for.
+
+Responses are made with orjson, and carry ETags like the pages do (see
+http_caching.py), so unchanged ones are 304s.
+"""
+
+import orjson
+from flask import Blueprint, abort, current_app, g, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
+
+from http_caching import (etag_from,
+                          get_home_timeline_version,
+                          get_message_page_version,
+                          get_user_page_version,
+)
+from models import db, Message, User
+from replicas import replica_reads
+from timeline import (format_cursor,
+                      get_home_timeline,
+                      parse_cursor,
+                      count_unseen_messages,
+)
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+USER_FIELDS = (
+    'id',
+    'username',
+    'image_url',
+    'header_image_url',
+    'bio',
+    'location',
+    'messages_count',
+    'followers_count',
+    'following_count',
+    'likes_count',
+    # Is the logged in user following them?
+    'followed',
+)
+
+MESSAGE_FIELDS = (
+    'id',
+    'text',
+    'timestamp',
+    'user',
+    # Has the logged in user liked it?
+    'liked',
+)
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that makes responses with orjson, several times
+    faster than the standard library on long lists. Datetimes, which are
+    stored in UTC, come out in RFC 3339 format.
+
+    Everything else (like the session cookie, which needs the standard
+    library's hooks) is left to the default provider.
+    """
+
+    def response(self, *args, **kwargs):
+        return self._app.response_class(
+            orjson.dumps(
+                self._prepare_response_obj(args, kwargs),
+                option=orjson.OPT_NAIVE_UTC,
+            ),
+            mimetype="application/json",
+        )
+
+
+@api.before_request
+def require_login():
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+
+@api.errorhandler(HTTPException)
+def http_error(error):
+    return jsonify(error=error.description), error.code
+
+
+def _get_fields(kind, available):
+    """Get the fields of `kind` asked for with fields[kind]; all of them if
+    it isn't given."""
+
+    requested = request.args.get(f"fields[{kind}]")
+
+    if requested is None:
+        return available
+
+    fields = tuple(filter(None, requested.split(",")))
+    unknown = set(fields).difference(available)
+
+    if unknown:
+        abort(400, f"Unknown {kind} fields: {', '.join(sorted(unknown))}")
+
+    return fields
+
+
+def _get_limit():
+    """Get the page size asked for, within bounds."""
+
+    limit = request.args.get(
+        'limit', current_app.config['API_PAGE_SIZE'], type=int)
+
+    return max(1, min(limit, current_app.config['API_PAGE_SIZE_MAX']))
+
+
+def _get_cursor(parse):
+    """Get the `cursor` param, parsed with `parse`, or None."""
+
+    cursor = request.args.get('cursor')
+
+    if not cursor:
+        return None
+
+    try:
+        return parse(cursor)
+    except ValueError:
+        abort(400, "Invalid cursor.")
+
+
+def _get_user_or_404(user_id):
+    user = db.get_or_404(User, user_id)
+
+    if user.deleted_at is not None:
+        abort(404)
+
+    return user
+
+
+def serialize_users(users):
+    """Turn users into dicts of the requested user fields."""
+
+    fields = _get_fields("user", USER_FIELDS)
+    columns = [field for field in fields if field != 'followed']
+
+    followed_user_ids = (g.user.get_followed_user_ids(users)
+                         if 'followed' in fields else None)
+
+    serialized = []
+
+    for user in users:
+        item = {column: getattr(user, column) for column in columns}
+
+        if followed_user_ids is not None:
+            item['followed'] = user.id in followed_user_ids
+
+        serialized.append(item)
+
+    return serialized
+
+
+def serialize_messages(messages):
+    """Turn messages into dicts of the requested message fields, with their
+    authors as dicts of the requested user fields."""
+
+    fields = _get_fields("message", MESSAGE_FIELDS)
+    columns = [field for field in fields if field not in ('user', 'liked')]
+
+    liked_message_ids = (g.user.get_liked_message_ids(messages)
+                         if 'liked' in fields else None)
+
+    # Each author is serialized once, however many of the messages are theirs
+    authors = None
+
+    if 'user' in fields:
+        unique_authors = list({
+            message.user_id: message.user for message in messages
+        }.values())
+        authors = {
+            author.id: item
+            for author, item in zip(unique_authors,
+                                    serialize_users(unique_authors))
+        }
+
+    serialized = []
+
+    for message in messages:
+        item = {column: getattr(message, column) for column in columns}
+
+        if authors is not None:
+            item['user'] = authors[message.user_id]
+
+        if liked_message_ids is not None:
+            item['liked'] = message.id in liked_message_ids
+
+        serialized.append(item)
+
+    return serialized
+
+
+def _conditional(response):
+    """Give a response an ETag from its body, and make it a 304 if the
+    client has it already. For lists of many users' data, with no cheap
+    version stamp; this saves the transfer, though not the work."""
+
+    response.add_etag()
+
+    return response.make_conditional(request)
+
+
+@api.get('/timeline')
+@replica_reads
+@etag_from(get_home_timeline_version)
+def get_timeline():
+    """The logged in user's home timeline, newest first."""
+
+    limit = _get_limit()
+    messages = get_home_timeline(
+        g.user, limit=limit, before=_get_cursor(parse_cursor))
+
+    return jsonify(
+        data=serialize_messages(messages),
+        next_cursor=(format_cursor(messages[-1])
+                     if len(messages) == limit else None),
+    )
+
+
+@api.get('/timeline/unseen')
+@replica_reads
+def get_unseen_count():
+    """How many messages by others are in the logged in user's home
+    timeline since they last looked at it. Counts up to TIMELINE_UNSEEN_CAP,
+    and `more` is true past that. Cheap enough to poll."""
+
+    cap = current_app.config['TIMELINE_UNSEEN_CAP']
+    count = count_unseen_messages(g.user, cap)
+
+    return jsonify(data={'count': min(count, cap), 'more': count > cap})
+
+
+@api.get('/users/<int:user_id>')
+@replica_reads
+@etag_from(get_user_page_version)
+def get_user(user_id):
+    """A user's profile."""
+
+    [user] = serialize_users([_get_user_or_404(user_id)])
+
+    return jsonify(data=user)
+
+
+@api.get('/users/<int:user_id>/followers')
+@replica_reads
+def get_followers(user_id):
+    """A user's followers, in id order."""
+
+    limit = _get_limit()
+    followers = _get_user_or_404(user_id).get_followers_page(
+        limit, after=_get_cursor(int))
+
+    return _conditional(jsonify(
+        data=serialize_users(followers),
+        next_cursor=str(followers[-1].id) if len(followers) == limit else None,
+    ))
+
+
+@api.get('/users/<int:user_id>/likes')
+@replica_reads
+def get_liked_messages(user_id):
+    """The messages a user has liked, newest message first."""
+
+    limit = _get_limit()
+    messages = _get_user_or_404(user_id).get_liked_messages_page(
+        limit, before=_get_cursor(int))
+
+    return _conditional(jsonify(
+        data=serialize_messages(messages),
+        next_cursor=str(messages[-1].id) if len(messages) == limit else None,
+    ))
+
+
+@api.get('/messages/<int:message_id>')
+@replica_reads
+@etag_from(get_message_page_version)
+def get_message(message_id):
+    """A message."""
+
+    message = (Message
+               .query
+               .options(db.joinedload(Message.user, innerjoin=True))
+               .get_or_404(message_id))
+
+    if message.user.deleted_at is not None:
+        abort(404)
+
+    [message] = serialize_messages([message])
+
+    return jsonify(data=message)
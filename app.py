@@ -1,8 +1,15 @@
 import os
+import time
+from datetime import datetime
+
+import click
 from dotenv import load_dotenv
 
-from flask import Flask, render_template, request, flash, redirect, session, g, abort
+from flask import (Flask, Response, render_template, stream_template, request,
+                   flash, redirect, session, g, abort, jsonify)
 from flask_debugtoolbar import DebugToolbarExtension
+from flask_migrate import Migrate
+from markupsafe import Markup
 from sqlalchemy.exc import IntegrityError
 
 from forms import UserAddForm, LoginForm, MessageForm, UserUpdateForm, CSRFForm
@@ -10,8 +17,34 @@ from models import  (db,
                     connect_db,
                     User,
                     Message,
+                    Follow,
+                    Like,
                     DEFAULT_IMAGE_URL, DEFAULT_HEADER_IMAGE_URL
 )
+from account_purge import purge_deleted_users
+from api import api, ORJSONProvider
+from cache import TTLCache
+from hashing import HashingBusy
+from http_caching import (etag_from,
+                          set_cache_policy,
+                          get_user_page_version,
+                          get_message_page_version,
+                          get_home_timeline_version,
+)
+from identity import CurrentUser, UserGone
+from index_check import check_indexes
+from live_updates import LiveUpdates, LiveUpdatesBusy, message_event
+from metrics import Metrics
+from replicas import ReplicaRouter, replica_reads
+from slow_queries import SlowQueryRecorder
+from timeline import (fan_out_message,
+                      add_follow_to_timeline,
+                      remove_follow_from_timeline,
+                      get_home_timeline,
+                      rebuild_timelines,
+                      format_cursor,
+                      parse_cursor,
+)
 
 load_dotenv()
 
@@ -20,12 +53,132 @@ CURR_USER_KEY = "curr_user"
 app = Flask(__name__)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
-app.config['SQLALCHEMY_ECHO'] = True
+# Comma-separated read replicas of DATABASE_URL; see replicas.py
+app.config['SQLALCHEMY_BINDS'] = {
+    f"replica_{i}": url
+    for i, url in enumerate(
+        filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')))
+}
+# Echo writes every statement to stdout as it runs, which is slow; use
+# /metrics for visibility into the database instead
+app.config['SQLALCHEMY_ECHO'] = os.environ.get('SQLALCHEMY_ECHO') == '1'
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
+
+# Authors with at least this many followers are merged into timelines on
+# read rather than fanned out on write
+app.config['TIMELINE_FANOUT_LIMIT'] = int(
+    os.environ.get('TIMELINE_FANOUT_LIMIT', 10_000))
+# ...and only go back to fan-out on write once they're this fraction under it
+app.config['TIMELINE_FANOUT_HYSTERESIS'] = 0.1
+# How many recent messages to copy into a timeline on a new follow
+app.config['TIMELINE_BACKFILL_SIZE'] = 100
+app.config['TIMELINE_PAGE_SIZE'] = 100
+# Unseen home timeline messages are counted up to this, then shown as "99+";
+# pages poll the count every so many seconds
+app.config['TIMELINE_UNSEEN_CAP'] = 99
+app.config['TIMELINE_UNSEEN_POLL_INTERVAL'] = 60
+app.config['USER_SEARCH_LIMIT'] = 50
+# Users directory page size, and the most a `per_page` param can ask for
+app.config['USERS_PAGE_SIZE'] = 50
+app.config['USERS_PAGE_SIZE_MAX'] = 200
+# Send the directory as it renders rather than buffering the whole page
+app.config['USERS_STREAM_TEMPLATE'] = (
+    os.environ.get('USERS_STREAM_TEMPLATE') == '1')
+# Identity fields of recently seen users, so most requests don't need to
+# load the logged in user at all
+app.config['IDENTITY_CACHE_SIZE'] = 10_000
+app.config['IDENTITY_CACHE_TTL'] = 60
+# Rendered message list items (without their like buttons), which are the
+# same for every viewer; see message_fragment
+app.config['MESSAGE_FRAGMENT_CACHE_SIZE'] = 10_000
+app.config['MESSAGE_FRAGMENT_CACHE_TTL'] = 60 * 60
+# Password hashing runs in a pool of processes; see hashing.py
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['HASHING_WORKERS'] = int(os.environ.get('HASHING_WORKERS', 2))
+app.config['HASHING_MAX_PENDING'] = 32
+app.config['HASHING_QUEUE_TIMEOUT'] = 0.5
+# Request, SQL and template timings on /metrics, for scrapers sending
+# METRICS_TOKEN as a bearer token; see metrics.py
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Statements slower than this many seconds are recorded; see slow_queries.py
+app.config['SLOW_QUERY_THRESHOLD'] = float(
+    os.environ.get('SLOW_QUERY_THRESHOLD', 0.1))
+app.config['SLOW_QUERY_EXPLAIN_RATE'] = 0.1
+app.config['SLOW_QUERY_LOG_FILE'] = os.environ.get('SLOW_QUERY_LOG_FILE')
+# Comma-separated ids of the users allowed on the admin pages (not their
+# usernames, which can be changed, and then claimed by someone else)
+app.config['ADMIN_USER_IDS'] = {
+    int(user_id)
+    for user_id in os.environ.get('ADMIN_USER_IDS', '').split(',')
+    if user_id.strip()
+}
+# Rows removed per transaction when purging deleted accounts
+app.config['ACCOUNT_PURGE_BATCH_SIZE'] = int(
+    os.environ.get('ACCOUNT_PURGE_BATCH_SIZE', 1000))
+# JSON API page size, and the most a `limit` param can ask for; see api.py
+app.config['API_PAGE_SIZE'] = 100
+app.config['API_PAGE_SIZE_MAX'] = 200
+# Live timeline updates; see live_updates.py. Use the "postgres" backend
+# when running more than one worker process.
+app.config['LIVE_UPDATES_BACKEND'] = os.environ.get(
+    'LIVE_UPDATES_BACKEND', 'memory')
+# Each open stream holds a request thread, so they're off (0) unless this
+# is set, and it should only be set, below the threads per worker, when
+# running threaded workers (gunicorn --threads)
+app.config['LIVE_UPDATES_MAX_CONNECTIONS'] = int(
+    os.environ.get('LIVE_UPDATES_MAX_CONNECTIONS', 0))
+app.config['LIVE_UPDATES_HEARTBEAT'] = 15
+# Revalidated pages get new ETags at least this often, so they never
+# replay an expired CSRF token; see http_caching.py
+app.config['ETAG_MAX_AGE'] = 30 * 60
 toolbar = DebugToolbarExtension(app)
 
+app.json = ORJSONProvider(app)
+app.register_blueprint(api)
+
 connect_db(app)
+migrate = Migrate(app, db)
+replica_router = ReplicaRouter(app, db)
+metrics = Metrics(app, db)
+slow_queries = SlowQueryRecorder(app, db)
+live_updates = LiveUpdates(app, db)
+
+identity_cache = TTLCache(
+    maxsize=app.config['IDENTITY_CACHE_SIZE'],
+    ttl=app.config['IDENTITY_CACHE_TTL'],
+)
+
+message_fragments = TTLCache(
+    maxsize=app.config['MESSAGE_FRAGMENT_CACHE_SIZE'],
+    ttl=app.config['MESSAGE_FRAGMENT_CACHE_TTL'],
+)
+
+
+@app.template_global()
+def message_fragment(message):
+    """Render the author, timestamp and text of a message list item.
+
+    Messages can't be edited, so the HTML only changes with the author's
+    profile. It is cached by message id along with the author's profile
+    version, and re-rendered once that moves on (update_profile bumps it;
+    new followers, likes and posts don't). delete_message drops deleted
+    messages.
+    """
+
+    version = message.user.profile_version
+    cached = message_fragments.get(message.id)
+
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    html = Markup(app.jinja_env
+                  .get_template('messages/_message_fragment.html')
+                  .render(message=message))
+    message_fragments.set(message.id, (version, html))
+
+    return html
 
 
 ##############################################################################
@@ -34,10 +187,13 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    The user is only loaded from the database if the request uses it.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = CurrentUser(session[CURR_USER_KEY], identity_cache)
 
     else:
         g.user = None
@@ -113,6 +269,8 @@ def login():
         )
 
         if user:
+            # Saves the password if it was rehashed at a new cost
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -141,28 +299,111 @@ def logout():
 ##############################################################################
 # General user routes:
 
+
+def abort_if_deleted(user):
+    """404 if `user` has deleted their account (it stays in the database
+    until it is purged)."""
+
+    if user.deleted_at is not None:
+        abort(404)
+
+
+def wants_json():
+    """Was this request sent by the in-page toggles (see
+    static/scripts/toggles.js), which want JSON back instead of a page?"""
+
+    return request.accept_mimetypes.best == "application/json"
+
+
+def refuse(message, category="danger"):
+    """Turn a request away: flash `message` and go home, or for the
+    toggles, a 403 with it."""
+
+    if wants_json():
+        return jsonify(error=message), 403
+
+    flash(message, category)
+    return redirect("/")
+
+
+def get_counts_json(*user_ids):
+    """The counts of these users, for the toggles to update the page with."""
+
+    return [
+        row._asdict()
+        for row in db.session.execute(
+            db.select(
+                User.id,
+                User.messages_count,
+                User.followers_count,
+                User.following_count,
+                User.likes_count,
+            )
+            .where(User.id.in_(user_ids))
+        )
+    ]
+
+
 @app.get('/users')
+@replica_reads
 def list_users():
     """Page with listing of users.
 
     Can take a 'q' param in querystring to search by that username.
+
+    Without a search, users are listed a page at a time in username order.
+    'after' is the username to start after and 'per_page' the page size, up
+    to USERS_PAGE_SIZE_MAX.
     """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    search = request.args.get('q')
+    search = request.args.get('q', '').strip()
+    next_after = None
 
     if not search:
-        users = User.query.all()
+        per_page = min(
+            request.args.get(
+                'per_page', app.config['USERS_PAGE_SIZE'], type=int),
+            app.config['USERS_PAGE_SIZE_MAX'],
+        )
+        per_page = max(per_page, 1)
+        after = request.args.get('after')
+
+        query = (User
+                 .query
+                 .filter_by(deleted_at=None)
+                 .order_by(User.username, User.id))
+
+        if after:
+            query = query.filter(User.username > after)
+
+        # One extra row tells us whether there is a next page
+        users = query.limit(per_page + 1).all()
+
+        if len(users) > per_page:
+            users = users[:per_page]
+            next_after = users[-1].username
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users = User.search(search, app.config['USER_SEARCH_LIMIT'])
+
+    render = (stream_template if app.config['USERS_STREAM_TEMPLATE']
+              else render_template)
 
-    return render_template('users/index.html', users=users)
+    return render(
+        'users/index.html',
+        users=users,
+        followed_user_ids=g.user.get_followed_user_ids(users),
+        next_after=next_after,
+        per_page=request.args.get('per_page', type=int),
+    )
 
 
 @app.get('/users/<int:user_id>')
+@replica_reads
+@etag_from(get_user_page_version)
 def show_user(user_id):
     """Show user profile."""
 
@@ -170,12 +411,21 @@ def show_user(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = (User
+            .query
+            .options(db.selectinload(User.messages))
+            .get_or_404(user_id))
+    abort_if_deleted(user)
 
-    return render_template('users/show.html', user=user)
+    return render_template(
+        'users/show.html',
+        user=user,
+        liked_message_ids=g.user.get_liked_message_ids(user.messages),
+    )
 
 
 @app.get('/users/<int:user_id>/following')
+@replica_reads
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -184,10 +434,19 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    abort_if_deleted(user)
+    following = user.get_following()
+
+    return render_template(
+        'users/following.html',
+        user=user,
+        following=following,
+        followed_user_ids=g.user.get_followed_user_ids(following),
+    )
 
 
 @app.get('/users/<int:user_id>/followers')
+@replica_reads
 def show_followers(user_id):
     """Show list of followers of this user."""
 
@@ -196,9 +455,18 @@ def show_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    abort_if_deleted(user)
+    followers = user.get_followers()
+
+    return render_template(
+        'users/followers.html',
+        user=user,
+        followers=followers,
+        followed_user_ids=g.user.get_followed_user_ids(followers),
+    )
 
 @app.get('/users/<int:user_id>/likes')
+@replica_reads
 def show_liked_messages(user_id):
     """Displays messages a user has liked."""
 
@@ -207,54 +475,87 @@ def show_liked_messages(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
+    abort_if_deleted(user)
+    liked_messages = user.get_liked_messages()
 
-    return render_template('users/likes.html', user=user)
+    return render_template(
+        'users/likes.html',
+        user=user,
+        liked_messages=liked_messages,
+        liked_message_ids=g.user.get_liked_message_ids(liked_messages),
+    )
 
 
 @app.post('/users/follow/<int:follow_id>')
 def start_following(follow_id):
     """Add a follow for the currently-logged-in user.
 
-    Redirect to following page for the current for the current user.
+    Redirect to following page for the current for the current user, or
+    for the toggles, return the new state and both users' counts.
     """
     #Could rearrange below to check NOT cases before valid cases, for security reasons
     form = g.csrf_form
 
     if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+        return refuse("Access unauthorized.")
 
     if form.validate_on_submit():
+        if follow_id == g.user.id:
+            return refuse("You can't follow yourself.")
+
         followed_user = User.query.get_or_404(follow_id)
-        g.user.following.append(followed_user)
+        abort_if_deleted(followed_user)
+
+        # Following twice (say, a double click) changes nothing
+        if Follow.add(g.user.id, followed_user.id):
+            User.adjust_counts(g.user.id, following_count=1)
+            User.adjust_counts(followed_user.id, followers_count=1)
+            add_follow_to_timeline(g.user.id, followed_user.id)
+
         db.session.commit()
 
+        if wants_json():
+            return jsonify(
+                following=True,
+                users=get_counts_json(g.user.id, followed_user.id),
+            )
+
         return redirect(f"/users/{g.user.id}/following")
     else:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+        return refuse("Access unauthorized.")
 
 @app.post('/users/stop-following/<int:follow_id>')
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user.
 
-    Redirect to following page for the current for the current user.
+    Redirect to following page for the current for the current user, or
+    for the toggles, return the new state and both users' counts.
     """
 
     form = g.csrf_form
 
     if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+        return refuse("Access unauthorized.")
 
     if form.validate_on_submit():
         followed_user = User.query.get_or_404(follow_id)
-        g.user.following.remove(followed_user)
+
+        if Follow.remove(g.user.id, followed_user.id):
+            User.adjust_counts(g.user.id, following_count=-1)
+            User.adjust_counts(followed_user.id, followers_count=-1)
+            remove_follow_from_timeline(g.user.id, followed_user.id)
+
         db.session.commit()
+
+        if wants_json():
+            return jsonify(
+                following=False,
+                users=get_counts_json(g.user.id, followed_user.id),
+            )
+
         return redirect(f"/users/{g.user.id}/following")
     else:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+        return refuse("Access unauthorized.")
 
 
 @app.route('/users/profile', methods=["GET", "POST"])
@@ -263,7 +564,7 @@ def update_profile():
     #Can store g.user in a variable here for better readability/easier to update later
     form = UserUpdateForm(obj=g.user)
     if form.validate_on_submit():
-        if User.authenticate(g.user.username, form.password.data):
+        if g.user.check_password(form.password.data):
             try:
                 g.user.username = form.username.data
                 g.user.email = form.email.data
@@ -273,8 +574,11 @@ def update_profile():
                     form.header_image_url.data or DEFAULT_HEADER_IMAGE_URL
                 )
                 g.user.bio = form.bio.data
+                # Also invalidates their cached message fragments
+                g.user.bump_profile_version()
 
                 db.session.commit()
+                identity_cache.delete(g.user.id)
 
                 return redirect(f'/users/{g.user.id}')
             except IntegrityError:
@@ -303,11 +607,13 @@ def delete_user():
     if form.validate_on_submit():
         do_logout()
 
-        for message in g.user.messages:
-            db.session.delete(message)
-
-        db.session.delete(g.user)
+        # Hide the account right away. Its messages, likes and follows (and
+        # the counts other users keep of them) are removed in the background
+        # by `flask purge-deleted-users`; see account_purge.py.
+        g.user.deleted_at = datetime.utcnow()
+        g.user.bump_profile_version()
         db.session.commit()
+        identity_cache.delete(g.user.id)
 
     return redirect("/signup")
 
@@ -331,7 +637,10 @@ def add_message():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        User.adjust_counts(g.user.id, messages_count=1)
+        fan_out_message(msg)
         db.session.commit()
+        live_updates.publish(msg)
 
         return redirect(f"/users/{g.user.id}")
 
@@ -339,6 +648,8 @@ def add_message():
 
 
 @app.get('/messages/<int:message_id>')
+@replica_reads
+@etag_from(get_message_page_version)
 def show_message(message_id):
     """Show a message."""
 
@@ -346,8 +657,17 @@ def show_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = (Message
+           .query
+           .options(db.joinedload(Message.user, innerjoin=True))
+           .get_or_404(message_id))
+    abort_if_deleted(msg.user)
+
+    return render_template(
+        'messages/show.html',
+        message=msg,
+        liked_message_ids=g.user.get_liked_message_ids([msg]),
+    )
 
 
 @app.post('/messages/<int:message_id>/delete')
@@ -369,8 +689,15 @@ def delete_message(message_id):
     form = g.csrf_form
 
     if form.validate_on_submit():
+        User.adjust_counts(g.user.id, messages_count=-1)
+        User.adjust_counts(
+            db.select(Like.user_liking_id)
+            .where(Like.message_being_liked_id == msg.id),
+            likes_count=-1,
+        )
         db.session.delete(msg)
         db.session.commit()
+        message_fragments.delete(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -379,7 +706,8 @@ def like_message(message_id):
     """Like a message.
 
     Check that the message was not written by the current user.
-    Redirect to liked messages page on success.
+    Redirect to liked messages page on success, or for the toggles, return
+    the new state and the user's counts.
     """
 
     message = Message.query.get_or_404(message_id)
@@ -387,15 +715,20 @@ def like_message(message_id):
     form = g.csrf_form
 
     if not g.user or not form.validate_on_submit():
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+        return refuse("Access unauthorized.")
     elif g.user.id == message.user_id:
-        flash("Don't you think that's a little conceited?", "warning")
-        return redirect("/")
+        return refuse("Don't you think that's a little conceited?", "warning")
     else:
-        g.user.liked_messages.append(message)
+        abort_if_deleted(message.user)
+
+        if Like.add(g.user.id, message.id):
+            User.adjust_counts(g.user.id, likes_count=1)
+
         db.session.commit()
 
+        if wants_json():
+            return jsonify(liked=True, users=get_counts_json(g.user.id))
+
         return redirect(f"/users/{g.user.id}/likes")
 
 @app.post('/messages/<int:message_id>/unlike')
@@ -403,7 +736,8 @@ def unlike_message(message_id):
     """Unlike a message.
 
     Check that the message was not written by the current user.
-    Redirect to liked messages page on success.
+    Redirect to liked messages page on success, or for the toggles, return
+    the new state and the user's counts.
     """
 
     message = Message.query.get_or_404(message_id)
@@ -411,57 +745,278 @@ def unlike_message(message_id):
     form = g.csrf_form
 
     if not g.user or not form.validate_on_submit():
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+        return refuse("Access unauthorized.")
     elif g.user.id == message.user_id:
-        flash("Well... I believe in you tiger.", "danger")
-        return redirect("/")
+        return refuse("Well... I believe in you tiger.")
     else:
-        g.user.liked_messages.remove(message)
+        if Like.remove(g.user.id, message.id):
+            User.adjust_counts(g.user.id, likes_count=-1)
+
         db.session.commit()
 
+        if wants_json():
+            return jsonify(liked=False, users=get_counts_json(g.user.id))
+
         return redirect(f"/users/{g.user.id}/likes")
 
 
 
 
 
+##############################################################################
+# Admin routes:
+
+
+@app.get('/admin/slow-queries')
+def show_slow_queries():
+    """Show the slowest recorded SQL statements, grouped by statement.
+
+    Only for users in ADMIN_USER_IDS.
+    """
+
+    if not g.user or g.user.id not in app.config['ADMIN_USER_IDS']:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    return render_template(
+        'admin/slow_queries.html',
+        summaries=slow_queries.worst(),
+        threshold=app.config['SLOW_QUERY_THRESHOLD'],
+    )
+
+
 ##############################################################################
 # Homepage and error pages
 
 
 @app.get('/')
+@replica_reads
+@etag_from(get_home_timeline_version)
 def homepage():
     """Show homepage:
 
     - anon users: no messages
     - logged in: 100 most recent messages of self & followed_users
+
+    Logged in users can page back with a `before` cursor in the querystring,
+    and `partial` renders just the next chunk of the message list.
     """
 
     if g.user:
+        page_size = app.config['TIMELINE_PAGE_SIZE']
 
-        #Ids of users that logged in user is following
-        followed_user_ids = [user.id for user in g.user.following]
+        try:
+            before = request.args.get('before')
+            before = parse_cursor(before) if before else None
+        except ValueError:
+            abort(400)
 
-        #get all the messages by time stamp
-        messages = (Message
-                            .query
-                            .filter((Message.user_id.in_(followed_user_ids))
-                                        | (Message.user_id == g.user.id))
-                            .order_by(Message.timestamp.desc())
-                            .limit(100)
-                            .all())
+        messages = get_home_timeline(g.user, limit=page_size, before=before)
 
-        return render_template('home.html', messages=messages)
+        next_cursor = (
+            format_cursor(messages[-1]) if len(messages) == page_size else None
+        )
+        liked_message_ids = g.user.get_liked_message_ids(messages)
+
+        if request.args.get('partial'):
+            return render_template(
+                'messages/_timeline_page.html',
+                messages=messages,
+                next_cursor=next_cursor,
+                liked_message_ids=liked_message_ids,
+            )
+
+        html = render_template(
+            'home.html',
+            messages=messages,
+            next_cursor=next_cursor,
+            liked_message_ids=liked_message_ids,
+            live_updates_enabled=live_updates.enabled,
+            # Live updates pick up after the newest message on the page
+            live_cursor=(
+                format_cursor(messages[0]) if messages and not before
+                else None
+            ),
+        )
+
+        # After rendering, since committing expires the user
+        if messages and not before:
+            g.user.mark_timeline_seen(max(message.id for message in messages))
+            db.session.commit()
+
+        return html
 
     else:
         return render_template('home-anon.html')
 
 
+@app.get('/timeline/live')
+def live_timeline():
+    """Stream the logged in user's new home timeline messages, as
+    Server-Sent Events; see live_updates.py.
+
+    Messages newer than the Last-Event-ID header (or, on the first
+    connection, the `after` cursor in the querystring) are replayed first.
+    """
+
+    if not live_updates.enabled:
+        abort(404)
+
+    if not g.user:
+        abort(401)
+
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('after')
+
+    try:
+        cursor = parse_cursor(cursor) if cursor else None
+    except ValueError:
+        abort(400)
+
+    author_ids = {g.user.id, *db.session.scalars(
+        db.select(Follow.user_being_followed_id)
+        .where(Follow.user_following_id == g.user.id)
+    )}
+
+    try:
+        # Subscribe before replaying, so nothing falls in between
+        subscription = live_updates.subscribe(author_ids)
+    except LiveUpdatesBusy:
+        return Response(
+            live_updates.busy_stream(), mimetype="text/event-stream")
+
+    try:
+        missed = (
+            get_home_timeline(
+                g.user,
+                limit=app.config['TIMELINE_PAGE_SIZE'],
+                after=cursor,
+            )
+            if cursor else []
+        )
+    except BaseException:
+        subscription.close()
+        raise
+
+    response = Response(
+        live_updates.stream(
+            subscription,
+            missed=[message_event(message) for message in reversed(missed)],
+        ),
+        mimetype="text/event-stream",
+        # Don't let nginx buffer the stream
+        headers={"X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(subscription.close)
+
+    return response
+
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    """Shed signups and logins while the password hashing pool is full."""
+
+    return (
+        "Warbler is very busy right now, please try again in a moment.",
+        503,
+        {"Retry-After": "1"},
+    )
+
+
+@app.errorhandler(UserGone)
+def user_gone(error):
+    """Log out a user whose account was deleted while their identity was
+    still cached, instead of failing the request."""
+
+    do_logout()
+
+    if request.blueprint == api.name:
+        return jsonify(error="Access unauthorized."), 401
+
+    return refuse("Access unauthorized.")
+
+
 @app.after_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Add caching headers on every request.
+
+    Pages that can be revalidated (static files and views marked with
+    @etag_from) are, and nothing else is stored; see http_caching.py.
+    """
 
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
-    return response
+    return set_cache_policy(response)
+
+
+##############################################################################
+# Maintenance commands
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines_command():
+    """Rebuild every home timeline from the messages and follows tables."""
+
+    rebuild_timelines()
+    db.session.commit()
+
+
+@app.cli.command('reconcile-counts')
+def reconcile_counts_command():
+    """Repair drift in the denormalized user counters."""
+
+    num_repaired = User.reconcile_counts()
+    db.session.commit()
+
+    print(f"Repaired counts for {num_repaired} users")
+
+
+@app.cli.command('purge-deleted-users')
+@click.option('--batch-size', type=int, help="Rows per transaction.")
+@click.option('--watch', type=float, metavar='SECONDS',
+              help="Keep running, checking for deleted accounts this often.")
+def purge_deleted_users_command(batch_size, watch):
+    """Remove deleted accounts and their messages, likes and follows."""
+
+    batch_size = batch_size or app.config['ACCOUNT_PURGE_BATCH_SIZE']
+
+    def report(user_id, step, num_deleted):
+        print(f"User #{user_id}: deleted {num_deleted} {step}")
+
+    while True:
+        num_purged = purge_deleted_users(batch_size, on_progress=report)
+
+        if num_purged or not watch:
+            print(f"Purged {num_purged} deleted accounts")
+
+        if not watch:
+            break
+
+        time.sleep(watch)
+
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """Find queries behind the app's pages that no index supports."""
+
+    # Browse as the busiest user, so every query on each page runs
+    user = db.session.scalars(
+        db.select(User).order_by(
+            (User.messages_count + User.likes_count
+             + User.following_count + User.followers_count).desc())
+    ).first()
+    message = db.session.scalars(db.select(Message)).first()
+
+    if user is None or message is None:
+        raise SystemExit("Seed the database first.")
+
+    unindexed = check_indexes(
+        db, user.id, {'user_id': user.id, 'message_id': message.id})
+
+    for query in unindexed:
+        print(f"{query.endpoint}: scans all of {query.table} for "
+              f"{query.condition}\n    {query.sql}\n")
+
+    if unindexed:
+        raise SystemExit(f"{len(unindexed)} queries need an index")
+
+    print("Every query has an index")
+
@@ -0,0 +1,105 @@
+"""Measure login throughput at different bcrypt costs.
+
+Runs password checks through the same PasswordHasher the app uses, from many
+threads at once as a burst of logins would, and reports logins/sec, latency
+percentiles and how many logins were shed as busy at each cost. Use it to
+pick BCRYPT_LOG_ROUNDS and HASHING_WORKERS for a given machine.
+
+Run from the project root:
+
+    python -m benchmarks.login_throughput --costs 10 11 12 --workers 4
+"""
+
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from flask import Flask
+
+from hashing import PasswordHasher, HashingBusy
+
+PASSWORD = "password"
+
+
+def percentile(sorted_values, pct):
+    """Get the `pct` percentile of some already sorted values."""
+
+    if not sorted_values:
+        return 0
+
+    index = round(pct / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+def run_cost(cost, workers, max_pending, concurrency, logins):
+    """Time `logins` password checks at bcrypt `cost`, `concurrency` at a
+    time. Returns a dict of results."""
+
+    app = Flask(__name__)
+    app.config['BCRYPT_LOG_ROUNDS'] = cost
+    app.config['HASHING_WORKERS'] = workers
+    app.config['HASHING_MAX_PENDING'] = max_pending
+    hasher = PasswordHasher(app)
+
+    pw_hash = hasher.hash(PASSWORD)
+
+    def login():
+        start = perf_counter()
+        try:
+            hasher.check(pw_hash, PASSWORD)
+        except HashingBusy:
+            return None
+        return perf_counter() - start
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        results = list(threads.map(lambda _: login(), range(logins)))
+    elapsed = perf_counter() - start
+
+    hasher.shutdown()
+
+    latencies = sorted(result for result in results if result is not None)
+
+    return {
+        "cost": cost,
+        "logins_per_sec": len(latencies) / elapsed,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "shed": results.count(None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--costs", type=int, nargs="+", default=[10, 11, 12])
+    parser.add_argument("--workers", type=int, default=2,
+                        help="hashing processes (0 hashes in each thread)")
+    parser.add_argument("--max-pending", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="logins in flight at once")
+    parser.add_argument("--logins", type=int, default=200,
+                        help="logins to time at each cost")
+    args = parser.parse_args()
+
+    print(f"{'cost':>4} {'logins/s':>9} {'mean ms':>8} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'shed':>5}")
+
+    for cost in args.costs:
+        result = run_cost(
+            cost,
+            workers=args.workers,
+            max_pending=args.max_pending,
+            concurrency=args.concurrency,
+            logins=args.logins,
+        )
+        print(f"{result['cost']:>4} {result['logins_per_sec']:>9.1f} "
+              f"{result['mean_ms']:>8.1f} {result['p50_ms']:>8.1f} "
+              f"{result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result['shed']:>5}")
+
+
+if __name__ == "__main__":
+    main()
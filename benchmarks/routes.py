@@ -0,0 +1,392 @@
+"""Measure latency, throughput and SQL queries for Warbler's main routes.
+
+Drives the app in-process through the Flask test client, or over HTTP
+against a running server (e.g. gunicorn) with --url, and reports p50/p95/p99
+latency, requests/sec and SQL queries per request for each route. Query
+counts are only available in-process.
+
+Results can be saved as JSON and compared against a saved baseline; the run
+exits non-zero if any route got slower or runs more queries than it did.
+
+Run from the project root, against a database you don't mind reseeding:
+
+    DATABASE_URL=postgresql:///warbler_bench \\
+        python -m benchmarks.routes --seed-tier small --out baseline.json
+
+    DATABASE_URL=postgresql:///warbler_bench \\
+        python -m benchmarks.routes --baseline baseline.json
+
+    gunicorn app:app &
+    DATABASE_URL=postgresql:///warbler_bench \\
+        python -m benchmarks.routes --url http://localhost:8000
+"""
+
+import argparse
+import json
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from time import perf_counter
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import (HTTPCookieProcessor, HTTPRedirectHandler,
+                            build_opener)
+
+from sqlalchemy import event
+
+from benchmarks.login_throughput import percentile
+
+BENCH_USERNAME = "benchmark"
+BENCH_PASSWORD = "password"
+
+# How many users the benchmark user follows, so it has a home timeline
+NUM_FOLLOWING = 50
+
+# A route to time. `path` is called with (rng, ids) to pick the URL for
+# each request. `undo`, if given, is an untimed request made afterwards to
+# put things back, so every timed request does the same work.
+Route = namedtuple('Route', ['name', 'method', 'path', 'undo'])
+
+ROUTES = [
+    Route("home", "GET", lambda rng, ids: "/", None),
+    Route("users", "GET", lambda rng, ids: "/users", None),
+    Route("user", "GET",
+          lambda rng, ids: f"/users/{rng.choice(ids.users)}", None),
+    Route("user_likes", "GET",
+          lambda rng, ids: f"/users/{rng.choice(ids.users)}/likes", None),
+    Route("message", "GET",
+          lambda rng, ids: f"/messages/{rng.choice(ids.messages)}", None),
+    Route("login", "POST", lambda rng, ids: "/login", None),
+    Route("follow", "POST",
+          lambda rng, ids: f"/users/follow/{rng.choice(ids.not_following)}",
+          lambda path: path.replace("/follow/", "/stop-following/")),
+    Route("like", "POST",
+          lambda rng, ids: f"/messages/{rng.choice(ids.messages)}/like",
+          lambda path: path.replace("/like", "/unlike")),
+]
+
+# Ids to pick request targets from
+Ids = namedtuple('Ids', ['users', 'messages', 'not_following'])
+
+
+def seed_tier(tier, seed):
+    """Generate a dataset tier and bulk load it into the database."""
+
+    from seed import bulk_seed
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        subprocess.run(
+            [sys.executable, "generator/create_csvs.py",
+             "--tier", tier, "--seed", seed, "--out", data_dir],
+            check=True,
+        )
+        bulk_seed(data_dir, chunk_size=50_000)
+
+
+def set_up_bench_user(rng):
+    """Get the benchmark user (made on the first run) following some random
+    users, and the ids for requests to target.
+
+    The last run's follows are undone the way the app does it, so everyone's
+    follower counts stay right however many times this is run.
+    """
+
+    from models import db, Follow, User, Message
+    from timeline import add_follow_to_timeline, remove_follow_from_timeline
+
+    bench_user = User.query.filter_by(username=BENCH_USERNAME).one_or_none()
+
+    if bench_user is None:
+        bench_user = User.signup(
+            BENCH_USERNAME, "benchmark@example.org", BENCH_PASSWORD, None)
+        db.session.flush()
+
+    followed_ids = db.session.scalars(
+        db.select(Follow.user_being_followed_id)
+        .where(Follow.user_following_id == bench_user.id)).all()
+
+    for user_id in followed_ids:
+        if Follow.remove(bench_user.id, user_id):
+            User.adjust_counts(bench_user.id, following_count=-1)
+            User.adjust_counts(user_id, followers_count=-1)
+            remove_follow_from_timeline(bench_user.id, user_id)
+
+    user_ids = db.session.scalars(
+        db.select(User.id).where(User.id != bench_user.id)).all()
+    message_ids = db.session.scalars(db.select(Message.id)).all()
+
+    following = rng.sample(user_ids, min(NUM_FOLLOWING, len(user_ids)))
+    for user_id in following:
+        if Follow.add(bench_user.id, user_id):
+            User.adjust_counts(bench_user.id, following_count=1)
+            User.adjust_counts(user_id, followers_count=1)
+            add_follow_to_timeline(bench_user.id, user_id)
+
+    db.session.commit()
+
+    following = set(following)
+    not_following = [
+        user_id for user_id in user_ids if user_id not in following]
+
+    return bench_user.id, Ids(user_ids, message_ids, not_following)
+
+
+class InProcessClient:
+    """Makes requests through the Flask test client, counting the SQL
+    each one runs."""
+
+    _counts = threading.local()
+
+    def __init__(self, app, user_id):
+        from app import CURR_USER_KEY
+
+        self.client = app.test_client()
+
+        if user_id is not None:
+            with self.client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+    @classmethod
+    def count_queries(cls, engine):
+        def count_statement(conn, cursor, statement, *args):
+            cls._counts.queries = getattr(cls._counts, 'queries', 0) + 1
+
+        event.listen(engine, "before_cursor_execute", count_statement)
+
+    def request(self, method, path, data=None):
+        """Make a request; returns (status, SQL queries run)."""
+
+        self._counts.queries = 0
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, self._counts.queries
+
+
+class _NoRedirects(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    """Makes requests to a running server, logged in as a real session."""
+
+    def __init__(self, base_url, username):
+        self.base_url = base_url.rstrip("/")
+        self.opener = build_opener(
+            HTTPCookieProcessor(CookieJar()), _NoRedirects())
+
+        # Every form shares the session's CSRF token
+        login_page = self._open("GET", "/login")[1]
+        self.csrf_token = re.search(
+            r'name="csrf_token"[^>]*value="([^"]+)"', login_page).group(1)
+
+        if username is not None:
+            self.request("POST", "/login", login_data(username))
+
+    def _open(self, method, path, data=None):
+        body = urlencode(data).encode() if data is not None else None
+
+        try:
+            with self.opener.open(self.base_url + path, body) as response:
+                return response.status, response.read().decode()
+        except HTTPError as error:
+            return error.code, ""
+
+    def request(self, method, path, data=None):
+        """Make a request; returns (status, None), as SQL can't be counted
+        from out here."""
+
+        if method == "POST":
+            data = {**(data or {}), "csrf_token": self.csrf_token}
+
+        return self._open(method, path, data)[0], None
+
+
+def login_data(username):
+    return {"username": username, "password": BENCH_PASSWORD}
+
+
+def run_route(route, make_client, ids, requests, concurrency, seed):
+    """Time `requests` requests to a route, `concurrency` at a time.
+    Returns a dict of results."""
+
+    def worker(worker_num):
+        rng = random.Random(f"{seed}:{route.name}:{worker_num}")
+        client = make_client(logged_in=route.name != "login")
+        results = []
+
+        for _ in range(requests // concurrency):
+            path = route.path(rng, ids)
+            data = login_data(BENCH_USERNAME) if route.name == "login" else None
+
+            start = perf_counter()
+            status, queries = client.request(route.method, path, data)
+            results.append((perf_counter() - start, status, queries))
+
+            if route.undo:
+                client.request(route.method, route.undo(path))
+
+        return results
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        results = [
+            result
+            for worker_results in threads.map(worker, range(concurrency))
+            for result in worker_results
+        ]
+    elapsed = perf_counter() - start
+
+    latencies = sorted(latency for latency, _, _ in results)
+    queries = [queries for _, _, queries in results if queries is not None]
+
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, status, _ in results if status >= 400),
+        "requests_per_sec": len(results) / elapsed,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "queries_mean": statistics.mean(queries) if queries else None,
+        "queries_max": max(queries) if queries else None,
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compare results against a baseline. Returns a list of messages for
+    routes that got slower by more than `tolerance` (a fraction) at p95, or
+    that run more queries."""
+
+    regressions = []
+
+    for name, old in baseline["routes"].items():
+        new = results["routes"].get(name)
+
+        if new is None:
+            continue
+
+        if new["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {old['p95_ms']:.1f}ms -> {new['p95_ms']:.1f}ms")
+
+        if (new["queries_max"] is not None and old["queries_max"] is not None
+                and new["queries_max"] > old["queries_max"]):
+            regressions.append(
+                f"{name}: queries {old['queries_max']} -> "
+                f"{new['queries_max']}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seed-tier",
+                        help="reseed the database with this generator tier "
+                             "first (destroys what's there)")
+    parser.add_argument("--seed", default="0",
+                        help="seed for the dataset and request targets")
+    parser.add_argument("--url",
+                        help="benchmark a running server instead of "
+                             "in-process")
+    parser.add_argument("--routes", nargs="+",
+                        choices=[route.name for route in ROUTES],
+                        help="routes to run (default: all)")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="timed requests per route")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="untimed requests per route first")
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed p95 slowdown vs the baseline "
+                             "(default: 0.2, i.e. 20%%)")
+    args = parser.parse_args()
+
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.engine.echo = False
+
+        if args.seed_tier:
+            seed_tier(args.seed_tier, args.seed)
+
+        bench_user_id, ids = set_up_bench_user(random.Random(args.seed))
+
+        if args.url:
+            def make_client(logged_in):
+                return HTTPClient(
+                    args.url, BENCH_USERNAME if logged_in else None)
+        else:
+            app.config['WTF_CSRF_ENABLED'] = False
+            app.config['DEBUG_TB_ENABLED'] = False
+            InProcessClient.count_queries(db.engine)
+
+            def make_client(logged_in):
+                return InProcessClient(
+                    app, bench_user_id if logged_in else None)
+
+        routes = [
+            route for route in ROUTES
+            if not args.routes or route.name in args.routes
+        ]
+
+        results = {
+            "mode": "http" if args.url else "in-process",
+            "seed_tier": args.seed_tier,
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "routes": {},
+        }
+
+        print(f"{'route':<11} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'queries':>7} {'errors':>6}")
+
+        for route in routes:
+            if args.warmup:
+                run_route(route, make_client, ids, args.warmup, 1, "warmup")
+
+            result = run_route(
+                route, make_client, ids,
+                requests=args.requests,
+                concurrency=args.concurrency,
+                seed=args.seed,
+            )
+            results["routes"][route.name] = result
+
+            queries = result["queries_max"]
+            print(f"{route.name:<11} {result['requests_per_sec']:>8.1f} "
+                  f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                  f"{result['p99_ms']:>8.1f} "
+                  f"{'-' if queries is None else queries:>7} "
+                  f"{result['errors']:>6}")
+
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(results, out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = find_regressions(results, baseline, args.tolerance)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Small in-process caches for Warbler."""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class TTLCache:
+    """A thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Holds at most `maxsize` entries; adding one more evicts the least
+    recently used. Each worker process has its own copy, so anything cached
+    here can be up to `ttl` seconds stale with respect to other workers.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """Get the live value for `key`, or `default`."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return default
+
+            value, expires_at = entry
+
+            if expires_at <= monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting the oldest entry if full."""
+
+        with self._lock:
+            self._entries[key] = (value, monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Drop `key` from the cache, if it is there."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop everything."""
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
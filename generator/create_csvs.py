@@ -3,87 +3,301 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Datasets come in size tiers and are the same for the same --seed, so
+benchmarks can be rerun against identical data:
+
+    python generator/create_csvs.py --tier medium --seed 1 --out /tmp/medium
+
+Follower counts, posting and likes are all heavy-tailed: a few users have
+most of the followers, and a few messages get most of the likes. Rows are
+generated in fixed-size chunks across a pool of processes and streamed to
+disk, so memory use stays flat even for the largest tier.
+
+Everything works offline. Header images come from the Unsplash API only if
+UNSPLASH_CID is set (which also makes the output depend on what Unsplash
+returns).
 """
 
+import argparse
+import csv
 import os
-from dotenv import load_dotenv
+import random
+import shutil
+from collections import namedtuple
+from datetime import datetime
+from math import gcd
+from multiprocessing import Pool
 
-import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+from dotenv import load_dotenv
 from faker import Faker
-from helpers import get_random_datetime
 
-load_dotenv()
-
-UNSPLASH_CID = os.environ['UNSPLASH_CID']
+from helpers import get_random_datetime, heavy_tailed_count, zipf_rank
 
 MAX_WARBLER_LENGTH = 140
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_liking_id', 'message_being_liked_id']
+
+Tier = namedtuple(
+    'Tier',
+    ['users', 'messages_per_user', 'follows_per_user', 'likes_per_user'],
+)
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+TIERS = {
+    'sample': Tier(300, 3, 16, 5),
+    'small': Tier(1_000, 10, 20, 20),
+    'medium': Tier(100_000, 10, 20, 20),
+    'large': Tier(10_000_000, 10, 20, 20),
+}
 
-fake = Faker()
+# Rows generated by each task in the pool. Chunk boundaries (and so the
+# output) don't depend on how many processes there are.
+CHUNK_SIZE = 10_000
 
-# Generate random profile image URLs to use for users
+# How skewed popularity is: rank r is picked about r ** -exponent as often
+# as rank 1
+FOLLOW_EXPONENT = 0.8
+POSTING_EXPONENT = 0.6
+LIKE_EXPONENT = 0.8
 
-image_urls = [
+# Every generated timestamp is in the two years before this
+END_DATETIME = datetime(2024, 1, 1)
+
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Random profile image URLs to use for users
+
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-# NOTE: You will need to create a dev account at unsplash.com, 
-# generate an access key and set that to an environment
-# variable to successfully ping the API. 
+# Same as DEFAULT_HEADER_IMAGE_URL in models.py
+
+FALLBACK_HEADER_IMAGE_URLS = [
+    "https://images.unsplash.com/photo-1519751138087-5bf79df62d5b?ixlib="
+    "rb-4.0.3&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=for"
+    "mat&fit=crop&w=2070&q=80"
+]
+
+
+def get_header_image_urls():
+    """Get header image URLs from Unsplash, or the fallback without a key.
+
+    NOTE: To use Unsplash, you will need to create a dev account at
+    unsplash.com, generate an access key and set that to the UNSPLASH_CID
+    environment variable.
+    """
+
+    unsplash_cid = os.environ.get('UNSPLASH_CID')
+
+    if not unsplash_cid:
+        return FALLBACK_HEADER_IMAGE_URLS
+
+    import requests
+
+    photos = requests.get(
+        "https://api.unsplash.com/topics/wallpapers/photos"
+        f"?per_page=30&orientation=landscape&client_id={unsplash_cid}"
+    ).json()
+
+    return [photo['urls']['regular'] for photo in photos]
+
+
+def scrambler(n):
+    """Get a function mapping popularity ranks 1..n onto ids 1..n.
+
+    Without this the most popular users would be the first ids. Ranks are
+    stepped through by about n / golden ratio, so neighbouring ranks land
+    far apart; it's a bijection since the step shares no factors with n.
+    (A fixed multiplier can be small mod n, which just spaces the popular
+    ids out a little from the first ones.)
+    """
+
+    multiplier = int(n * 0.618) | 1
+
+    while gcd(multiplier, n) != 1:
+        multiplier += 2
+
+    return lambda rank: rank * multiplier % n + 1
+
+
+def pick_distinct(rng, count, pick, exclude=None):
+    """Pick `count` distinct values by calling pick(), skipping `exclude`.
+
+    Gives up after a few tries per value, since a small dataset might not
+    have `count` values to go around.
+    """
+
+    picked = set()
+
+    for _ in range(count * 4):
+        if len(picked) == count:
+            break
+
+        value = pick()
+
+        if value != exclude:
+            picked.add(value)
+
+    return picked
+
 
-header_image_urls = [
-    requests.get(
-        "https://api.unsplash.com/topics/wallpapers/photos" \
-        f"?per_page=30&orientation=landscape&client_id={UNSPLASH_CID}"
-    ).json()[i]['urls']['regular'] for i in range(0,29)
+def users_rows(rng, fake, tier, start, stop, header_image_urls):
+    for user_id in range(start, stop):
+        # Faker repeats usernames, and they must be unique
+        username = f"{fake.user_name()}{user_id}"
+
+        yield [
+            f"{username}@example.org",
+            username,
+            rng.choice(IMAGE_URLS),
+            PASSWORD_HASH,
+            fake.sentence(),
+            rng.choice(header_image_urls),
+            fake.city(),
+        ]
+
+
+def messages_rows(rng, fake, tier, start, stop, header_image_urls):
+    author_id = scrambler(tier.users)
+
+    for _ in range(start, stop):
+        yield [
+            fake.paragraph()[:MAX_WARBLER_LENGTH],
+            get_random_datetime(rng=rng, now=END_DATETIME),
+            author_id(zipf_rank(rng, tier.users, POSTING_EXPONENT)),
+        ]
+
+
+def follows_rows(rng, fake, tier, start, stop, header_image_urls):
+    # Popular posters tend to be popular to follow too
+    followed_id = scrambler(tier.users)
+
+    for follower_id in range(start, stop):
+        num_following = min(
+            heavy_tailed_count(rng, tier.follows_per_user), tier.users - 1)
+
+        followed_ids = pick_distinct(
+            rng,
+            num_following,
+            lambda: followed_id(zipf_rank(rng, tier.users, FOLLOW_EXPONENT)),
+            exclude=follower_id,
+        )
+
+        for user_id in sorted(followed_ids):
+            yield [user_id, follower_id]
+
+
+def likes_rows(rng, fake, tier, start, stop, header_image_urls):
+    num_messages = tier.users * tier.messages_per_user
+    message_id = scrambler(num_messages)
+
+    for user_id in range(start, stop):
+        num_likes = min(
+            heavy_tailed_count(rng, tier.likes_per_user), num_messages)
+
+        liked_ids = pick_distinct(
+            rng,
+            num_likes,
+            lambda: message_id(zipf_rank(rng, num_messages, LIKE_EXPONENT)),
+        )
+
+        for liked_id in sorted(liked_ids):
+            yield [user_id, liked_id]
+
+
+# (filename, headers, row generator, rows to chunk up) for each CSV. Follows
+# and likes are chunked by user, so they have a row count per user rather
+# than an exact total.
+CSVS = [
+    ('users.csv', USERS_CSV_HEADERS, users_rows,
+     lambda tier: tier.users),
+    ('messages.csv', MESSAGES_CSV_HEADERS, messages_rows,
+     lambda tier: tier.users * tier.messages_per_user),
+    ('follows.csv', FOLLOWS_CSV_HEADERS, follows_rows,
+     lambda tier: tier.users),
+    ('likes.csv', LIKES_CSV_HEADERS, likes_rows,
+     lambda tier: tier.users),
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+def part_path(out_dir, filename, chunk):
+    return os.path.join(out_dir, f"{filename}.part{chunk:06d}")
+
+
+def write_chunk(task):
+    """Write one chunk of one CSV to its own part file (in a pool process).
+
+    Each chunk gets its own seeded random number generators, so it comes out
+    the same whichever process runs it.
+    """
+
+    seed, tier, out_dir, csv_index, chunk, header_image_urls = task
+    filename, _, make_rows, num_rows = CSVS[csv_index]
+
+    chunk_seed = f"{seed}:{filename}:{chunk}"
+    rng = random.Random(chunk_seed)
+    fake = Faker()
+    fake.seed_instance(chunk_seed)
+
+    # Ids start at 1, like the database's
+    start = chunk * CHUNK_SIZE + 1
+    stop = min(start + CHUNK_SIZE, num_rows(tier) + 1)
+
+    with open(part_path(out_dir, filename, chunk), 'w', newline='') as part:
+        csv.writer(part).writerows(
+            make_rows(rng, fake, tier, start, stop, header_image_urls))
+
+
+def generate(tier, seed, out_dir, processes=None):
+    """Write users/messages/follows/likes CSVs for a tier to `out_dir`."""
+
+    os.makedirs(out_dir, exist_ok=True)
+    header_image_urls = get_header_image_urls()
+
+    tasks = [
+        (seed, tier, out_dir, csv_index, chunk, header_image_urls)
+        for csv_index, (_, _, _, num_rows) in enumerate(CSVS)
+        for chunk in range(-(-num_rows(tier) // CHUNK_SIZE))
+    ]
+
+    with Pool(processes) as pool:
+        for done, _ in enumerate(pool.imap_unordered(write_chunk, tasks), 1):
+            print(f"\r{done}/{len(tasks)} chunks", end="", flush=True)
+
+    print()
+
+    # Stitch the parts together in order
+    for filename, headers, _, num_rows in CSVS:
+        with open(os.path.join(out_dir, filename), 'w', newline='') as out:
+            csv.writer(out).writerow(headers)
+
+            for chunk in range(-(-num_rows(tier) // CHUNK_SIZE)):
+                path = part_path(out_dir, filename, chunk)
+
+                with open(path, newline='') as part:
+                    shutil.copyfileobj(part, out)
+
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Generate Warbler CSVs.")
+    parser.add_argument("--tier", choices=TIERS, default="sample",
+                        help="dataset size (default: sample)")
+    parser.add_argument("--seed", default="0",
+                        help="same seed, same data (default: 0)")
+    parser.add_argument("--out", default=os.path.dirname(__file__) or ".",
+                        help="directory to write the CSVs to")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="pool size (default: one per CPU)")
+    args = parser.parse_args()
+
+    generate(TIERS[args.tier], args.seed, args.out, args.processes)
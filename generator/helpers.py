@@ -1,14 +1,43 @@
 """Support functions for CSV generation."""
 
+import random
 from datetime import datetime
-from random import uniform
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, rng=random, now=None):
+    """Get a random datetime within the last few years.
 
-    now = datetime.now()
+    Pass a seeded `rng` and a fixed `now` to get the same datetimes on every
+    run.
+    """
+
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    random_timestamp = rng.uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def zipf_rank(rng, n, exponent):
+    """Pick a rank from 1 to n, with rank r about r ** -exponent as likely.
+
+    Uses the inverse CDF of the continuous version of the distribution, so it
+    takes constant time and memory however big n is. `exponent` must not
+    be 1.
+    """
+
+    span = (n + 1) ** (1 - exponent) - 1
+    rank = (span * rng.random() + 1) ** (1 / (1 - exponent))
+
+    return min(int(rank), n)
+
+
+def heavy_tailed_count(rng, mean, alpha=2.0):
+    """Pick a count from a Pareto distribution with the given mean.
+
+    Most picks land a little under the mean, and a few land far above it.
+    """
+
+    scale = mean * (alpha - 1) / alpha
+
+    return int(scale * rng.paretovariate(alpha))
@@ -0,0 +1,157 @@
+"""Password hashing off the request workers for Warbler.
+
+bcrypt is deliberately slow, so a burst of logins hashing in the request
+workers ties all of them up. PasswordHasher runs the hashing in a small pool
+of worker processes instead, and bounds how much work can be waiting for
+that pool: past the bound, new logins fail fast with HashingBusy rather
+than queueing behind everyone else.
+
+This module only imports bcrypt, so the pool's processes start quickly.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+
+
+class HashingBusy(Exception):
+    """Too many passwords are already waiting to be hashed."""
+
+
+def _hash_password(password, rounds):
+    """Hash a password with bcrypt at `rounds` cost."""
+
+    return bcrypt.hashpw(
+        password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(pw_hash, password):
+    """Does `password` match this bcrypt hash?"""
+
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+class PasswordHasher:
+    """Hashes and checks bcrypt passwords in a bounded process pool.
+
+    Configured from the app by init_app():
+
+    - BCRYPT_LOG_ROUNDS: the bcrypt cost for new hashes
+    - HASHING_WORKERS: processes in the pool; 0 hashes in the calling
+      thread instead
+    - HASHING_MAX_PENDING: hashes that can be running or queued at once
+    - HASHING_QUEUE_TIMEOUT: seconds to wait for room in the queue before
+      raising HashingBusy
+    """
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.max_workers = 0
+        self.queue_timeout = 0
+
+        self._slots = None
+        self._executor = None
+        self._executor_lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('HASHING_WORKERS', 2)
+        app.config.setdefault('HASHING_MAX_PENDING', 32)
+        app.config.setdefault('HASHING_QUEUE_TIMEOUT', 0.5)
+
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.max_workers = app.config['HASHING_WORKERS']
+        self.queue_timeout = app.config['HASHING_QUEUE_TIMEOUT']
+        self._slots = BoundedSemaphore(app.config['HASHING_MAX_PENDING'])
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # Spawn rather than fork, so the pool doesn't inherit the
+                # parent's database connections and threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+
+            return self._executor
+
+    def _discard_executor(self, executor):
+        """Drop a broken pool, so the next hash starts a new one."""
+
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+
+        executor.shutdown(wait=False)
+
+    def _run(self, fn, *args):
+        """Run `fn` in the pool and wait for its result.
+
+        Raises HashingBusy if the pool is too backed up to take it. A pool
+        that lost a process (killed, or out of memory) can't be used again,
+        so it's replaced and `fn` is tried once more in the new one.
+        """
+
+        if not self.max_workers:
+            return fn(*args)
+
+        for attempt in range(2):
+            executor = self._get_executor()
+
+            try:
+                return self._submit(executor, fn, *args)
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+
+        raise HashingBusy()
+
+    def _submit(self, executor, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HashingBusy()
+
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda future: self._slots.release())
+
+        return future.result()
+
+    def hash(self, password):
+        """Hash a password at the configured cost."""
+
+        if not password:
+            raise ValueError("Password must be non-empty.")
+
+        return self._run(_hash_password, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        if not password:
+            return False
+
+        return self._run(_check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was this hash made at a different cost than is configured now?"""
+
+        # bcrypt hashes look like $2b$<cost>$<salt and hash>
+        return int(pw_hash.split('$')[2]) != self.rounds
+
+    def shutdown(self):
+        """Stop the pool's processes."""
+
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
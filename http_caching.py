@@ -0,0 +1,136 @@
+"""HTTP caching policy for Warbler.
+
+Responses are `no-store` unless they carry a validator:
+
+- static files get Flask's ETag and Last-Modified, and are public but
+  revalidated on every use (`no-cache`)
+- views marked with @etag_from answer conditional GETs. The ETag is made
+  from a cheap version stamp, such as the version of each user the page
+  shows, so an unchanged page is a 304 without rendering its template or
+  running its queries. These pages are per user, so they're `private`.
+  The version stamps for the pages are below.
+
+Pages embed CSRF tokens, which expire, so ETags also change every
+ETAG_MAX_AGE seconds; keep it under WTF_CSRF_TIME_LIMIT.
+"""
+
+import time
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from werkzeug.http import generate_etag
+
+from models import db, Follow, Message, User
+
+
+def etag_from(get_version):
+    """Make a view answer conditional GETs with an ETag from `get_version`.
+
+    `get_version` is called with the view's arguments and returns a tuple
+    that changes whenever the page would, or None to just run the view (for
+    instance, to let it 404). Only logged in users' pages without a pending
+    flash message are revalidated; everything else runs the view as usual.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # A pending flash would be shown once and then 304'd forever
+            if not g.user or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            version = get_version(*args, **kwargs)
+
+            if version is None:
+                return view(*args, **kwargs)
+
+            etag = generate_etag(repr((
+                request.endpoint,
+                g.user.id,
+                int(time.time() // current_app.config['ETAG_MAX_AGE']),
+                *version,
+            )).encode())
+
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def set_cache_policy(response):
+    """Set Cache-Control on `response`, by whether it has a validator."""
+
+    if request.endpoint == 'static':
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+
+    elif response.get_etag()[0] is not None:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+
+    else:
+        response.cache_control.no_store = True
+
+    return response
+
+
+def get_user_page_version(user_id):
+    """Version stamp for a page about `user_id`, as the logged in user
+    sees it: both users' versions. None if there's no such user."""
+
+    versions = {
+        id: (version, deleted_at)
+        for id, version, deleted_at in db.session.execute(
+            db.select(User.id, User.version, User.deleted_at)
+            .where(User.id.in_([g.user.id, user_id]))
+        )
+    }
+
+    if user_id not in versions or versions[user_id][1] is not None:
+        return None
+
+    return versions[g.user.id][0], versions[user_id][0]
+
+
+def get_message_page_version(message_id):
+    """Version stamp for a message's page. Messages can't be edited, so
+    the page only changes with its author and the logged in user."""
+
+    author = db.aliased(User)
+
+    row = db.session.execute(
+        db.select(User.version, author.version, author.deleted_at)
+        .select_from(Message)
+        .join(author, author.id == Message.user_id)
+        .join(User, User.id == g.user.id)
+        .where(Message.id == message_id)
+    ).one_or_none()
+
+    if row is None or row.deleted_at is not None:
+        return None
+
+    return row[0], row[1]
+
+
+def get_home_timeline_version():
+    """Version stamp for the logged in user's home timeline: their own
+    version, and the sum of the versions of the users they follow (which
+    changes when any of them posts or deletes a message)."""
+
+    followed_versions = db.session.scalar(
+        db.select(db.func.coalesce(db.func.sum(User.version), 0))
+        .select_from(Follow)
+        .join(User, User.id == Follow.user_being_followed_id)
+        .where(Follow.user_following_id == g.user.id)
+    )
+
+    return g.user.version, followed_versions
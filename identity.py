@@ -0,0 +1,97 @@
+"""Lazy, cached loading of the logged in user for Warbler."""
+
+from models import db, User
+
+# The User fields every page needs (mostly for the navbar), which are
+# served from the identity cache without loading the user
+IDENTITY_FIELDS = ('id', 'username', 'image_url', 'header_image_url')
+
+
+class UserGone(Exception):
+    """The logged in user turned out to be deleted partway through a
+    request, after their cached identity said they were logged in."""
+
+
+class CurrentUser:
+    """Stand-in for the logged in User on `g.user`.
+
+    Nothing is loaded until the user is used. The fields in IDENTITY_FIELDS
+    come from `identity_cache` when they can; anything else loads the User
+    from the database (once per request) and is passed through to it, so
+    this can be used anywhere the User itself would be.
+
+    Evaluates false if the user no longer exists or has deleted their
+    account. The cache is per worker, so it can still say they exist for a
+    while after another worker deletes them; using anything else of theirs
+    then drops them from the cache and raises UserGone.
+    """
+
+    def __init__(self, user_id, identity_cache):
+        object.__setattr__(self, '_user_id', user_id)
+        object.__setattr__(self, '_identity_cache', identity_cache)
+        object.__setattr__(self, '_user', None)
+        object.__setattr__(self, '_gone', False)
+
+    def load(self):
+        """Get the User itself, loading it on first use. None if the user
+        doesn't exist or their account has been deleted."""
+
+        if self._user is None:
+            user = db.session.get(User, self._user_id)
+
+            if user is not None and user.deleted_at is None:
+                object.__setattr__(self, '_user', user)
+
+        return self._user
+
+    def _get_identity(self):
+        """Get the cached identity fields, loading and caching them on a
+        miss. None if the user doesn't exist."""
+
+        identity = self._identity_cache.get(self._user_id)
+
+        if identity is None:
+            user = self.load()
+
+            if user is None:
+                return None
+
+            identity = {field: getattr(user, field)
+                        for field in IDENTITY_FIELDS}
+            self._identity_cache.set(self._user_id, identity)
+
+        return identity
+
+    @property
+    def id(self):
+        return self._user_id
+
+    def _load_or_raise(self):
+        user = self.load()
+
+        if user is None:
+            self._identity_cache.delete(self._user_id)
+            object.__setattr__(self, '_gone', True)
+            raise UserGone()
+
+        return user
+
+    def __bool__(self):
+        return not self._gone and self._get_identity() is not None
+
+    def __getattr__(self, name):
+        # Once the User is loaded it is the freshest copy, so stop using
+        # the cache
+        if name in IDENTITY_FIELDS and self._user is None:
+            identity = self._get_identity()
+
+            if identity is not None:
+                return identity[name]
+
+        return getattr(self._load_or_raise(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load_or_raise(), name, value)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self._user_id}>"
@@ -0,0 +1,165 @@
+"""Find app queries that no index supports.
+
+Requests every GET page of the app, as a real user, and collects the
+SELECTs each one runs. Each distinct statement is then EXPLAINed with
+sequential scans and hash and merge joins turned off, so PostgreSQL uses an
+index wherever one can serve. Any scan still reading all of a table (or all
+of an index that doesn't lead with the column it's looking for) needs an
+index. Run it against a seeded database with:
+
+    flask check-indexes
+"""
+
+import re
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import event
+
+from slow_queries import normalize_sql
+
+# Pages that aren't part of the app proper
+SKIPPED_ENDPOINTS = {'static', 'metrics', 'show_slow_queries'}
+
+# A statement that needs an index
+UnindexedQuery = namedtuple(
+    'UnindexedQuery', ['endpoint', 'table', 'condition', 'sql'])
+
+
+def get_page_urls(app, url_args):
+    """Get (endpoint, url) for every GET page, filling in its URL args from
+    `url_args`. Pages with args not in `url_args` are skipped."""
+
+    urls = []
+
+    for rule in app.url_map.iter_rules():
+        if ('GET' not in rule.methods
+                or rule.endpoint in SKIPPED_ENDPOINTS
+                or not rule.arguments <= url_args.keys()):
+            continue
+
+        args = {name: url_args[name] for name in rule.arguments}
+        urls.append((rule.endpoint, rule.build(args)[1]))
+
+    return sorted(urls)
+
+
+def collect_queries(app, db, user_id, urls):
+    """Request each page logged in as `user_id`, and get the SELECTs they
+    ran, as {normalized sql: (endpoint, statement, parameters)}."""
+
+    from app import CURR_USER_KEY
+
+    queries = {}
+    current = {}
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        sql = normalize_sql(statement)
+
+        if sql.upper().startswith("SELECT") and sql not in queries:
+            queries[sql] = (current['endpoint'], statement, parameters)
+
+    event.listen(db.engine, "before_cursor_execute", collect)
+
+    try:
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            for endpoint, url in urls:
+                current['endpoint'] = endpoint
+                # Closed, so streamed pages stop streaming
+                client.get(url).close()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", collect)
+
+    return queries
+
+
+def _get_index_leads(conn):
+    """Get {index name: (table, first column)} for the database's indexes.
+
+    Indexes that lead with an expression are left out.
+    """
+
+    return {
+        index: (table, column)
+        for index, table, column in conn.exec_driver_sql("""
+            SELECT index_class.relname, table_class.relname, attname
+            FROM pg_index
+            JOIN pg_class AS index_class ON index_class.oid = indexrelid
+            JOIN pg_class AS table_class ON table_class.oid = indrelid
+            JOIN pg_attribute
+                ON attrelid = indrelid AND attnum = indkey[0]
+        """)
+    }
+
+
+def _full_scans(plan, index_leads):
+    """Yield (table, condition) for each scan in a JSON plan that reads all
+    of a table or index to find its rows.
+
+    That's a sequential scan with a filter, or an index scan whose condition
+    doesn't include the index's first column (PostgreSQL can check a later
+    column in the index, but only by reading all of it).
+    """
+
+    node_type = plan.get("Node Type")
+
+    if node_type == "Seq Scan" and "Filter" in plan:
+        yield plan["Relation Name"], plan["Filter"]
+
+    elif node_type in {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}:
+        table, lead = index_leads.get(plan["Index Name"], (None, None))
+        condition = plan.get("Index Cond") or plan.get("Filter")
+
+        if lead and condition and not re.search(rf"\b{lead}\b",
+                                                plan.get("Index Cond", "")):
+            yield table, condition
+
+    for child in plan.get("Plans", []):
+        yield from _full_scans(child, index_leads)
+
+
+def find_unindexed_queries(db, queries):
+    """EXPLAIN each query, and return an UnindexedQuery for each full
+    scan."""
+
+    unindexed = []
+
+    with db.engine.connect() as conn:
+        index_leads = _get_index_leads(conn)
+
+        # Make the planner use indexes (and so index lookups in joins)
+        # wherever it can; only for this transaction, which is rolled back
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        conn.exec_driver_sql("SET LOCAL enable_hashjoin = off")
+        conn.exec_driver_sql("SET LOCAL enable_mergejoin = off")
+
+        for sql, (endpoint, statement, parameters) in queries.items():
+            [[explained]] = conn.exec_driver_sql(
+                "EXPLAIN (FORMAT JSON) " + statement, parameters).all()
+
+            for table, condition in _full_scans(
+                    explained[0]["Plan"], index_leads):
+                unindexed.append(
+                    UnindexedQuery(endpoint, table, condition, sql))
+
+        conn.rollback()
+
+    return unindexed
+
+
+def check_indexes(db, user_id, url_args):
+    """Find the queries behind the app's GET pages that no index supports.
+
+    `user_id` is who to browse as, and `url_args` the values for URL args
+    like user_id and message_id. Pick ones with plenty of follows, messages
+    and likes, so every query on each page actually runs.
+    """
+
+    app = current_app._get_current_object()
+    urls = get_page_urls(app, url_args)
+    queries = collect_queries(app, db, user_id, urls)
+
+    return find_unindexed_queries(db, queries)
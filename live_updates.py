@@ -0,0 +1,368 @@
+"""Live home timeline updates for Warbler, as Server-Sent Events.
+
+A logged in user's home page keeps a stream open to /timeline/live, and is
+sent an event for each new message by the users they follow (or by
+themselves). The page shows how many there are, so people can wait for
+something new rather than refreshing `/` to look.
+
+- add_message publishes each new message through a broker, which delivers
+  it to the subscriptions of the streams open in this worker.
+  MemoryBroker only reaches this process (tests, or a single worker);
+  PostgresBroker sends events through Postgres LISTEN/NOTIFY, so every
+  worker gets them.
+- Each event's id is the message's timeline cursor. A reconnecting browser
+  sends the last one back as Last-Event-ID (the page passes its newest
+  message as `after` for the first connection), and the messages it
+  missed are replayed from the timeline.
+- Idle streams get a heartbeat comment every so often, which keeps proxies
+  from timing them out and lets the server notice clients that have gone.
+- Streams are ended after a while (the browser reconnects and catches up),
+  so new follows are picked up and workers can be restarted. A client that
+  falls too far behind has its stream ended the same way.
+- Each open stream holds a request thread for up to LIVE_UPDATES_MAX_AGE,
+  so live updates are off unless LIVE_UPDATES_MAX_CONNECTIONS is set. Only
+  set it with threaded workers (e.g. gunicorn's --threads), and keep it
+  well under the threads per worker: with the default sync workers, every
+  open home page would tie up a whole worker. Past the cap, new streams
+  are told to retry later (LiveUpdatesBusy).
+
+The streams themselves don't use the database.
+"""
+
+import json
+import logging
+import select
+import time
+from collections import defaultdict, deque
+from threading import BoundedSemaphore, Condition, Lock, Thread
+
+from timeline import format_cursor
+
+logger = logging.getLogger("warbler.live_updates")
+
+NOTIFY_CHANNEL = "warbler_live_updates"
+
+
+class LiveUpdatesBusy(Exception):
+    """This worker already has as many streams open as it allows."""
+
+
+def message_event(message):
+    """The live update event for a new message."""
+
+    return {
+        'id': message.id,
+        'user_id': message.user_id,
+        'cursor': format_cursor(message),
+    }
+
+
+def format_event(event):
+    """Format an event for an event stream."""
+
+    data = json.dumps({'id': event['id'], 'user_id': event['user_id']})
+
+    return f"id: {event['cursor']}\ndata: {data}\n\n"
+
+
+class Subscription:
+    """The events waiting to be sent on one stream, from the authors it
+    follows.
+
+    Holds at most `max_pending` events; a stream that falls further behind
+    than that is dropped, to reconnect and catch up from the timeline.
+    """
+
+    def __init__(self, author_ids, max_pending, on_close):
+        self.author_ids = frozenset(author_ids)
+        self.max_pending = max_pending
+        self.dropped = False
+
+        self._pending = deque()
+        self._ready = Condition()
+        self._on_close = on_close
+        self._closed = False
+
+    def put(self, event):
+        with self._ready:
+            if len(self._pending) >= self.max_pending:
+                self.dropped = True
+            else:
+                self._pending.append(event)
+
+            self._ready.notify()
+
+    def drop(self):
+        with self._ready:
+            self.dropped = True
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Wait up to `timeout` seconds for the next event. None if there
+        wasn't one, or if the subscription has been dropped."""
+
+        with self._ready:
+            self._ready.wait_for(
+                lambda: self._pending or self.dropped, timeout)
+
+            if self.dropped or not self._pending:
+                return None
+
+            return self._pending.popleft()
+
+    def close(self):
+        """Stop receiving events. Safe to call more than once."""
+
+        with self._ready:
+            if self._closed:
+                return
+
+            self._closed = True
+
+        self._on_close(self)
+
+
+class MemoryBroker:
+    """Delivers events to the subscriptions in this process."""
+
+    def __init__(self):
+        # Author id -> the subscriptions following them
+        self._subscriptions = defaultdict(set)
+        self._lock = Lock()
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        """Hand an event to every subscription following its author."""
+
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(event['user_id'], ()))
+
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def add(self, subscription):
+        with self._lock:
+            for author_id in subscription.author_ids:
+                self._subscriptions[author_id].add(subscription)
+
+    def remove(self, subscription):
+        with self._lock:
+            for author_id in subscription.author_ids:
+                subscriptions = self._subscriptions.get(author_id)
+
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+
+                    if not subscriptions:
+                        del self._subscriptions[author_id]
+
+    def drop_all(self):
+        """Drop every subscription, so their streams reconnect."""
+
+        with self._lock:
+            subscriptions = set().union(*self._subscriptions.values())
+
+        for subscription in subscriptions:
+            subscription.drop()
+
+
+class PostgresBroker(MemoryBroker):
+    """Delivers events to the subscriptions in every worker, through
+    Postgres LISTEN/NOTIFY (psycopg2 only).
+
+    Each worker listens on its own connection, in a thread started when its
+    first stream opens. If that connection is lost, events may be missed,
+    so every stream is dropped to catch up from the timeline, and the
+    listener reconnects.
+    """
+
+    def __init__(self, db, reconnect_delay=1):
+        super().__init__()
+        self.db = db
+        self.reconnect_delay = reconnect_delay
+
+        self._listener = None
+        self._listener_lock = Lock()
+
+    def publish(self, event):
+        # Delivered to listeners when this commits
+        self.db.session.execute(
+            self.db.select(
+                self.db.func.pg_notify(NOTIFY_CHANNEL, json.dumps(event))))
+        self.db.session.commit()
+
+    def add(self, subscription):
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = Thread(
+                    target=self._listen,
+                    args=(self.db.engine,),
+                    name="live-updates-listener",
+                    daemon=True,
+                )
+                self._listener.start()
+
+        super().add(subscription)
+
+    def _listen(self, engine):
+        while True:
+            try:
+                self._listen_on_connection(engine)
+            except Exception:
+                logger.exception("Live updates listener lost its connection")
+
+            self.drop_all()
+            time.sleep(self.reconnect_delay)
+
+    def _listen_on_connection(self, engine):
+        connection = engine.raw_connection()
+        listener = connection.driver_connection
+        # Closed rather than returned to the pool, since it's LISTENing
+        connection.detach()
+
+        try:
+            listener.autocommit = True
+
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+
+            while True:
+                select.select([listener], [], [], 60)
+                listener.poll()
+
+                while listener.notifies:
+                    notify = listener.notifies.pop(0)
+                    self.deliver(json.loads(notify.payload))
+        finally:
+            connection.close()
+
+
+BROKERS = {
+    'memory': lambda db: MemoryBroker(),
+    'postgres': lambda db: PostgresBroker(db),
+}
+
+
+class LiveUpdates:
+    """Publishes new messages, and streams them to the users following
+    their authors.
+
+    Configured from the app by init_app():
+
+    - LIVE_UPDATES_BACKEND: the broker; "memory" reaches this process
+      only, "postgres" every worker
+    - LIVE_UPDATES_MAX_CONNECTIONS: streams a worker process keeps open;
+      0 (the default) turns live updates off
+    - LIVE_UPDATES_HEARTBEAT: seconds between heartbeats on an idle stream
+    - LIVE_UPDATES_MAX_AGE: seconds before a stream is ended, to reconnect
+    - LIVE_UPDATES_MAX_PENDING: events a stream can fall behind by before
+      it's dropped
+    - LIVE_UPDATES_RETRY: seconds browsers wait before reconnecting
+    - LIVE_UPDATES_BUSY_RETRY: seconds browsers wait before reconnecting
+      when there was no room for their stream
+    """
+
+    def __init__(self, app=None, db=None):
+        self.broker = None
+        self.enabled = False
+        self.heartbeat = 15
+        self.max_age = 5 * 60
+        self.max_pending = 100
+        self.retry = 3
+        self.busy_retry = 30
+
+        self._slots = None
+
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('LIVE_UPDATES_BACKEND', 'memory')
+        app.config.setdefault('LIVE_UPDATES_MAX_CONNECTIONS', 0)
+        app.config.setdefault('LIVE_UPDATES_HEARTBEAT', 15)
+        app.config.setdefault('LIVE_UPDATES_MAX_AGE', 5 * 60)
+        app.config.setdefault('LIVE_UPDATES_MAX_PENDING', 100)
+        app.config.setdefault('LIVE_UPDATES_RETRY', 3)
+        app.config.setdefault('LIVE_UPDATES_BUSY_RETRY', 30)
+
+        self.broker = BROKERS[app.config['LIVE_UPDATES_BACKEND']](db)
+        self.enabled = app.config['LIVE_UPDATES_MAX_CONNECTIONS'] > 0
+        self.heartbeat = app.config['LIVE_UPDATES_HEARTBEAT']
+        self.max_age = app.config['LIVE_UPDATES_MAX_AGE']
+        self.max_pending = app.config['LIVE_UPDATES_MAX_PENDING']
+        self.retry = app.config['LIVE_UPDATES_RETRY']
+        self.busy_retry = app.config['LIVE_UPDATES_BUSY_RETRY']
+        self._slots = BoundedSemaphore(
+            app.config['LIVE_UPDATES_MAX_CONNECTIONS'])
+
+        app.extensions['live_updates'] = self
+
+    def publish(self, message):
+        """Send a new message to the streams of its author's followers.
+        Call this once the message is committed."""
+
+        if self.enabled:
+            self.broker.publish(message_event(message))
+
+    def subscribe(self, author_ids):
+        """Start collecting the events for a stream, from `author_ids`.
+
+        Raises LiveUpdatesBusy if this worker has no room for another
+        stream. Close the subscription when the stream ends.
+        """
+
+        if not self._slots.acquire(blocking=False):
+            raise LiveUpdatesBusy()
+
+        subscription = Subscription(
+            author_ids, self.max_pending, on_close=self._unsubscribe)
+
+        try:
+            self.broker.add(subscription)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        self.broker.remove(subscription)
+        self._slots.release()
+
+    def stream(self, subscription, missed=()):
+        """Generate an event stream: the `missed` events, oldest first, then
+        the subscription's events as they come, until it's time to
+        reconnect."""
+
+        yield f"retry: {int(self.retry * 1000)}\n\n"
+
+        missed_ids = set()
+
+        for event in missed:
+            missed_ids.add(event['id'])
+            yield format_event(event)
+
+        ends_at = time.monotonic() + self.max_age
+
+        while time.monotonic() < ends_at:
+            event = subscription.get(
+                timeout=min(self.heartbeat, ends_at - time.monotonic()))
+
+            if subscription.dropped:
+                return
+
+            if event is None:
+                yield ": heartbeat\n\n"
+
+            # A message posted as the stream opened can also be replayed
+            elif event['id'] not in missed_ids:
+                yield format_event(event)
+
+    def busy_stream(self):
+        """A stream for when there's no room: it just tells the browser to
+        reconnect in a while. (An error status would stop it reconnecting
+        at all.)"""
+
+        return f"retry: {int(self.busy_retry * 1000)}\n\n"
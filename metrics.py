@@ -0,0 +1,276 @@
+"""Request, SQL and template metrics for Warbler, in Prometheus format.
+
+Metrics hooks into Flask's request hooks and template signals and into
+SQLAlchemy's engine events, and records per endpoint:
+
+- request latency (a histogram) and requests by status
+- SQL statements run, and the time spent running them
+- template render time
+- time spent waiting for a database connection from the pool
+
+These are served in the Prometheus text format on /metrics. Like the other
+in-process state, each worker process has its own numbers; Prometheus adds
+them up across workers when scraping each one.
+
+/metrics is on the app's own listener, so it's protected with a bearer
+token: scrapers send "Authorization: Bearer <METRICS_TOKEN>" (Prometheus's
+`authorization` scrape setting). Without a token configured, /metrics is
+a 404, so per-endpoint traffic, errors and SQL timings are never public.
+
+Recording is a few perf_counter() calls and dict updates per request and per
+statement, so it stays well under 1% of a request's time.
+"""
+
+import hmac
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+
+from flask import (Response, abort, before_render_template, g,
+                   has_request_context, request, template_rendered)
+from sqlalchemy import event
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+
+class Counter:
+    """A Prometheus counter, by endpoint (and optionally more labels)."""
+
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+
+class Histogram:
+    """A Prometheus histogram, by endpoint."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> [count in each bucket..., sum, count]
+        self._values = {}
+
+    def observe(self, labels, value):
+        values = self._values.get(labels)
+
+        if values is None:
+            values = self._values[labels] = [0] * (len(self.buckets) + 2)
+
+        # Counted in its own bucket here, and made cumulative on output
+        bucket = bisect_left(self.buckets, value)
+        if bucket < len(self.buckets):
+            values[bucket] += 1
+
+        values[-2] += value
+        values[-1] += 1
+
+    def samples(self):
+        for labels, values in self._values.items():
+            cumulative = 0
+
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield (f"{self.name}_bucket",
+                       labels + (("le", str(bound)),),
+                       cumulative)
+
+            yield f"{self.name}_bucket", labels + (("le", "+Inf"),), values[-1]
+            yield f"{self.name}_sum", labels, values[-2]
+            yield f"{self.name}_count", labels, values[-1]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(
+        f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value):
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+class Metrics:
+    """Collects the metrics for an app and serves them on /metrics.
+
+    Configured from the app by init_app():
+
+    - METRICS_ENABLED: turns off all recording, and /metrics, when false
+    - METRICS_TOKEN: the bearer token scrapers must send for /metrics;
+      /metrics is a 404 without one
+    """
+
+    def __init__(self, app=None, db=None):
+        self.token = None
+        self._lock = Lock()
+
+        self.requests = Counter(
+            "warbler_requests_total",
+            "Requests handled, by endpoint and status.")
+        self.request_duration = Histogram(
+            "warbler_request_duration_seconds",
+            "Time to handle a request, by endpoint.")
+        self.sql_statements = Counter(
+            "warbler_sql_statements_total",
+            "SQL statements run, by endpoint.")
+        self.sql_duration = Counter(
+            "warbler_sql_duration_seconds_total",
+            "Time spent running SQL statements, by endpoint.")
+        self.render_duration = Histogram(
+            "warbler_template_render_seconds",
+            "Time to render a template, by endpoint.")
+        self.pool_wait = Histogram(
+            "warbler_db_pool_wait_seconds",
+            "Time waiting for a database connection, by endpoint.")
+
+        self.metrics = [
+            self.requests,
+            self.request_duration,
+            self.sql_statements,
+            self.sql_duration,
+            self.render_duration,
+            self.pool_wait,
+        ]
+
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_TOKEN', None)
+
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        self.token = app.config['METRICS_TOKEN']
+
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        app.add_url_rule("/metrics", "metrics", self.render)
+
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._end_render, app)
+
+        with app.app_context():
+            for engine in db.engines.values():
+                self._instrument_engine(engine)
+
+    def _instrument_engine(self, engine):
+        event.listen(engine, "before_cursor_execute", self._start_statement)
+        event.listen(engine, "after_cursor_execute", self._end_statement)
+
+        # SQLAlchemy has no event for before a pool checkout, so time the
+        # engine's method that does it; the pool itself is replaced when
+        # the engine is disposed, but the engine isn't
+        raw_connection = engine.raw_connection
+
+        def timed_raw_connection():
+            start = perf_counter()
+
+            try:
+                return raw_connection()
+            finally:
+                if has_request_context():
+                    self._observe(
+                        self.pool_wait, perf_counter() - start)
+
+        engine.raw_connection = timed_raw_connection
+
+    def _observe(self, metric, value):
+        with self._lock:
+            metric.observe(_endpoint_labels(), value)
+
+    def _start_request(self):
+        g.metrics_request_start = perf_counter()
+        g.metrics_sql_statements = 0
+        g.metrics_sql_duration = 0
+
+    def _end_request(self, response):
+        start = g.get('metrics_request_start')
+
+        if start is None:
+            return response
+
+        labels = _endpoint_labels()
+
+        with self._lock:
+            self.requests.inc(labels + (("status", response.status_code),))
+            self.request_duration.observe(labels, perf_counter() - start)
+            self.sql_statements.inc(labels, g.metrics_sql_statements)
+            self.sql_duration.inc(labels, g.metrics_sql_duration)
+
+        return response
+
+    def _start_statement(self, conn, cursor, statement, parameters,
+                         context, executemany):
+        if has_request_context():
+            g.metrics_statement_start = perf_counter()
+
+    def _end_statement(self, conn, cursor, statement, parameters,
+                       context, executemany):
+        if not has_request_context() or 'metrics_sql_statements' not in g:
+            return
+
+        g.metrics_sql_statements += 1
+        g.metrics_sql_duration += perf_counter() - g.metrics_statement_start
+
+    def _start_render(self, app, template, context, **extra):
+        if has_request_context():
+            g.metrics_render_start = perf_counter()
+
+    def _end_render(self, app, template, context, **extra):
+        if has_request_context() and 'metrics_render_start' in g:
+            self._observe(
+                self.render_duration, perf_counter() - g.metrics_render_start)
+
+    def render(self):
+        """The metrics in the Prometheus text format, for scrapers with the
+        token."""
+
+        if not self.token:
+            abort(404)
+
+        authorization = request.headers.get("Authorization", "")
+
+        if not hmac.compare_digest(
+                authorization.encode(), f"Bearer {self.token}".encode()):
+            abort(401)
+
+        lines = []
+
+        with self._lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        return Response(
+            "\n".join(lines) + "\n",
+            mimetype="text/plain; version=0.0.4",
+        )
+
+
+def _endpoint_labels():
+    return (("endpoint", request.endpoint or "unmatched"),)
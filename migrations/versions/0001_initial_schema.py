@@ -0,0 +1,108 @@
+"""initial schema
+
+The tables, without the indexes for the hot paths, which 0002 adds. A
+database made by db.create_all() can be brought under migrations with:
+
+    flask db stamp 0001
+    flask db upgrade
+
+(0002 skips any of its indexes that already exist.)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 06:39:20.694422
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _pg_trgm_available(bind):
+    return bind.scalar(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_available_extensions "
+        "WHERE name = 'pg_trgm')"
+    ))
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(length=50), nullable=False),
+    sa.Column('username', sa.String(length=30), nullable=False),
+    sa.Column('image_url', sa.String(length=255), nullable=False),
+    sa.Column('header_image_url', sa.String(length=255), nullable=False),
+    sa.Column('bio', sa.Text(), nullable=False),
+    sa.Column('location', sa.String(length=30), nullable=False),
+    sa.Column('password', sa.String(length=100), nullable=False),
+    sa.Column('fanout_on_read', sa.Boolean(), server_default=sa.text('false'), nullable=False),
+    sa.Column('messages_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('following_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('likes_count', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+
+    # Username search indexes; see User.search
+    if bind.dialect.name == "postgresql":
+        op.create_index('ix_users_username_prefix', 'users', [sa.literal_column('(lower(username) COLLATE "C")')], unique=False)
+
+        if _pg_trgm_available(bind):
+            op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            op.create_index('ix_users_username_trgm', 'users', ['username'], unique=False, postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'})
+    elif bind.dialect.name == "sqlite":
+        op.create_index('ix_users_username_prefix_sqlite', 'users', [sa.literal_column('lower(username)')], unique=False)
+
+    op.create_table('follows',
+    sa.Column('user_being_followed_id', sa.Integer(), nullable=False),
+    sa.Column('user_following_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_being_followed_id'], ['users.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_following_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('user_being_followed_id', 'user_following_id')
+    )
+
+    op.create_table('messages',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('text', sa.String(length=140), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    op.create_table('likes',
+    sa.Column('message_being_liked_id', sa.Integer(), nullable=False),
+    sa.Column('user_liking_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['message_being_liked_id'], ['messages.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_liking_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('message_being_liked_id', 'user_liking_id')
+    )
+
+    op.create_table('timeline_entries',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('user_id', 'message_id')
+    )
+
+
+def downgrade():
+    op.drop_table('timeline_entries')
+    op.drop_table('likes')
+    op.drop_table('messages')
+    op.drop_table('follows')
+    op.drop_table('users')
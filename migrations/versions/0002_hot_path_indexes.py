@@ -0,0 +1,69 @@
+"""hot path indexes
+
+Indexes for reading timelines, follow lists and likes pages:
+
+- messages (user_id, timestamp DESC, id DESC): a user's newest messages,
+  for profiles, timeline backfill and fan-out-on-read authors
+- timeline_entries (user_id, timestamp DESC, message_id DESC): a page of a
+  home timeline, as one range scan
+- timeline_entries (message_id): removing a deleted message from timelines
+- follows (user_following_id): who a user follows (the primary key leads
+  with the followed user, which covers followers)
+- likes (user_liking_id): a user's liked messages (the primary key leads
+  with the message)
+
+On PostgreSQL these are built CONCURRENTLY, outside a transaction, so they
+can be added to a live database without locking out writes. If a concurrent
+build fails it leaves an INVALID index behind; drop it and run the upgrade
+again.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 06:45:02.118510
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_messages_user_timestamp', 'messages',
+     ['user_id', sa.literal_column('timestamp DESC'),
+      sa.literal_column('id DESC')]),
+    ('ix_timeline_entries_user_timestamp', 'timeline_entries',
+     ['user_id', sa.literal_column('timestamp DESC'),
+      sa.literal_column('message_id DESC')]),
+    ('ix_timeline_entries_message_id', 'timeline_entries', ['message_id']),
+    ('ix_follows_user_following_id', 'follows', ['user_following_id']),
+    ('ix_likes_user_liking_id', 'likes', ['user_liking_id']),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=False,
+                if_not_exists=True,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                if_exists=True,
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,84 @@
+"""deleted accounts
+
+- users.deleted_at: set when an account is deleted; the account's rows are
+  removed afterwards by `flask purge-deleted-users`
+- users (deleted_at), only where set: the accounts waiting to be purged
+- users (username, id), only where deleted_at isn't set: the users
+  directory, which leaves deleted accounts out
+- timeline_entries (author_id): a deleted author's messages in other users'
+  timelines, and the author_id foreign key's cascade
+
+The indexes are built CONCURRENTLY, as in 0002.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 07:31:48.402917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_users_deleted_at',
+            'users',
+            ['deleted_at'],
+            unique=False,
+            if_not_exists=True,
+            postgresql_concurrently=True,
+            postgresql_where=sa.text('deleted_at IS NOT NULL'),
+            sqlite_where=sa.text('deleted_at IS NOT NULL'),
+        )
+        op.create_index(
+            'ix_users_username_active',
+            'users',
+            ['username', 'id'],
+            unique=False,
+            if_not_exists=True,
+            postgresql_concurrently=True,
+            postgresql_where=sa.text('deleted_at IS NULL'),
+            sqlite_where=sa.text('deleted_at IS NULL'),
+        )
+        op.create_index(
+            'ix_timeline_entries_author_id',
+            'timeline_entries',
+            ['author_id'],
+            unique=False,
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_timeline_entries_author_id',
+            table_name='timeline_entries',
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_users_username_active',
+            table_name='users',
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_users_deleted_at',
+            table_name='users',
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
+
+    op.drop_column('users', 'deleted_at')
@@ -0,0 +1,27 @@
+"""user versions
+
+- users.version: bumped whenever anything shown about a user changes, for
+  conditional GETs; see http_caching.py
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 08:02:37.915064
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'version')
@@ -0,0 +1,49 @@
+"""last seen messages
+
+- users.last_seen_message_id: the newest message a user has been shown on
+  their home timeline, for counting the ones they haven't seen
+- messages (user_id, id): an author's messages since a given one, counted
+  from the index alone
+
+The index is built CONCURRENTLY, as in 0002.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 09:12:40.551827
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('last_seen_message_id', sa.Integer(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_user_id_id',
+            'messages',
+            ['user_id', 'id'],
+            unique=False,
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_messages_user_id_id',
+            table_name='messages',
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
+
+    op.drop_column('users', 'last_seen_message_id')
@@ -0,0 +1,58 @@
+"""likes user message index
+
+- likes (user_liking_id, message_being_liked_id): a user's likes in
+  message order, so each cursor page of them is a range read rather than a
+  sort of all of them. Replaces likes (user_liking_id), which it covers.
+
+The indexes are built and dropped CONCURRENTLY, as in 0002.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 10:04:26.730118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_likes_user_message',
+            'likes',
+            ['user_liking_id', 'message_being_liked_id'],
+            unique=False,
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_likes_user_liking_id',
+            table_name='likes',
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_likes_user_liking_id',
+            'likes',
+            ['user_liking_id'],
+            unique=False,
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_likes_user_message',
+            table_name='likes',
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,28 @@
+"""user profile versions
+
+- users.profile_version: bumped only when a user's profile changes (not
+  their counts), for the cached HTML of their messages; see
+  message_fragment in app.py
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 10:31:52.604218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('profile_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'profile_version')
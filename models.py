@@ -2,11 +2,15 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects import postgresql, sqlite
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from hashing import PasswordHasher
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+hasher = PasswordHasher()
 
 DEFAULT_IMAGE_URL = (
     "https://icon-library.com/images/default-user-icon/" +
@@ -18,11 +22,68 @@ DEFAULT_HEADER_IMAGE_URL = (
     "mat&fit=crop&w=2070&q=80")
 
 
+def _pg_trgm_available(ddl, target, bind, **kw):
+    """Can the pg_trgm extension be used on this database?
+
+    Used to only create trigram search indexes where the extension exists;
+    elsewhere username search falls back to a scan.
+    """
+
+    return (
+        bind is not None
+        and bind.dialect.name == "postgresql"
+        and bind.scalar(db.text(
+            "SELECT EXISTS "
+            "(SELECT FROM pg_available_extensions WHERE name = 'pg_trgm')"
+        ))
+    )
+
+
+def _insert_if_absent(model, **values):
+    """INSERT one row of `model`, doing nothing if its primary key is
+    already taken (ON CONFLICT DO NOTHING).
+
+    Returns whether a row was inserted.
+    """
+
+    if db.session.get_bind().dialect.name == "sqlite":
+        insert = sqlite.insert
+    else:
+        insert = postgresql.insert
+
+    result = db.session.execute(
+        insert(model).values(**values).on_conflict_do_nothing())
+
+    return result.rowcount == 1
+
+
+def _delete_if_present(model, **values):
+    """DELETE the row of `model` with these primary key values.
+
+    Returns whether a row was deleted.
+    """
+
+    result = db.session.execute(
+        db.delete(model)
+        .filter_by(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+    return result.rowcount == 1
+
+
 class Follow(db.Model):
     """Connection of a follower <-> followed_user."""
 
     __tablename__ = 'follows'
 
+    # The primary key leads with the followed user, so this covers the
+    # other direction: who a user follows, for their following page and
+    # home timeline
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', 'user_following_id'),
+    )
+
     user_being_followed_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -35,6 +96,42 @@ class Follow(db.Model):
         primary_key=True,
     )
 
+    @classmethod
+    def exists(cls, follower_id, followed_id):
+        """Is `follower_id` following `followed_id`? A primary key lookup."""
+
+        return db.session.scalar(db.select(db.exists().where(
+            cls.user_following_id == follower_id,
+            cls.user_being_followed_id == followed_id,
+        )))
+
+    @classmethod
+    def add(cls, follower_id, followed_id):
+        """Make `follower_id` follow `followed_id`, in one INSERT that
+        doesn't load anyone's follows.
+
+        Returns False if they were already following.
+        """
+
+        return _insert_if_absent(
+            cls,
+            user_following_id=follower_id,
+            user_being_followed_id=followed_id,
+        )
+
+    @classmethod
+    def remove(cls, follower_id, followed_id):
+        """Stop `follower_id` following `followed_id`, in one DELETE.
+
+        Returns False if they weren't following.
+        """
+
+        return _delete_if_present(
+            cls,
+            user_following_id=follower_id,
+            user_being_followed_id=followed_id,
+        )
+
 
 class User(db.Model):
     """User in the system."""
@@ -87,7 +184,87 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message', backref="user")
+    # Authors with very many followers are not fanned out on write; their
+    # messages are merged into followers' timelines at read time instead.
+    # Maintained by timeline.fan_out_message.
+    fanout_on_read = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+    )
+
+    # Denormalized counts for profile stats, kept in step with the rows they
+    # count by the routes that write them. User.reconcile_counts repairs
+    # any drift.
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # Bumped whenever anything a page shows about this user changes: their
+    # profile, their counts (and so their messages, likes and follows) or
+    # deletion. Pages are revalidated against it; see http_caching.py.
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # Bumped only when the profile itself changes (not the counts), for
+    # what's cached of it alongside each of their messages; see
+    # message_fragment in app.py
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # When the account was deleted. Deleted accounts are hidden right away;
+    # their rows are removed later, in batches, by account_purge.py.
+    deleted_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
+    # The newest message this user has been shown on their home timeline,
+    # for counting the ones they haven't seen yet. Not a foreign key: the
+    # message may since have been deleted.
+    last_seen_message_id = db.Column(
+        db.Integer,
+        nullable=True,
+    )
+
+    # Every message list renders its author, so load it in the same query
+    messages = db.relationship(
+        'Message',
+        backref=db.backref("user", lazy="joined", innerjoin=True),
+    )
 
     followers = db.relationship(
         "User",
@@ -99,6 +276,42 @@ class User(db.Model):
 
     #Can access list of liked messages with .liked_messages
 
+    __table_args__ = (
+        # Prefix search is a range scan over lowercased usernames. The "C"
+        # collation keeps every username sharing a prefix in one range.
+        db.Index(
+            'ix_users_username_prefix',
+            db.func.lower(username).collate("C"),
+        ).ddl_if(dialect="postgresql"),
+        # SQLite compares strings bytewise already
+        db.Index(
+            'ix_users_username_prefix_sqlite',
+            db.func.lower(username),
+        ).ddl_if(dialect="sqlite"),
+        # Substring search, for ILIKE '%term%'
+        db.Index(
+            'ix_users_username_trgm',
+            username,
+            postgresql_using="gin",
+            postgresql_ops={"username": "gin_trgm_ops"},
+        ).ddl_if(callable_=_pg_trgm_available),
+        # The users directory, which lists only accounts that aren't deleted
+        db.Index(
+            'ix_users_username_active',
+            username,
+            id,
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        # Only deleted accounts, for the purge to find
+        db.Index(
+            'ix_users_deleted_at',
+            deleted_at,
+            postgresql_where=deleted_at.is_not(None),
+            sqlite_where=deleted_at.is_not(None),
+        ),
+    )
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
@@ -109,7 +322,7 @@ class User(db.Model):
         Hashes password and adds user to session.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -129,32 +342,314 @@ class User(db.Model):
         It searches for a user whose password hash matches this password
         and, if it finds such a user, returns that user object.
 
-        If this can't find matching user (or if password is wrong), returns
-        False.
+        If this can't find matching user (or if password is wrong, or the
+        account has been deleted), returns False.
+
+        If the user's hash was made at an old bcrypt cost, it is replaced
+        with one at the current cost; commit to save it.
         """
 
-        user = cls.query.filter_by(username=username).one_or_none()
+        user = (cls
+                .query
+                .filter_by(username=username, deleted_at=None)
+                .one_or_none())
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if user and user.check_password(password):
+            if hasher.needs_rehash(user.password):
+                user.password = hasher.hash(password)
+
+            return user
 
         return False
 
+    def check_password(self, password):
+        """Does `password` match this user's password?"""
+
+        return hasher.check(self.password, password)
+
+    def bump_version(self):
+        """Mark this user as changed, for pages that show them to be
+        revalidated. Saved with the rest of the session."""
+
+        self.version = User.version + 1
+
+    def bump_profile_version(self):
+        """Mark this user's profile as changed: their username, images or
+        deletion. Bumps their version too. Saved with the rest of the
+        session."""
+
+        self.bump_version()
+        self.profile_version = User.profile_version + 1
+
+    def mark_timeline_seen(self, message_id):
+        """Record that this user has been shown their home timeline up to
+        `message_id`, in one UPDATE, unless they've already seen further
+        (say, in another tab). Commit to save it."""
+
+        if (self.last_seen_message_id or 0) >= message_id:
+            return
+
+        db.session.execute(
+            db.update(User)
+            .where(User.id == self.id)
+            .where(db.or_(
+                User.last_seen_message_id.is_(None),
+                User.last_seen_message_id < message_id,
+            ))
+            .values(last_seen_message_id=message_id)
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    def search(cls, term, limit):
+        """Find up to `limit` users whose username contains `term`.
+
+        Usernames starting with the term come first, alphabetically (so an
+        exact match leads), read straight off the prefix index. Any room
+        left is filled with other usernames containing the term, shortest
+        first; these need at least three characters, the shortest term a
+        trigram index can answer without scanning. Deleted accounts are left
+        out.
+        """
+
+        term = term.strip().lower()
+
+        username_key = db.func.lower(cls.username)
+        if db.session.get_bind().dialect.name == "postgresql":
+            username_key = username_key.collate("C")
+
+        # No character sorts after U+10FFFF, so this bounds the prefix range
+        is_prefix_match = db.and_(
+            username_key >= term,
+            username_key < term + "\U0010ffff",
+        )
+
+        users = (cls
+                 .query
+                 .filter(is_prefix_match)
+                 .filter(cls.deleted_at.is_(None))
+                 .order_by(username_key)
+                 .limit(limit)
+                 .all())
+
+        if len(users) == limit or len(term) < 3:
+            return users
+
+        escaped_term = (term
+                        .replace("\\", "\\\\")
+                        .replace("%", "\\%")
+                        .replace("_", "\\_"))
+
+        contains_term = cls.username.ilike(f"%{escaped_term}%", escape="\\")
+
+        users += (cls
+                  .query
+                  .filter(contains_term)
+                  .filter(db.not_(is_prefix_match))
+                  .filter(cls.deleted_at.is_(None))
+                  .order_by(db.func.length(cls.username), cls.username)
+                  .limit(limit - len(users))
+                  .all())
+
+        return users
+
+    @classmethod
+    def adjust_counts(cls, user_ids, **deltas):
+        """Add to the denormalized counters of one or more users.
+
+        `user_ids` is an id, a list of ids, or a select of ids; `deltas` maps
+        counter names to amounts (or SQL expressions correlated to the user),
+        e.g. adjust_counts(1, followers_count=1).
+        The update is done in SQL so concurrent requests can't lose counts,
+        and it commits or rolls back with the rest of the session. Also
+        bumps the users' versions.
+        """
+
+        if isinstance(user_ids, int):
+            user_ids = [user_ids]
+
+        db.session.execute(
+            db.update(cls)
+            .where(cls.id.in_(user_ids))
+            .values({
+                cls.version: cls.version + 1,
+                **{
+                    getattr(cls, name): getattr(cls, name) + delta
+                    for name, delta in deltas.items()
+                },
+            })
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    def reconcile_counts(cls):
+        """Recompute every user's denormalized counters from the source
+        tables, fixing any that have drifted.
+
+        Returns the number of users whose counts were repaired.
+        """
+
+        actual_counts = {
+            cls.messages_count: (
+                db.select(db.func.count())
+                .where(Message.user_id == cls.id)
+                .scalar_subquery()
+            ),
+            cls.followers_count: (
+                db.select(db.func.count())
+                .where(Follow.user_being_followed_id == cls.id)
+                .scalar_subquery()
+            ),
+            cls.following_count: (
+                db.select(db.func.count())
+                .where(Follow.user_following_id == cls.id)
+                .scalar_subquery()
+            ),
+            cls.likes_count: (
+                db.select(db.func.count())
+                .where(Like.user_liking_id == cls.id)
+                .scalar_subquery()
+            ),
+        }
+
+        result = db.session.execute(
+            db.update(cls)
+            .where(db.or_(*(
+                column != actual for column, actual in actual_counts.items()
+            )))
+            .values({cls.version: cls.version + 1, **actual_counts})
+            .execution_options(synchronize_session=False)
+        )
+
+        return result.rowcount
+
+    def get_liked_message_ids(self, messages):
+        """Which of `messages` has this user liked?
+
+        Returns a set of message ids, found with one query, so templates can
+        check each message's like button with a set lookup instead of
+        scanning this user's liked_messages.
+        """
+
+        message_ids = [message.id for message in messages]
+
+        if not message_ids:
+            return set()
+
+        return set(db.session.scalars(
+            db.select(Like.message_being_liked_id)
+            .where(Like.user_liking_id == self.id)
+            .where(Like.message_being_liked_id.in_(message_ids))
+        ))
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follow.exists(other_user.id, self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Follow.exists(self.id, other_user.id)
+
+    def get_followed_user_ids(self, users):
+        """Which of `users` is this user following?
+
+        Returns a set of user ids, found with one query, so list pages can
+        check each user's follow button with a set lookup instead of a query
+        per user.
+        """
+
+        user_ids = [user.id for user in users]
+
+        if not user_ids:
+            return set()
+
+        return set(db.session.scalars(
+            db.select(Follow.user_being_followed_id)
+            .where(Follow.user_following_id == self.id)
+            .where(Follow.user_being_followed_id.in_(user_ids))
+        ))
+
+    def get_following(self):
+        """Get the users this user follows, leaving out deleted accounts."""
+
+        return db.session.scalars(
+            db.select(User)
+            .join(Follow, Follow.user_being_followed_id == User.id)
+            .where(Follow.user_following_id == self.id)
+            .where(User.deleted_at.is_(None))
+        ).all()
+
+    def get_followers(self):
+        """Get this user's followers, leaving out deleted accounts."""
+
+        return db.session.scalars(
+            db.select(User)
+            .join(Follow, Follow.user_following_id == User.id)
+            .where(Follow.user_being_followed_id == self.id)
+            .where(User.deleted_at.is_(None))
+        ).all()
+
+    def get_liked_messages(self):
+        """Get the messages this user has liked, with their authors, leaving
+        out those by deleted accounts."""
+
+        return db.session.scalars(
+            db.select(Message)
+            .join(Like, Like.message_being_liked_id == Message.id)
+            .where(Like.user_liking_id == self.id)
+            # A primary key lookup per message, so the query stays led by
+            # the user's likes (filtering the joined authors on deleted_at
+            # can lead it with the index of every active user instead)
+            .where(~db.exists()
+                   .where(User.id == Message.user_id)
+                   .where(User.deleted_at.is_not(None)))
+            .options(db.joinedload(Message.user, innerjoin=True))
+        ).all()
+
+    def get_followers_page(self, limit, after=None):
+        """Get up to `limit` of this user's followers, in id order, starting
+        after the follower with id `after`.
+
+        A range read of the follows primary key, however deep the page.
+        """
+
+        query = (
+            db.select(User)
+            .join(Follow, Follow.user_following_id == User.id)
+            .where(Follow.user_being_followed_id == self.id)
+            .where(User.deleted_at.is_(None))
+        )
+
+        if after is not None:
+            query = query.where(Follow.user_following_id > after)
+
+        return db.session.scalars(
+            query.order_by(Follow.user_following_id).limit(limit)
+        ).all()
+
+    def get_liked_messages_page(self, limit, before=None):
+        """Get up to `limit` of the messages this user has liked, newest
+        message first, starting before the message with id `before`. Those
+        by deleted accounts are left out."""
+
+        query = (
+            db.select(Message)
+            .join(Like, Like.message_being_liked_id == Message.id)
+            .where(Like.user_liking_id == self.id)
+            .where(~db.exists()
+                   .where(User.id == Message.user_id)
+                   .where(User.deleted_at.is_not(None)))
+            .options(db.joinedload(Message.user, innerjoin=True))
+        )
+
+        if before is not None:
+            query = query.where(Like.message_being_liked_id < before)
+
+        return db.session.scalars(
+            query.order_by(Like.message_being_liked_id.desc()).limit(limit)
+        ).all()
 
 
 class Message(db.Model):
@@ -190,6 +685,20 @@ class Message(db.Model):
         backref="liked_messages",
     )
 
+    __table_args__ = (
+        # Supports keyset pagination over one author's messages, newest
+        # first
+        db.Index(
+            'ix_messages_user_timestamp',
+            user_id,
+            timestamp.desc(),
+            id.desc(),
+        ),
+        # Counts an author's messages since a given one, from the index
+        # alone; see count_unseen_messages
+        db.Index('ix_messages_user_id_id', user_id, id),
+    )
+
     def __repr__(self):
         return f"<Message #{self.id}>"
 
@@ -198,6 +707,16 @@ class Like(db.Model):
     """Connection of a message <-> liking_user."""
 
     __tablename__ = 'likes'
+
+    # The primary key leads with the message, so this covers a user's likes
+    # page, in message order, so its cursor pages are range reads
+    __table_args__ = (
+        db.Index(
+            'ix_likes_user_message',
+            'user_liking_id',
+            'message_being_liked_id',
+        ),
+    )
     #For future reference, would be better to shorten names
     message_being_liked_id = db.Column(
         db.Integer,
@@ -211,6 +730,82 @@ class Like(db.Model):
         primary_key=True,
     )
 
+    @classmethod
+    def add(cls, user_id, message_id):
+        """Have `user_id` like `message_id`, in one INSERT that doesn't
+        load their likes.
+
+        Returns False if they already liked it.
+        """
+
+        return _insert_if_absent(
+            cls, user_liking_id=user_id, message_being_liked_id=message_id)
+
+    @classmethod
+    def remove(cls, user_id, message_id):
+        """Have `user_id` unlike `message_id`, in one DELETE.
+
+        Returns False if they hadn't liked it.
+        """
+
+        return _delete_if_present(
+            cls, user_liking_id=user_id, message_being_liked_id=message_id)
+
+
+class TimelineEntry(db.Model):
+    """A message delivered to a user's home timeline.
+
+    Rows are written when a message is posted (fan-out on write), so reading
+    a home timeline is a single range scan over one user's entries.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        primary_key=True,
+        index=True,
+    )
+
+    # Indexed so a deleted author's entries can be found without a scan
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False,
+        index=True,
+    )
+
+    # Copied from the message so the timeline can be ordered without a join
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index(
+            'ix_timeline_entries_user_timestamp',
+            user_id,
+            timestamp.desc(),
+            message_id.desc(),
+        ),
+    )
+
+
+event.listen(
+    User.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(
+        callable_=_pg_trgm_available),
+)
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -220,3 +815,4 @@ def connect_db(app):
     app.app_context().push()
     db.app = app
     db.init_app(app)
+    hasher.init_app(app)
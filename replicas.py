@@ -0,0 +1,215 @@
+"""Read replica routing for Warbler.
+
+Every engine in SQLALCHEMY_BINDS whose key starts with "replica" is a read
+replica of the primary database. RoutingSession sends a statement to a
+replica only when all of these hold:
+
+- it's a SELECT, and the session hasn't written anything yet
+- the request is a GET to a view marked with @replica_reads
+- the client hasn't made a write request recently (its read-your-writes
+  window), so it won't miss its own changes because of replication lag
+- a replica is healthy
+
+Everything else goes to the primary. Replicas are health checked with a
+SELECT 1 every so often, and a replica that fails a check or drops a
+connection is skipped (falling back to the primary if none are left) until
+it has been down for a while.
+
+This module is imported by models, so it can't import models.
+"""
+
+import random
+from functools import wraps
+from threading import Lock
+from time import monotonic, time
+
+from flask import current_app, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc, text
+
+READ_PRIMARY_UNTIL_KEY = "read_primary_until"
+
+
+def replica_reads(view):
+    """Mark a read-only view as safe to serve from a replica."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return view(*args, **kwargs)
+
+    wrapper.replica_reads = True
+    return wrapper
+
+
+class Replica:
+    """A replica's engine, and whether it's fit to use."""
+
+    def __init__(self, engine, check_interval, retry_after):
+        self.engine = engine
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+
+        self._checked_at = None
+        self._down_until = 0
+        self._lock = Lock()
+
+        event.listen(engine, "handle_error", self._on_error)
+
+    def mark_down(self):
+        self._down_until = monotonic() + self.retry_after
+
+    def is_healthy(self):
+        """Is this replica up? Checks it if it's due a check."""
+
+        now = monotonic()
+
+        if now < self._down_until:
+            return False
+
+        # Only one thread runs the check; the rest go by the last result
+        if (self._checked_at is None
+                or now - self._checked_at >= self.check_interval):
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._check()
+                finally:
+                    self._checked_at = monotonic()
+                    self._lock.release()
+
+        return monotonic() >= self._down_until
+
+    def _check(self):
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except exc.DBAPIError:
+            self.mark_down()
+
+    def _on_error(self, context):
+        if context.is_disconnect or isinstance(
+                context.sqlalchemy_exception, exc.OperationalError):
+            self.mark_down()
+
+
+class ReplicaRouter:
+    """Decides, for the current request, whether reads can use a replica.
+
+    Configured from the app by init_app():
+
+    - SQLALCHEMY_BINDS: any "replica..." keys are the replicas
+    - REPLICA_READ_YOUR_WRITES: seconds after a client's write request
+      during which its reads all go to the primary
+    - REPLICA_CHECK_INTERVAL: seconds between health checks of a replica
+    - REPLICA_RETRY_AFTER: seconds to skip a replica once it's found down
+    """
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        self.replicas = []
+        self.read_your_writes = 5
+
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('REPLICA_READ_YOUR_WRITES', 5)
+        app.config.setdefault('REPLICA_CHECK_INTERVAL', 5)
+        app.config.setdefault('REPLICA_RETRY_AFTER', 30)
+
+        self.db = db
+        self.read_your_writes = app.config['REPLICA_READ_YOUR_WRITES']
+
+        with app.app_context():
+            self.replicas = [
+                Replica(
+                    engine,
+                    check_interval=app.config['REPLICA_CHECK_INTERVAL'],
+                    retry_after=app.config['REPLICA_RETRY_AFTER'],
+                )
+                for key, engine in db.engines.items()
+                if key and key.startswith("replica")
+            ]
+
+        app.extensions['replica_router'] = self
+        app.before_request(self._reset_choice)
+        app.after_request(self._start_read_your_writes)
+
+    def _reset_choice(self):
+        # The session can outlive a request (when requests share the app
+        # context pushed by connect_db), so choose afresh for each one
+        self.db.session.info.pop('replica', None)
+
+    def _start_read_your_writes(self, response):
+        # Without replicas every read is from the primary, so don't touch
+        # the session cookie
+        if self.replicas and request.method not in ("GET", "HEAD", "OPTIONS"):
+            session[READ_PRIMARY_UNTIL_KEY] = time() + self.read_your_writes
+
+        return response
+
+    def request_can_use_replica(self):
+        """Can the current request's reads go to a replica?"""
+
+        if not self.replicas or not has_request_context():
+            return False
+
+        if request.method not in ("GET", "HEAD"):
+            return False
+
+        view = current_app.view_functions.get(request.endpoint)
+
+        if not getattr(view, "replica_reads", False):
+            return False
+
+        return session.get(READ_PRIMARY_UNTIL_KEY, 0) < time()
+
+    def choose_engine(self):
+        """A healthy replica's engine, or None if there aren't any."""
+
+        healthy = [
+            replica for replica in self.replicas if replica.is_healthy()]
+
+        if not healthy:
+            return None
+
+        return random.choice(healthy).engine
+
+
+class RoutingSession(Session):
+    """A session that sends reads to a replica where it's safe to.
+
+    The replica is chosen once per request, and a session that writes
+    anything uses the primary from then on.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            replica = self._replica_for(clause)
+
+            if replica is not None:
+                return replica
+
+        return super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_for(self, clause):
+        # A lookup without a statement (like get_bind().dialect) gets the
+        # primary, but doesn't stop later reads using a replica
+        if clause is None and not self._flushing:
+            return None
+
+        if self._flushing or not getattr(clause, "is_select", False):
+            self.info['replica'] = None
+            return None
+
+        if 'replica' not in self.info:
+            router = (current_app.extensions.get('replica_router')
+                      if has_request_context() else None)
+
+            self.info['replica'] = (
+                router.choose_engine()
+                if router and router.request_can_use_replica()
+                else None
+            )
+
+        return self.info['replica']
@@ -1,19 +1,229 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
+For the small sample data in generator/:
+
+    python seed.py
+
+For big generated datasets, --bulk streams each CSV into the database in
+fixed-size chunks (with COPY on PostgreSQL) and builds indexes and foreign
+keys only once the data is in:
+
+    python seed.py --bulk --data-dir path/to/csvs --chunk-size 50000
+"""
+
+import argparse
+import csv
+import io
+import os
 from csv import DictReader
+from datetime import datetime
+from itertools import islice
+from time import perf_counter
+
+from flask_migrate import stamp
+from sqlalchemy.schema import AddConstraint, DropIndex
+
 from app import db
-from models import User, Message, Follow
+from models import User, Message, Follow, Like
+from timeline import rebuild_timelines
+
+# Load order, so rows only ever point at rows that are already there
+BULK_LOAD_TABLES = [
+    ('users.csv', User.__table__),
+    ('messages.csv', Message.__table__),
+    ('follows.csv', Follow.__table__),
+    ('likes.csv', Like.__table__),
+]
+
+
+def seed():
+    """Load the sample CSVs through the ORM."""
+
+    db.drop_all()
+    db.create_all()
+    # The tables are as new as the models, so later migrations start here
+    stamp()
+
+    with open('generator/users.csv') as users:
+        db.session.bulk_insert_mappings(User, DictReader(users))
+
+    with open('generator/messages.csv') as messages:
+        db.session.bulk_insert_mappings(Message, DictReader(messages))
+
+    with open('generator/follows.csv') as follows:
+        db.session.bulk_insert_mappings(Follow, DictReader(follows))
+
+    User.reconcile_counts()
+    rebuild_timelines()
+
+    db.session.commit()
+
+
+def read_chunks(csv_file, chunk_size):
+    """Read a CSV a chunk at a time.
+
+    Yields (header, rows) with at most `chunk_size` rows each, so memory use
+    doesn't grow with the size of the file.
+    """
+
+    reader = csv.reader(csv_file)
+    header = next(reader)
+
+    while chunk := list(islice(reader, chunk_size)):
+        yield header, chunk
+
+
+def copy_chunk(conn, table, header, rows):
+    """Load rows into a table with PostgreSQL's COPY FROM STDIN."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    quote = conn.dialect.identifier_preparer.quote
+    columns = ", ".join(quote(column) for column in header)
+
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {quote(table.name)} ({columns}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+
+
+def insert_chunk(conn, table, header, rows):
+    """Load rows into a table with an executemany INSERT.
+
+    For databases without COPY, like SQLite.
+    """
+
+    # CSV values are all strings; most databases coerce them, but SQLAlchemy
+    # wants real datetimes for DateTime columns
+    datetime_columns = {
+        column.name for column in table.columns
+        if isinstance(column.type, db.DateTime)
+    }
+
+    conn.execute(table.insert(), [
+        {
+            column: (datetime.fromisoformat(value)
+                     if column in datetime_columns else value)
+            for column, value in zip(header, row)
+        }
+        for row in rows
+    ])
+
+
+def drop_deferred_ddl(conn):
+    """Drop the indexes and foreign keys that slow down a bulk load.
+
+    Primary keys and unique constraints are kept, so bad data still fails
+    the load.
+    """
+
+    inspector = db.inspect(conn)
+    quote = conn.dialect.identifier_preparer.quote
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(DropIndex(index, if_exists=True))
+
+        if conn.dialect.supports_alter:
+            for foreign_key in inspector.get_foreign_keys(table.name):
+                conn.execute(db.text(
+                    f"ALTER TABLE {quote(table.name)} "
+                    f"DROP CONSTRAINT {quote(foreign_key['name'])}"
+                ))
+
+
+def create_deferred_ddl(conn):
+    """Recreate the indexes and foreign keys dropped for the load."""
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn)
+
+        if conn.dialect.supports_alter:
+            for constraint in table.foreign_key_constraints:
+                conn.execute(AddConstraint(constraint))
+                # AddConstraint leaves the constraint out of any later
+                # CREATE TABLE (like the next load's create_all); undo that
+                constraint._create_rule = None
+
+
+def resync_sequences(conn):
+    """Move id sequences past any ids loaded from the CSVs."""
+
+    if conn.dialect.name != "postgresql":
+        return
+
+    for table in db.metadata.sorted_tables:
+        if 'id' in table.columns:
+            conn.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"COALESCE(MAX(id), 0) + 1, false) FROM {table.name}"
+            ))
+
+
+def bulk_seed(data_dir, chunk_size):
+    """Stream the CSVs in `data_dir` into a fresh database.
+
+    Everything happens in one transaction, so a failed load leaves nothing
+    behind. Prints the rows/sec for each table as it goes.
+    """
+
+    db.drop_all()
+    db.create_all()
+    stamp()
+
+    with db.engine.begin() as conn:
+        drop_deferred_ddl(conn)
+
+        load_chunk = (copy_chunk if conn.dialect.name == "postgresql"
+                      else insert_chunk)
+
+        for filename, table in BULK_LOAD_TABLES:
+            path = os.path.join(data_dir, filename)
+
+            if not os.path.exists(path):
+                print(f"{table.name}: skipped, no {path}")
+                continue
+
+            num_rows = 0
+            start = perf_counter()
+
+            with open(path, newline='') as csv_file:
+                for header, rows in read_chunks(csv_file, chunk_size):
+                    load_chunk(conn, table, header, rows)
+                    num_rows += len(rows)
+
+            elapsed = perf_counter() - start
+            print(f"{table.name}: {num_rows} rows in {elapsed:.1f}s "
+                  f"({num_rows / elapsed:.0f} rows/sec)")
 
-db.drop_all()
-db.create_all()
+        start = perf_counter()
+        create_deferred_ddl(conn)
+        resync_sequences(conn)
+        print(f"indexes and constraints: {perf_counter() - start:.1f}s")
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+    start = perf_counter()
+    User.reconcile_counts()
+    rebuild_timelines()
+    db.session.commit()
+    print(f"counts and timelines: {perf_counter() - start:.1f}s")
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follow, DictReader(follows))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the Warbler database.")
+    parser.add_argument("--bulk", action="store_true",
+                        help="stream large CSVs in chunks")
+    parser.add_argument("--data-dir", default="generator",
+                        help="directory with users/messages/follows/likes CSVs")
+    parser.add_argument("--chunk-size", type=int, default=50_000,
+                        help="rows per chunk in --bulk mode")
+    args = parser.parse_args()
 
-db.session.commit()
+    if args.bulk:
+        bulk_seed(args.data_dir, args.chunk_size)
+    else:
+        seed()
@@ -0,0 +1,231 @@
+"""Slow SQL statement capture for Warbler.
+
+SlowQueryRecorder times every statement on the engine. Statements slower
+than the threshold are recorded with their normalized SQL, the shape (not
+the values) of their bind parameters and the endpoint that ran them. A
+sample of slow SELECTs also get an EXPLAIN (ANALYZE, BUFFERS) plan, on
+PostgreSQL. Recordings go to a bounded in-memory ring buffer, which the admin
+page summarizes, and to a rotating log file if one is configured.
+"""
+
+import json
+import logging
+import random
+import re
+from collections import deque, namedtuple
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from threading import Lock
+from time import perf_counter
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger("warbler.slow_queries")
+
+SlowQuery = namedtuple(
+    'SlowQuery',
+    ['sql', 'params', 'endpoint', 'duration', 'recorded_at', 'plan'],
+)
+
+# Worst offenders on the admin page: slow statements grouped by their SQL
+SlowQuerySummary = namedtuple(
+    'SlowQuerySummary',
+    ['sql', 'count', 'total_duration', 'max_duration', 'endpoints', 'plan'],
+)
+
+# Expanded IN lists, and any literals that made it into the SQL, so the
+# same statement with different values normalizes the same
+_IN_LIST = re.compile(
+    r"\bIN \((?:%\(\w+\)s|\?)(?:,\s*(?:%\(\w+\)s|\?))*\)", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w%(])-?\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement):
+    """Collapse a statement to one line with its literals replaced by ?."""
+
+    sql = _WHITESPACE.sub(" ", statement).strip()
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+
+    return sql
+
+
+def parameter_shape(parameters, executemany):
+    """Describe bind parameters by their types only, since their values may
+    be private (like password hashes)."""
+
+    if executemany:
+        rows = list(parameters)
+        shape = parameter_shape(rows[0], False) if rows else None
+        return {"rows": len(rows), "row": shape}
+
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__
+                for name, value in parameters.items()}
+
+    return [type(value).__name__ for value in parameters or ()]
+
+
+class SlowQueryRecorder:
+    """Records statements slower than a threshold from the app's engines.
+
+    Configured from the app by init_app():
+
+    - SLOW_QUERY_THRESHOLD: seconds a statement must take to be recorded
+    - SLOW_QUERY_EXPLAIN_RATE: fraction of slow SELECTs to EXPLAIN ANALYZE,
+      which runs them again
+    - SLOW_QUERY_BUFFER_SIZE: how many recordings to keep in memory
+    - SLOW_QUERY_LOG_FILE: file to log recordings to, or None
+    - SLOW_QUERY_LOG_MAX_BYTES / SLOW_QUERY_LOG_BACKUPS: when to rotate the
+      log file, and how many old ones to keep
+    """
+
+    def __init__(self, app=None, db=None):
+        self.threshold = 0.1
+        self.explain_rate = 0.1
+        self._queries = deque(maxlen=500)
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('SLOW_QUERY_THRESHOLD', 0.1)
+        app.config.setdefault('SLOW_QUERY_EXPLAIN_RATE', 0.1)
+        app.config.setdefault('SLOW_QUERY_BUFFER_SIZE', 500)
+        app.config.setdefault('SLOW_QUERY_LOG_FILE', None)
+        app.config.setdefault('SLOW_QUERY_LOG_MAX_BYTES', 10_000_000)
+        app.config.setdefault('SLOW_QUERY_LOG_BACKUPS', 5)
+
+        self.threshold = app.config['SLOW_QUERY_THRESHOLD']
+        self.explain_rate = app.config['SLOW_QUERY_EXPLAIN_RATE']
+        self._queries = deque(maxlen=app.config['SLOW_QUERY_BUFFER_SIZE'])
+
+        if app.config['SLOW_QUERY_LOG_FILE']:
+            handler = RotatingFileHandler(
+                app.config['SLOW_QUERY_LOG_FILE'],
+                maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+                backupCount=app.config['SLOW_QUERY_LOG_BACKUPS'],
+            )
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(
+                    engine, "before_cursor_execute", self._start_statement)
+                event.listen(
+                    engine, "after_cursor_execute", self._end_statement)
+
+    def _start_statement(self, conn, cursor, statement, parameters,
+                         context, executemany):
+        # Kept on the statement's execution context, which is thrown away
+        # with it, since after_cursor_execute isn't called for a statement
+        # that fails
+        if context is not None:
+            context.slow_query_start = perf_counter()
+
+    def _end_statement(self, conn, cursor, statement, parameters,
+                       context, executemany):
+        start = getattr(context, 'slow_query_start', None)
+
+        if start is None:
+            return
+
+        duration = perf_counter() - start
+
+        if duration < self.threshold:
+            return
+
+        plan = None
+        if (conn.dialect.name == "postgresql"
+                and not executemany
+                and statement.lstrip()[:6].upper() == "SELECT"
+                and random.random() < self.explain_rate):
+            plan = self._explain(conn, statement, parameters)
+
+        self.record(SlowQuery(
+            sql=normalize_sql(statement),
+            params=parameter_shape(parameters, executemany),
+            endpoint=request.endpoint if has_request_context() else None,
+            duration=duration,
+            recorded_at=datetime.utcnow(),
+            plan=plan,
+        ))
+
+    def _explain(self, conn, statement, parameters):
+        """Get the EXPLAIN (ANALYZE, BUFFERS) plan for a statement, or None
+        if that fails.
+
+        Runs in a savepoint on the statement's own connection, so it sees
+        the same data and a failure can't spoil the transaction.
+        """
+
+        with conn.connection.dbapi_connection.cursor() as cursor:
+            cursor.execute("SAVEPOINT slow_query_explain")
+
+            try:
+                cursor.execute(
+                    "EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                logger.exception("Couldn't EXPLAIN slow query")
+                return None
+
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+
+        return plan
+
+    def record(self, query):
+        """Keep a slow query in the buffer, and log it."""
+
+        with self._lock:
+            self._queries.append(query)
+
+        logger.info(json.dumps({
+            **query._asdict(),
+            "recorded_at": query.recorded_at.isoformat(),
+        }))
+
+    def recent(self):
+        """The recorded slow queries, oldest first."""
+
+        with self._lock:
+            return list(self._queries)
+
+    def worst(self, limit=50):
+        """Summaries of the recorded slow queries grouped by SQL, those
+        taking the most total time first."""
+
+        by_sql = {}
+
+        for query in self.recent():
+            summary = by_sql.get(query.sql)
+
+            if summary is None:
+                summary = SlowQuerySummary(
+                    query.sql, 0, 0, 0, set(), None)
+
+            by_sql[query.sql] = summary._replace(
+                count=summary.count + 1,
+                total_duration=summary.total_duration + query.duration,
+                max_duration=max(summary.max_duration, query.duration),
+                endpoints=summary.endpoints | {query.endpoint or "-"},
+                # The latest plan is the most relevant
+                plan=query.plan or summary.plan,
+            )
+
+        return sorted(
+            by_sql.values(),
+            key=lambda summary: summary.total_duration,
+            reverse=True,
+        )[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._queries.clear()
@@ -0,0 +1,33 @@
+"use strict";
+
+/** Announce new warbles on the home timeline as they're posted.
+ *
+ * Listens to the timeline's live updates (Server-Sent Events) and keeps a
+ * "N new warbles" link at the top of the list, which reloads the page.
+ * The browser reconnects by itself, and the server replays anything missed
+ * in between, so an id can arrive more than once.
+ */
+
+const liveList = document.querySelector("#messages[data-live-url]");
+
+if (liveList && window.EventSource) {
+  const newMessageIds = new Set();
+  const source = new EventSource(liveList.dataset.liveUrl);
+
+  source.addEventListener("message", function showNewWarbles(evt) {
+    newMessageIds.add(JSON.parse(evt.data).id);
+
+    let banner = liveList.querySelector(".new-warbles");
+    if (!banner) {
+      banner = document.createElement("li");
+      banner.className = "list-group-item new-warbles";
+      banner.append(document.createElement("a"));
+      banner.firstChild.href = "/";
+      liveList.prepend(banner);
+    }
+
+    const count = newMessageIds.size;
+    banner.firstChild.textContent =
+      `${count} new warble${count === 1 ? "" : "s"}`;
+  });
+}
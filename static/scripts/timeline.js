@@ -0,0 +1,21 @@
+"use strict";
+
+/** Swap a "load older" link for the next page of the timeline, in place.
+ *
+ * Without JS the link is a plain link to the next page.
+ */
+
+document.addEventListener("click", async function loadOlder(evt) {
+  const link = evt.target.closest(".load-older a");
+  if (!link) return;
+
+  evt.preventDefault();
+
+  const resp = await fetch(link.dataset.partialUrl);
+  if (!resp.ok) {
+    window.location = link.href;
+    return;
+  }
+
+  link.closest("li").outerHTML = await resp.text();
+});
@@ -0,0 +1,70 @@
+"use strict";
+
+/** Like, unlike, follow and unfollow in place.
+ *
+ * Their forms are posted with fetch(), asking for JSON, and on success the
+ * form is flipped to its opposite and any counts on the page are updated.
+ * Counts are elements with a data-count="<user id>:<count name>" attribute.
+ *
+ * Without JS (or if the request fails) the forms post as usual.
+ */
+
+const TOGGLES = [
+  {
+    pattern: /^\/messages\/(\d+)\/(like|unlike)$/,
+    flip(form, match, state) {
+      form.action = `/messages/${match[1]}/${state.liked ? "unlike" : "like"}`;
+      const icon = form.querySelector(".bi");
+      icon.classList.toggle("bi-star-fill", state.liked);
+      icon.classList.toggle("bi-star", !state.liked);
+    },
+  },
+  {
+    pattern: /^\/users\/(follow|stop-following)\/(\d+)$/,
+    flip(form, match, state) {
+      const action = state.following ? "stop-following" : "follow";
+      form.action = `/users/${action}/${match[2]}`;
+      form.querySelector("button").textContent =
+        state.following ? "Unfollow" : "Follow";
+    },
+  },
+];
+
+function updateCounts(users) {
+  for (const user of users) {
+    for (const [name, count] of Object.entries(user)) {
+      for (const elem of
+           document.querySelectorAll(`[data-count="${user.id}:${name}"]`)) {
+        elem.textContent = count;
+      }
+    }
+  }
+}
+
+document.addEventListener("submit", async function toggle(evt) {
+  const form = evt.target;
+  const path = new URL(form.action).pathname;
+
+  for (const { pattern, flip } of TOGGLES) {
+    const match = path.match(pattern);
+    if (!match) continue;
+
+    evt.preventDefault();
+
+    const resp = await fetch(form.action, {
+      method: "POST",
+      body: new FormData(form),
+      headers: { Accept: "application/json" },
+    });
+
+    if (!resp.ok) {
+      form.submit();
+      return;
+    }
+
+    const state = await resp.json();
+    flip(form, match, state);
+    updateCounts(state.users);
+    return;
+  }
+});
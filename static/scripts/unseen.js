@@ -0,0 +1,27 @@
+"use strict";
+
+/** Show how many new warbles are waiting on the home timeline.
+ *
+ * Polls the unseen count every data-poll-interval seconds while the page
+ * is visible, and shows it on the navbar badge ("99+" past the cap). The
+ * count only goes back down when the home page is loaded again.
+ */
+
+const unseenBadge = document.querySelector(".unseen-count[data-unseen-url]");
+
+async function showUnseenCount() {
+  if (document.visibilityState !== "visible") return;
+
+  const resp = await fetch(unseenBadge.dataset.unseenUrl);
+  if (!resp.ok) return;
+
+  const { data } = await resp.json();
+  unseenBadge.textContent = `${data.count}${data.more ? "+" : ""}`;
+  unseenBadge.hidden = data.count === 0;
+}
+
+if (unseenBadge) {
+  showUnseenCount();
+  setInterval(showUnseenCount, unseenBadge.dataset.pollInterval * 1000);
+  document.addEventListener("visibilitychange", showUnseenCount);
+}
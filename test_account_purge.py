@@ -0,0 +1,133 @@
+"""Account deletion and purge tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_account_purge.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from account_purge import purge_user, purge_deleted_users
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AccountPurgeTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+            for i in range(3):
+                c.post("/messages/new", data={"text": f"u1 message {i}"})
+            c.post(f"/users/follow/{self.u2_id}")
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "u2 message"})
+            c.post(f"/users/follow/{self.u1_id}")
+            for message in Message.query.filter_by(user_id=self.u1_id):
+                c.post(f"/messages/{message.id}/like")
+
+            self.login(c, self.u1_id)
+            c.post("/users/delete")
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def count_rows(self):
+        return {
+            model.__name__: model.query.count()
+            for model in [User, Message, Follow, Like, TimelineEntry]
+        }
+
+    def test_deleted_account_is_hidden(self):
+        """Test that a deleted account disappears before it is purged"""
+
+        self.assertEqual(self.count_rows()["Message"], 4)
+        self.assertEqual(User.authenticate("u1", "password"), False)
+
+        with app.test_client() as c:
+            self.login(c, self.u2_id)
+
+            self.assertEqual(c.get(f"/users/{self.u1_id}").status_code, 404)
+            self.assertNotIn("u1 message", c.get("/").get_data(as_text=True))
+            self.assertNotIn(">@u1<", c.get("/users").get_data(as_text=True))
+
+    def test_purge(self):
+        """Test that the purge removes the account and everything that
+        points at it, and fixes the other user's counts"""
+
+        progress = []
+        self.assertEqual(purge_deleted_users(
+            batch_size=2,
+            on_progress=lambda *args: progress.append(args),
+        ), 1)
+
+        self.assertEqual(self.count_rows(), {
+            "User": 1,
+            "Message": 1,
+            "Follow": 0,
+            "Like": 0,
+            "TimelineEntry": 1,
+        })
+
+        u2 = User.query.get(self.u2_id)
+        self.assertEqual(
+            (u2.followers_count, u2.following_count, u2.likes_count),
+            (0, 0, 0))
+
+        # Three likes, two to a batch
+        self.assertIn((self.u1_id, "likes of messages", 2), progress)
+        self.assertIn((self.u1_id, "likes of messages", 1), progress)
+
+    def test_purge_resumes(self):
+        """Test that a purge interrupted part way finishes when run again"""
+
+        calls = []
+
+        def stop_after_two_batches(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            purge_user(self.u1_id, 1, on_progress=stop_after_two_batches)
+
+        self.assertEqual(self.count_rows()["Like"], 1)
+
+        self.assertEqual(purge_deleted_users(batch_size=1), 1)
+        self.assertEqual(self.count_rows()["User"], 1)
+        self.assertEqual(User.query.get(self.u2_id).likes_count, 0)
@@ -0,0 +1,199 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+from timeline import rebuild_timelines
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="not-a-hash")
+        followers = [
+            User(username=f"f{i}", email=f"f{i}@email.com",
+                 password="not-a-hash")
+            for i in range(3)
+        ]
+        db.session.add_all([u1, *followers])
+        db.session.flush()
+
+        messages = [Message(text=f"message {i}", user_id=u1.id)
+                    for i in range(5)]
+        db.session.add_all(messages)
+        db.session.flush()
+
+        db.session.add_all([
+            Follow(user_being_followed_id=u1.id,
+                   user_following_id=follower.id)
+            for follower in followers
+        ])
+        db.session.add_all([
+            Like(message_being_liked_id=message.id,
+                 user_liking_id=followers[0].id)
+            for message in messages[:3]
+        ])
+        db.session.flush()
+
+        User.reconcile_counts()
+        rebuild_timelines()
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.f0_id = followers[0].id
+        self.message_ids = [message.id for message in messages]
+
+        app.config['API_PAGE_SIZE'] = 2
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['API_PAGE_SIZE'] = 100
+        app.config['TIMELINE_UNSEEN_CAP'] = 99
+
+    def get_as(self, user_id, url, **kwargs):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            return c.get(url, **kwargs)
+
+    def get_all_pages(self, user_id, url):
+        """Follow a list's cursors to the end, and return every item."""
+
+        items = []
+        cursor = None
+
+        while True:
+            resp = self.get_as(user_id, url, query_string={"cursor": cursor})
+            self.assertEqual(resp.status_code, 200)
+
+            items += resp.json["data"]
+            cursor = resp.json["next_cursor"]
+
+            if cursor is None:
+                return items
+
+    def test_timeline_pages(self):
+        """Test that the timeline pages through every message, newest
+        first, with its author and whether it's liked"""
+
+        messages = self.get_all_pages(self.f0_id, "/api/v1/timeline")
+
+        self.assertEqual([message["id"] for message in messages],
+                         self.message_ids[::-1])
+        self.assertEqual(messages[-1]["user"]["username"], "u1")
+        self.assertEqual(messages[-1]["liked"], True)
+        self.assertEqual(messages[0]["liked"], False)
+
+    def test_followers_and_likes_pages(self):
+        """Test that followers and likes page through every item"""
+
+        followers = self.get_all_pages(
+            self.u1_id, f"/api/v1/users/{self.u1_id}/followers")
+        liked = self.get_all_pages(
+            self.u1_id, f"/api/v1/users/{self.f0_id}/likes")
+
+        self.assertEqual([user["username"] for user in followers],
+                         ["f0", "f1", "f2"])
+        self.assertEqual([message["id"] for message in liked],
+                         self.message_ids[2::-1])
+
+    def test_sparse_fieldsets(self):
+        """Test that only the requested fields are returned"""
+
+        resp = self.get_as(
+            self.f0_id,
+            f"/api/v1/messages/{self.message_ids[0]}",
+            query_string={"fields[message]": "id,user",
+                          "fields[user]": "username,followed"},
+        )
+
+        self.assertEqual(resp.json, {"data": {
+            "id": self.message_ids[0],
+            "user": {"username": "u1", "followed": True},
+        }})
+
+        resp = self.get_as(self.f0_id, f"/api/v1/users/{self.u1_id}",
+                           query_string={"fields[user]": "id,password"})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("password", resp.json["error"])
+
+    def test_profile(self):
+        """Test that a profile has its counts"""
+
+        resp = self.get_as(self.f0_id, f"/api/v1/users/{self.u1_id}")
+
+        self.assertEqual(resp.json["data"]["messages_count"], 5)
+        self.assertEqual(resp.json["data"]["followers_count"], 3)
+
+    def test_unseen_count(self):
+        """Test that the unseen count is capped, and cleared by viewing
+        the home page"""
+
+        app.config['TIMELINE_UNSEEN_CAP'] = 3
+
+        resp = self.get_as(self.f0_id, "/api/v1/timeline/unseen")
+        self.assertEqual(resp.json, {"data": {"count": 3, "more": True}})
+
+        self.get_as(self.f0_id, "/")
+
+        resp = self.get_as(self.f0_id, "/api/v1/timeline/unseen")
+        self.assertEqual(resp.json, {"data": {"count": 0, "more": False}})
+
+    def test_not_modified(self):
+        """Test that revalidating an unchanged timeline is a 304"""
+
+        resp = self.get_as(self.f0_id, "/api/v1/timeline")
+        resp = self.get_as(self.f0_id, "/api/v1/timeline",
+                           headers={"If-None-Match": resp.headers["ETag"]})
+
+        self.assertEqual(resp.status_code, 304)
+
+    def test_errors(self):
+        """Test that errors are JSON"""
+
+        with app.test_client() as c:
+            resp = c.get("/api/v1/timeline")
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(resp.json, {"error": "Access unauthorized."})
+
+        resp = self.get_as(self.f0_id, "/api/v1/users/0")
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("error", resp.json)
+
+        resp = self.get_as(self.f0_id, "/api/v1/timeline",
+                           query_string={"cursor": "not-a-cursor"})
+
+        self.assertEqual(resp.status_code, 400)
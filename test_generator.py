@@ -0,0 +1,56 @@
+"""CSV generator tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_generator.py
+
+
+import os
+import sys
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+# The generator is a script, importing its helpers from its own directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "generator"))
+
+import create_csvs
+from create_csvs import Tier, generate, scrambler
+
+
+class ScramblerTestCase(TestCase):
+    def test_scrambler(self):
+        """Test that ranks map onto every id once, and the most popular
+        ranks aren't the first ids"""
+
+        for n in (1, 2, 300, 1_000, 10_000):
+            ids = scrambler(n)
+            self.assertEqual(sorted(map(ids, range(1, n + 1))),
+                             list(range(1, n + 1)))
+
+        ids = scrambler(1_000)
+        self.assertTrue(all(ids(rank) > 50 for rank in range(1, 6)))
+
+
+class GenerateTestCase(TestCase):
+    def test_same_seed_same_files(self):
+        """Test that a seed gives the same files whatever the pool size"""
+
+        tier = Tier(60, 2, 3, 3)
+
+        # Several chunks per file, to be split across the pool
+        with patch.object(create_csvs, "CHUNK_SIZE", 25), \
+                patch.dict(os.environ, {"UNSPLASH_CID": ""}), \
+                tempfile.TemporaryDirectory() as one, \
+                tempfile.TemporaryDirectory() as three:
+            generate(tier, "1", one, processes=1)
+            generate(tier, "1", three, processes=3)
+
+            self.assertEqual(sorted(os.listdir(three)),
+                             sorted(filename
+                                    for filename, *_ in create_csvs.CSVS))
+
+            for filename in os.listdir(one):
+                with open(os.path.join(one, filename)) as expected, \
+                        open(os.path.join(three, filename)) as actual:
+                    self.assertEqual(actual.read(), expected.read())
@@ -0,0 +1,133 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_hashing.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, hasher
+from hashing import PasswordHasher, HashingBusy
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordHasherTestCase(TestCase):
+    def test_hash_and_check(self):
+        """Test that a hash checks against its own password only"""
+
+        pw_hash = hasher.hash("password")
+
+        self.assertTrue(hasher.check(pw_hash, "password"))
+        self.assertFalse(hasher.check(pw_hash, "passw0rd"))
+        self.assertFalse(hasher.check(pw_hash, ""))
+
+    def test_needs_rehash(self):
+        """Test that hashes at another cost are flagged for rehashing"""
+
+        self.assertFalse(hasher.needs_rehash(hasher.hash("password")))
+        self.assertTrue(hasher.needs_rehash(
+            "$2b$04$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe"))
+
+    def test_full_queue_raises_busy(self):
+        """Test that hashing fails fast once the queue is full"""
+
+        busy_hasher = PasswordHasher(app)
+        busy_hasher.queue_timeout = 0
+
+        # Fill every slot, as if that many logins were already hashing
+        while busy_hasher._slots.acquire(blocking=False):
+            pass
+
+        with self.assertRaises(HashingBusy):
+            busy_hasher.hash("password")
+
+    def test_replaces_broken_pool(self):
+        """Test that a pool that lost a process is replaced"""
+
+        pool_hasher = PasswordHasher(app)
+        pool_hasher.rounds = 4
+        pool_hasher.max_workers = 1
+
+        try:
+            pool_hasher.hash("password")
+
+            for process in pool_hasher._executor._processes.values():
+                process.kill()
+                process.join()
+
+            self.assertTrue(pool_hasher.check(
+                pool_hasher.hash("password"), "password"))
+        finally:
+            pool_hasher.shutdown()
+
+
+class RehashOnLoginTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        self.rounds = hasher.rounds
+        hasher.rounds = 4
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+
+    def tearDown(self):
+        hasher.rounds = self.rounds
+        db.session.rollback()
+
+    def test_login_rehashes_at_new_cost(self):
+        """Test that logging in upgrades a hash made at an old cost"""
+
+        hasher.rounds = 5
+
+        with app.test_client() as c:
+            resp = c.post("/login", data={
+                "username": "u1",
+                "password": "password",
+            })
+
+        self.assertEqual(resp.status_code, 302)
+
+        u1 = User.query.get(self.u1_id)
+        self.assertTrue(u1.password.startswith("$2b$05$"))
+        self.assertTrue(u1.check_password("password"))
+
+    def test_login_while_busy(self):
+        """Test that logins are turned away with a 503 when hashing is
+        backed up"""
+
+        with patch.object(hasher, "check", side_effect=HashingBusy):
+            with app.test_client() as c:
+                resp = c.post("/login", data={
+                    "username": "u1",
+                    "password": "password",
+                })
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers["Retry-After"], "1")
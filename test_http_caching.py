@@ -0,0 +1,145 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_http_caching.py
+
+
+import os
+from unittest import TestCase
+
+from flask import template_rendered
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HTTPCachingTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="not-a-hash")
+        u2 = User(username="u2", email="u2@email.com", password="not-a-hash")
+        db.session.add_all([u1, u2])
+        db.session.flush()
+
+        m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.add(m2)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m2_id = m2.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def revalidate(self, c, url, etag):
+        """GET `url` with `etag`, and return the response and whether a
+        template was rendered for it."""
+
+        rendered = []
+
+        def record(sender, template, context, **extra):
+            rendered.append(template)
+
+        with template_rendered.connected_to(record, app):
+            resp = c.get(url, headers={"If-None-Match": etag})
+
+        return resp, bool(rendered)
+
+    def test_unchanged_page_is_not_modified(self):
+        """Test that revalidating an unchanged page is a 304 without
+        rendering it"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+
+            for url in [f"/users/{self.u2_id}", f"/messages/{self.m2_id}",
+                        "/"]:
+                resp = c.get(url)
+                etag = resp.headers["ETag"]
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("private", resp.headers["Cache-Control"])
+                self.assertIn("no-cache", resp.headers["Cache-Control"])
+
+                resp, rendered = self.revalidate(c, url, etag)
+
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(resp.headers["ETag"], etag)
+                self.assertFalse(rendered)
+
+    def test_changed_page_is_rendered(self):
+        """Test that a page's ETag changes when what it shows does"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+            profile_etag = c.get(f"/users/{self.u2_id}").headers["ETag"]
+
+            c.post(f"/users/follow/{self.u2_id}")
+
+            resp, rendered = self.revalidate(
+                c, f"/users/{self.u2_id}", profile_etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(rendered)
+
+            home_etag = c.get("/").headers["ETag"]
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "new message"})
+
+            self.login(c, self.u1_id)
+            resp, rendered = self.revalidate(c, "/", home_etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("new message", resp.get_data(as_text=True))
+
+    def test_other_pages_are_not_stored(self):
+        """Test that pages without a validator are no-store"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+            resp = c.get("/users/profile")
+
+        self.assertIn("no-store", resp.headers["Cache-Control"])
+        self.assertNotIn("ETag", resp.headers)
+
+    def test_static_files_are_revalidated(self):
+        """Test that static files can be cached and revalidated"""
+
+        with app.test_client() as c:
+            resp = c.get("/static/favicon.ico")
+            resp.close()
+
+            self.assertIn("no-cache", resp.headers["Cache-Control"])
+            self.assertIn("public", resp.headers["Cache-Control"])
+
+            resp = c.get("/static/favicon.ico",
+                         headers={"If-None-Match": resp.headers["ETag"]})
+
+            self.assertEqual(resp.status_code, 304)
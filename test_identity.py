@@ -0,0 +1,160 @@
+"""Identity cache and lazy g.user tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_identity.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User
+from cache import TTLCache
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, identity_cache
+from test_query_counts import QueryCountTestCase
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TTLCacheTestCase(TestCase):
+    def test_get_and_set(self):
+        """Test that cached values can be read back and deleted"""
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+
+        cache.delete("a")
+        self.assertIsNone(cache.get("a"))
+
+    def test_evicts_least_recently_used(self):
+        """Test that a full cache drops its least recently used entry"""
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire(self):
+        """Test that entries are gone after their TTL"""
+
+        cache = TTLCache(maxsize=2, ttl=60)
+
+        with patch("cache.monotonic", return_value=0):
+            cache.set("a", 1)
+
+        with patch("cache.monotonic", return_value=61):
+            self.assertIsNone(cache.get("a"))
+
+
+class CurrentUserTestCase(QueryCountTestCase):
+    def setUp(self):
+        User.query.delete()
+        identity_cache.clear()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_cached_identity_skips_database(self):
+        """Test that pages only using identity fields don't load the user
+        once the cache is warm"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get("/messages/new")
+
+            with self.assert_max_queries(0):
+                resp = c.get("/messages/new")
+
+            self.assertIn("u1", resp.get_data(as_text=True))
+
+    def test_update_profile_invalidates(self):
+        """Test that editing a profile refreshes the cached identity"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get("/messages/new")
+            c.post("/users/profile", data={
+                "username": "renamed",
+                "email": "u1@email.com",
+                "password": "password",
+            })
+
+            resp = c.get("/messages/new")
+
+            self.assertIn('alt="renamed"', resp.get_data(as_text=True))
+
+    def test_deleted_user_is_logged_out(self):
+        """Test that a session for a user that no longer exists is
+        treated as logged out"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            User.query.delete()
+            db.session.commit()
+
+            resp = c.get("/messages/new", follow_redirects=True)
+
+            self.assertIn("Access unauthorized.", resp.get_data(as_text=True))
+
+    def test_user_deleted_while_cached(self):
+        """Test that a user deleted elsewhere while their identity is still
+        cached is logged out when the page needs more than their identity"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get("/messages/new")
+
+            # As if another worker deleted them, leaving this one's cache
+            User.query.get(self.u1_id).deleted_at = datetime.utcnow()
+            db.session.commit()
+
+            resp = c.get("/users", follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Access unauthorized.", resp.get_data(as_text=True))
+            self.assertIsNone(identity_cache.get(self.u1_id))
+
+            with c.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
@@ -0,0 +1,85 @@
+"""Index check tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_index_check.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app
+from index_check import check_indexes
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class IndexCheckTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="not-a-hash")
+        u2 = User(username="u2", email="u2@email.com", password="not-a-hash")
+        db.session.add_all([u1, u2])
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u1.id)
+        m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.add_all([m1, m2])
+        db.session.flush()
+
+        db.session.add_all([
+            Follow(user_being_followed_id=u2.id, user_following_id=u1.id),
+            Follow(user_being_followed_id=u1.id, user_following_id=u2.id),
+            Like(message_being_liked_id=m2.id, user_liking_id=u1.id),
+        ])
+        db.session.commit()
+
+        self.url_args = {'user_id': u1.id, 'message_id': m2.id}
+        self.u1_id = u1.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_every_query_has_an_index(self):
+        """Test that no page's queries scan a whole table"""
+
+        self.assertEqual(check_indexes(db, self.u1_id, self.url_args), [])
+
+    def test_flags_missing_index(self):
+        """Test that a page whose query lost its index is flagged"""
+
+        db.session.execute(db.text("DROP INDEX ix_likes_user_message"))
+        db.session.commit()
+
+        try:
+            unindexed = check_indexes(db, self.u1_id, self.url_args)
+        finally:
+            [index] = [index for index in Like.__table__.indexes
+                       if index.name == "ix_likes_user_message"]
+            index.create(db.engine)
+
+        self.assertIn(
+            ("show_liked_messages", "likes"),
+            {(query.endpoint, query.table) for query in unindexed},
+        )
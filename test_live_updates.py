@@ -0,0 +1,267 @@
+"""Live timeline updates tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_live_updates.py
+
+
+import json
+import os
+from unittest import TestCase
+
+from flask import url_for
+
+from models import db, User, Message, Follow
+from live_updates import (LiveUpdatesBusy,
+                          MemoryBroker,
+                          PostgresBroker,
+                          Subscription,
+)
+from timeline import format_cursor
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, live_updates
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# Live updates are off by default
+app.config['LIVE_UPDATES_MAX_CONNECTIONS'] = 10
+live_updates.init_app(app, db)
+
+
+def read_events(resp):
+    """Read an event stream to its end, and return its events' ids and
+    data, and its comments."""
+
+    events = []
+    comments = []
+
+    for chunk in resp.response:
+        for block in chunk.decode().split("\n\n"):
+            if block.startswith(":"):
+                comments.append(block)
+            elif block.startswith("id: "):
+                event_id, data = block.split("\n")
+                events.append((event_id[len("id: "):],
+                               json.loads(data[len("data: "):])))
+
+    resp.close()
+
+    return events, comments
+
+
+class BrokerTestCase(TestCase):
+    def subscribe(self, broker, author_ids, max_pending=10):
+        subscription = Subscription(
+            author_ids, max_pending, on_close=broker.remove)
+        broker.add(subscription)
+
+        return subscription
+
+    def test_delivers_to_followers(self):
+        """Test that an event only goes to subscriptions following its
+        author"""
+
+        broker = MemoryBroker()
+        follower = self.subscribe(broker, {1, 2})
+        other = self.subscribe(broker, {3})
+
+        broker.publish({'id': 10, 'user_id': 2})
+
+        self.assertEqual(follower.get(timeout=0), {'id': 10, 'user_id': 2})
+        self.assertIsNone(other.get(timeout=0))
+
+        follower.close()
+        broker.publish({'id': 11, 'user_id': 2})
+
+        self.assertIsNone(follower.get(timeout=0))
+
+    def test_drops_slow_subscriptions(self):
+        """Test that a subscription that falls behind is dropped"""
+
+        broker = MemoryBroker()
+        subscription = self.subscribe(broker, {1}, max_pending=1)
+
+        broker.publish({'id': 10, 'user_id': 1})
+        broker.publish({'id': 11, 'user_id': 1})
+
+        self.assertTrue(subscription.dropped)
+        self.assertIsNone(subscription.get(timeout=0))
+
+    def test_postgres_broker(self):
+        """Test that the Postgres broker delivers events through NOTIFY"""
+
+        broker = PostgresBroker(db)
+        subscription = self.subscribe(broker, {1})
+        event = {'id': 10, 'user_id': 1, 'cursor': "cursor"}
+
+        # The listener starts in the background, so publish until it's
+        # listening
+        for attempt in range(50):
+            broker.publish(event)
+
+            if subscription.get(timeout=0.1) == event:
+                break
+        else:
+            self.fail("The event wasn't delivered")
+
+        subscription.close()
+
+
+class LiveTimelineTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="not-a-hash")
+        u2 = User(username="u2", email="u2@email.com", password="not-a-hash")
+        u3 = User(username="u3", email="u3@email.com", password="not-a-hash")
+        db.session.add_all([u1, u2, u3])
+        db.session.flush()
+
+        db.session.add(Follow(user_being_followed_id=u2.id,
+                              user_following_id=u1.id))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+
+        live_updates.heartbeat = 0.01
+        live_updates.max_age = 0.05
+
+    def tearDown(self):
+        db.session.rollback()
+
+        live_updates.heartbeat = app.config['LIVE_UPDATES_HEARTBEAT']
+        live_updates.max_age = app.config['LIVE_UPDATES_MAX_AGE']
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def post_as(self, user_id, text):
+        with app.test_client() as c:
+            self.login(c, user_id)
+            c.post("/messages/new", data={"text": text})
+
+        return Message.query.filter_by(text=text).one()
+
+    def test_streams_followed_messages(self):
+        """Test that new messages by followed users are streamed, with
+        heartbeats in between"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+            resp = c.get("/timeline/live")
+
+            self.assertEqual(resp.mimetype, "text/event-stream")
+
+            followed = self.post_as(self.u2_id, "followed")
+            self.post_as(self.u3_id, "not followed")
+
+            events, comments = read_events(resp)
+
+        self.assertEqual(events, [
+            (format_cursor(followed),
+             {'id': followed.id, 'user_id': self.u2_id}),
+        ])
+        self.assertIn(": heartbeat", comments)
+
+    def test_replays_missed_messages(self):
+        """Test that reconnecting replays the messages after Last-Event-ID"""
+
+        seen = self.post_as(self.u2_id, "seen")
+        missed = self.post_as(self.u2_id, "missed")
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+            resp = c.get("/timeline/live",
+                         headers={"Last-Event-ID": format_cursor(seen)})
+
+            events, comments = read_events(resp)
+
+        self.assertEqual([data['id'] for event_id, data in events],
+                         [missed.id])
+
+    def test_connection_cap(self):
+        """Test that past the cap, streams are told to retry later, and
+        that closed streams make room"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+
+            subscriptions = []
+
+            try:
+                while True:
+                    subscriptions.append(live_updates.subscribe({0}))
+            except LiveUpdatesBusy:
+                pass
+
+            resp = c.get("/timeline/live")
+            self.assertEqual(
+                resp.get_data(as_text=True),
+                f"retry: {app.config['LIVE_UPDATES_BUSY_RETRY'] * 1000}\n\n")
+
+            subscriptions.pop().close()
+
+            resp = c.get("/timeline/live")
+            self.assertIn(": heartbeat", read_events(resp)[1])
+
+            for subscription in subscriptions:
+                subscription.close()
+
+    def test_home_page_links_live_updates(self):
+        """Test that the home page streams from its newest message"""
+
+        message = self.post_as(self.u2_id, "newest")
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+            resp = c.get("/")
+
+        with app.test_request_context():
+            live_url = url_for('live_timeline', after=format_cursor(message))
+
+        self.assertIn(f'data-live-url="{live_url}"',
+                      resp.get_data(as_text=True))
+
+    def test_disabled(self):
+        """Test that with live updates off, the home page doesn't stream"""
+
+        live_updates.enabled = False
+
+        try:
+            with app.test_client() as c:
+                self.login(c, self.u1_id)
+
+                self.assertNotIn("data-live-url",
+                                 c.get("/").get_data(as_text=True))
+                self.assertEqual(c.get("/timeline/live").status_code, 404)
+        finally:
+            live_updates.enabled = True
+
+    def test_logged_out(self):
+        """Test that logged out users can't stream"""
+
+        with app.test_client() as c:
+            resp = c.get("/timeline/live")
+
+        self.assertEqual(resp.status_code, 401)
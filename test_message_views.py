@@ -19,7 +19,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, message_fragments
 
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 
@@ -127,4 +127,118 @@ class MessageAddViewTestCase(MessageBaseViewTestCase):
                 sess[CURR_USER_KEY] = self.u1_id
 
             resp = c.get(f'/messages/0')
-            self.assertEqual(resp.status_code, 404)
\ No newline at end of file
+            self.assertEqual(resp.status_code, 404)
+
+    def test_like_json(self):
+        """Test that the like toggles get the new state and counts"""
+
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u2.id
+
+            resp = c.post(f"/messages/{self.m1_id}/like",
+                          headers={"Accept": "application/json"})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json["liked"], True)
+            self.assertEqual(resp.json["users"][0]["likes_count"], 1)
+
+            resp = c.post(f"/messages/{self.m1_id}/unlike",
+                          headers={"Accept": "application/json"})
+
+            self.assertEqual(resp.json["liked"], False)
+            self.assertEqual(resp.json["users"][0]["likes_count"], 0)
+
+    def test_like_own_message_json(self):
+        """Test that liking your own message is refused with a 403"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post(f"/messages/{self.m1_id}/like",
+                          headers={"Accept": "application/json"})
+
+        self.assertEqual(resp.status_code, 403)
+        self.assertIn("conceited", resp.json["error"])
+
+
+class MessageFragmentCacheTestCase(MessageBaseViewTestCase):
+    def setUp(self):
+        super().setUp()
+        message_fragments.clear()
+
+    def get_profile(self, c):
+        return c.get(f"/users/{self.u1_id}").get_data(as_text=True)
+
+    def test_fragment_is_cached(self):
+        """Test that a message's fragment is rendered once, and that the
+        like button isn't cached with it"""
+
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u2.id
+
+            self.get_profile(c)
+            self.assertIsNotNone(message_fragments.get(self.m1_id))
+
+            c.post(f"/messages/{self.m1_id}/like")
+            html = self.get_profile(c)
+
+        self.assertIn("m1-text", html)
+        self.assertIn(f"/messages/{self.m1_id}/unlike", html)
+
+    def test_counts_dont_invalidate(self):
+        """Test that likes and follows leave the author's fragments cached"""
+
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u2.id
+
+            self.get_profile(c)
+            cached = message_fragments.get(self.m1_id)
+
+            c.post(f"/messages/{self.m1_id}/like")
+            c.post(f"/users/follow/{self.u1_id}")
+            self.get_profile(c)
+
+        self.assertIs(message_fragments.get(self.m1_id), cached)
+
+    def test_profile_update_invalidates(self):
+        """Test that a renamed author's messages show the new name"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            self.get_profile(c)
+            c.post("/users/profile", data={
+                "username": "renamed",
+                "email": "u1@email.com",
+                "password": "password",
+            })
+            html = self.get_profile(c)
+
+        self.assertIn("@renamed", html)
+        self.assertNotIn("@u1<", html)
+
+    def test_delete_message_invalidates(self):
+        """Test that deleting a message drops its fragment"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            self.get_profile(c)
+            c.post(f"/messages/{self.m1_id}/delete")
+
+        self.assertIsNone(message_fragments.get(self.m1_id))
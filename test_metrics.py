@@ -0,0 +1,118 @@
+"""Metrics tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_metrics.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+from metrics import Histogram
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, metrics
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HistogramTestCase(TestCase):
+    def test_buckets_are_cumulative(self):
+        """Test that each bucket counts everything at or below its bound"""
+
+        histogram = Histogram("test_seconds", "Test.", buckets=(0.1, 1))
+        labels = (("endpoint", "test"),)
+
+        histogram.observe(labels, 0.05)
+        histogram.observe(labels, 0.5)
+        histogram.observe(labels, 5)
+
+        samples = {
+            (name, labels[-1][1] if name.endswith("_bucket") else None): value
+            for name, labels, value in histogram.samples()
+        }
+
+        self.assertEqual(samples[("test_seconds_bucket", "0.1")], 1)
+        self.assertEqual(samples[("test_seconds_bucket", "1")], 2)
+        self.assertEqual(samples[("test_seconds_bucket", "+Inf")], 3)
+        self.assertEqual(samples[("test_seconds_count", None)], 3)
+        self.assertAlmostEqual(samples[("test_seconds_sum", None)], 5.55)
+
+
+class MetricsViewTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="not-a-hash")
+        db.session.add(u1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+
+        metrics.token = "metrics-token"
+
+    def tearDown(self):
+        db.session.rollback()
+        metrics.token = app.config['METRICS_TOKEN']
+
+    def test_records_routes(self):
+        """Test that requests, SQL and rendering show up on /metrics"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get(f"/users/{self.u1_id}")
+            resp = c.get("/metrics", headers={
+                "Authorization": "Bearer metrics-token"})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+
+        html = resp.get_data(as_text=True)
+        self.assertIn(
+            'warbler_requests_total{endpoint="show_user",status="200"}', html)
+        self.assertIn(
+            'warbler_request_duration_seconds_count{endpoint="show_user"}',
+            html)
+        self.assertIn(
+            'warbler_template_render_seconds_count{endpoint="show_user"}',
+            html)
+
+        sql_statements = metrics.sql_statements.samples()
+        self.assertTrue(any(
+            labels == (("endpoint", "show_user"),) and value > 0
+            for _, labels, value in sql_statements
+        ))
+
+    def test_needs_token(self):
+        """Test that /metrics needs the token, and is off without one"""
+
+        with app.test_client() as c:
+            self.assertEqual(c.get("/metrics").status_code, 401)
+            self.assertEqual(
+                c.get("/metrics", headers={
+                    "Authorization": "Bearer wrong"}).status_code,
+                401)
+
+            metrics.token = None
+
+            self.assertEqual(c.get("/metrics").status_code, 404)
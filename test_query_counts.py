@@ -0,0 +1,203 @@
+"""SQL query budget tests for the message list routes."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_query_counts.py
+
+
+import os
+from contextlib import contextmanager
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from timeline import rebuild_timelines
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+NUM_AUTHORS = 10
+NUM_MESSAGES = 100
+
+
+class QueryCountTestCase(TestCase):
+    """Base for tests that put an upper bound on the SQL a route runs."""
+
+    @contextmanager
+    def assert_max_queries(self, max_queries):
+        """Fail if the block runs more than `max_queries` SQL statements.
+
+        The session is emptied first so nothing is served from objects that
+        earlier requests left in the identity map.
+        """
+
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.session.expunge_all()
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+
+        self.assertLessEqual(
+            len(statements),
+            max_queries,
+            "Too many queries:\n" + "\n\n".join(statements),
+        )
+
+
+class MessageListQueryCountTestCase(QueryCountTestCase):
+    def setUp(self):
+        User.query.delete()
+
+        # Skip bcrypt; these users never log in with a password
+        viewer = User(username="viewer", email="viewer@email.com",
+                      password="not-a-hash")
+        authors = [
+            User(username=f"author{i}", email=f"author{i}@email.com",
+                 password="not-a-hash")
+            for i in range(NUM_AUTHORS)
+        ]
+        db.session.add_all([viewer, *authors])
+        db.session.flush()
+
+        messages = [
+            Message(text=f"message {i}",
+                    user_id=authors[i % NUM_AUTHORS].id)
+            for i in range(NUM_MESSAGES)
+        ]
+        db.session.add_all(messages)
+        db.session.flush()
+
+        db.session.add_all([
+            Follow(user_being_followed_id=author.id,
+                   user_following_id=viewer.id)
+            for author in authors
+        ])
+        db.session.add_all([
+            Like(message_being_liked_id=message.id, user_liking_id=viewer.id)
+            for message in messages[::2]
+        ])
+        db.session.flush()
+
+        User.reconcile_counts()
+        rebuild_timelines()
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.author_id = authors[0].id
+        self.message_id = messages[0].id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def get_as_viewer(self, url, max_queries):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            with self.assert_max_queries(max_queries):
+                resp = c.get(url)
+
+        self.assertEqual(resp.status_code, 200)
+
+        return resp.get_data(as_text=True)
+
+    def test_homepage(self):
+        """Test that the 100 message home timeline has a fixed query cost"""
+
+        # One records how far down the timeline the viewer has seen
+        html = self.get_as_viewer("/", 6)
+
+        self.assertEqual(html.count('class="message-link"'), NUM_MESSAGES)
+
+    def test_show_user(self):
+        """Test that a profile's messages don't load per message"""
+
+        # One of them reads the page's version stamp, for its ETag
+        html = self.get_as_viewer(f"/users/{self.author_id}", 6)
+
+        self.assertIn("@author0", html)
+
+    def test_show_liked_messages(self):
+        """Test that the likes page loads each author in bulk"""
+
+        html = self.get_as_viewer(f"/users/{self.viewer_id}/likes", 4)
+
+        self.assertEqual(
+            html.count('class="message-link"'), NUM_MESSAGES // 2)
+
+    def test_show_message(self):
+        """Test that a single message loads its author with it"""
+
+        self.get_as_viewer(f"/messages/{self.message_id}", 5)
+
+    def test_show_following(self):
+        """Test that the follow buttons on a list page take one query, not
+        one per user"""
+
+        html = self.get_as_viewer(f"/users/{self.viewer_id}/following", 5)
+
+        self.assertEqual(html.count("/users/stop-following/"), NUM_AUTHORS)
+
+    def test_show_followers(self):
+        """Test that the followers page checks follows in one query"""
+
+        html = self.get_as_viewer(f"/users/{self.author_id}/followers", 5)
+
+        self.assertIn("@viewer", html)
+
+
+    def post_as_viewer(self, url, max_queries):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            with self.assert_max_queries(max_queries) as statements:
+                c.post(url)
+
+        return [statement for statement in statements
+                if statement.startswith("SELECT")]
+
+    def test_like_and_unlike(self):
+        """Test that liking doesn't load the viewer's likes"""
+
+        selects = (
+            self.post_as_viewer(f"/messages/{self.message_id}/unlike", 4)
+            + self.post_as_viewer(f"/messages/{self.message_id}/like", 4))
+
+        self.assertFalse(any("FROM likes" in select for select in selects))
+
+    def test_follow_and_unfollow(self):
+        """Test that following doesn't load the viewer's follows"""
+
+        selects = (
+            self.post_as_viewer(f"/users/stop-following/{self.author_id}", 6)
+            + self.post_as_viewer(f"/users/follow/{self.author_id}", 7))
+
+        self.assertFalse(any("FROM follows" in select for select in selects))
@@ -0,0 +1,147 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_replicas.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from models import db, User
+from replicas import Replica, READ_PRIMARY_UNTIL_KEY
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, replica_router
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Uses a SQLite file as the "replica", holding different data than the
+    primary, to see which database each page was read from."""
+
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="not-a-hash",
+                  bio="bio on the primary")
+        db.session.add(u1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+
+        self.replica_dir = tempfile.TemporaryDirectory()
+        self.replica_engine = create_engine(
+            f"sqlite:///{self.replica_dir.name}/replica.db")
+        db.metadata.create_all(self.replica_engine)
+
+        with self.replica_engine.begin() as conn:
+            conn.execute(db.insert(User).values(
+                id=u1.id, username="u1", email="u1@email.com",
+                password="not-a-hash", bio="bio on the replica"))
+
+        self.replicas = replica_router.replicas
+        replica_router.replicas = [
+            Replica(self.replica_engine, check_interval=5, retry_after=30)]
+
+    def tearDown(self):
+        replica_router.replicas = self.replicas
+        db.session.rollback()
+        db.session.info.pop('replica', None)
+        self.replica_engine.dispose()
+        self.replica_dir.cleanup()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def test_marked_get_reads_replica(self):
+        """Test that a @replica_reads page is read from the replica"""
+
+        with app.test_client() as c:
+            self.login(c)
+            resp = c.get(f"/users/{self.u1_id}")
+
+        self.assertIn("bio on the replica", resp.get_data(as_text=True))
+
+    def test_unmarked_get_reads_primary(self):
+        """Test that pages not marked as replica-safe use the primary"""
+
+        with app.test_client() as c:
+            self.login(c)
+            resp = c.get("/users/profile")
+
+        self.assertIn("bio on the primary", resp.get_data(as_text=True))
+
+    def test_reads_own_writes(self):
+        """Test that reads just after a write go to the primary"""
+
+        with app.test_client() as c:
+            self.login(c)
+            c.post("/messages/new", data={"text": "hello"})
+            resp = c.get(f"/users/{self.u1_id}")
+
+        html = resp.get_data(as_text=True)
+        self.assertIn("bio on the primary", html)
+        self.assertIn("hello", html)
+
+    def test_dialect_lookup_doesnt_pin_primary(self):
+        """Test that looking up the session's dialect doesn't send the
+        request's later reads to the primary"""
+
+        with app.test_request_context(f"/users/{self.u1_id}"):
+            app.preprocess_request()
+            db.session.get_bind().dialect
+
+            user = db.session.get(User, self.u1_id)
+
+        self.assertEqual(user.bio, "bio on the replica")
+
+    def test_no_replicas_leaves_session_alone(self):
+        """Test that without replicas, writes don't set read-your-writes"""
+
+        replica_router.replicas = []
+
+        with app.test_client() as c:
+            self.login(c)
+            c.post("/messages/new", data={"text": "hello"})
+
+            with c.session_transaction() as sess:
+                self.assertNotIn(READ_PRIMARY_UNTIL_KEY, sess)
+
+    def test_falls_back_when_replica_down(self):
+        """Test that a replica that fails its health check is skipped"""
+
+        replica_router.replicas = [Replica(
+            create_engine("postgresql:///warbler_no_such_replica"),
+            check_interval=5,
+            retry_after=30,
+        )]
+
+        with app.test_client() as c:
+            self.login(c)
+            resp = c.get(f"/users/{self.u1_id}")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("bio on the primary", resp.get_data(as_text=True))
@@ -0,0 +1,121 @@
+"""Bulk seeding tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_seed.py
+
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app
+from seed import bulk_seed
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+class BulkSeedTestCase(TestCase):
+    def setUp(self):
+        app.config['TIMELINE_FANOUT_LIMIT'] = 10_000
+
+        self.data_dir = tempfile.TemporaryDirectory()
+
+        write_csv(
+            os.path.join(self.data_dir.name, "users.csv"),
+            ['email', 'username', 'image_url', 'password', 'bio',
+             'header_image_url', 'location'],
+            [[f"u{i}@email.com", f"u{i}", "/static/images/default-pic.png",
+              "not-a-hash", "bio", "/static/images/warbler-hero.jpg", "city"]
+             for i in range(1, 4)],
+        )
+        write_csv(
+            os.path.join(self.data_dir.name, "messages.csv"),
+            ['text', 'timestamp', 'user_id'],
+            [["first", "2023-01-01 00:00:00", 1],
+             ["second", "2023-01-02 00:00:00", 1],
+             ["third", "2023-01-03 00:00:00", 2]],
+        )
+        write_csv(
+            os.path.join(self.data_dir.name, "follows.csv"),
+            ['user_being_followed_id', 'user_following_id'],
+            [[1, 2], [1, 3], [2, 3]],
+        )
+        write_csv(
+            os.path.join(self.data_dir.name, "likes.csv"),
+            ['user_liking_id', 'message_being_liked_id'],
+            [[2, 1], [3, 1], [3, 3]],
+        )
+
+    def tearDown(self):
+        db.session.rollback()
+        self.data_dir.cleanup()
+
+        # Leave the tables as the other tests expect them
+        db.drop_all()
+        db.create_all()
+
+    def test_bulk_seed(self):
+        """Test that the CSVs are loaded in chunks, with the indexes put
+        back and the counts and timelines built"""
+
+        bulk_seed(self.data_dir.name, chunk_size=2)
+
+        self.assertEqual(User.query.count(), 3)
+        self.assertEqual(Message.query.count(), 3)
+        self.assertEqual(Follow.query.count(), 3)
+        self.assertEqual(Like.query.count(), 3)
+
+        inspector = db.inspect(db.engine)
+        self.assertIn(
+            'ix_follows_user_following_id',
+            [index['name'] for index in inspector.get_indexes('follows')])
+        self.assertIn(
+            'ix_likes_user_message',
+            [index['name'] for index in inspector.get_indexes('likes')])
+        self.assertTrue(inspector.get_foreign_keys('messages'))
+
+        u1 = db.session.get(User, 1)
+        self.assertEqual(u1.messages_count, 2)
+        self.assertEqual(u1.followers_count, 2)
+
+        u3_timeline = (TimelineEntry.query
+                       .filter_by(user_id=3)
+                       .order_by(TimelineEntry.message_id)
+                       .all())
+        self.assertEqual([entry.message_id for entry in u3_timeline],
+                         [1, 2, 3])
+
+        # New rows get ids past the loaded ones
+        db.session.add(User(username="u4", email="u4@email.com",
+                            password="not-a-hash"))
+        db.session.commit()
+        self.assertEqual(User.query.filter_by(username="u4").one().id, 4)
@@ -0,0 +1,152 @@
+"""Slow query recorder tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_slow_queries.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import exc, text
+
+from models import db, User
+from slow_queries import normalize_sql
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, slow_queries
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class NormalizeSQLTestCase(TestCase):
+    def test_normalize_sql(self):
+        """Test that values and expanded IN lists are normalized away"""
+
+        self.assertEqual(
+            normalize_sql(
+                "SELECT id\n  FROM users WHERE id IN (%(id_1_1)s, "
+                "%(id_1_2)s) AND bio = 'it''s' LIMIT 10"),
+            "SELECT id FROM users WHERE id IN (...) AND bio = ? LIMIT ?",
+        )
+
+
+class SlowQueryRecorderTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User(username="u1", email="u1@email.com", password="not-a-hash")
+        u2 = User(username="u2", email="u2@email.com", password="not-a-hash")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        # Record everything, and explain every SELECT
+        self.threshold = slow_queries.threshold
+        self.explain_rate = slow_queries.explain_rate
+        slow_queries.threshold = 0
+        slow_queries.explain_rate = 1
+        slow_queries.clear()
+
+    def tearDown(self):
+        slow_queries.threshold = self.threshold
+        slow_queries.explain_rate = self.explain_rate
+        slow_queries.clear()
+        app.config['ADMIN_USER_IDS'] = set()
+        db.session.rollback()
+
+    def test_records_endpoint_and_plan(self):
+        """Test that slow queries record their endpoint and a plan, but not
+        their parameter values"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get(f"/users/{self.u2_id}")
+
+        recorded = [
+            query for query in slow_queries.recent()
+            if query.endpoint == "show_user" and "FROM users" in query.sql
+        ]
+
+        self.assertTrue(recorded)
+        self.assertIn("Execution Time", recorded[0].plan)
+        self.assertNotIn(str(self.u2_id), str(recorded[0].params))
+        self.assertIn("int", str(recorded[0].params))
+
+    def test_failed_statement(self):
+        """Test that a failed statement leaves nothing behind on its
+        connection, and later statements are still timed"""
+
+        with db.engine.connect() as conn:
+            with self.assertRaises(exc.DBAPIError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+
+            conn.rollback()
+            conn.execute(text("SELECT 'after the failure'"))
+
+            self.assertNotIn('slow_query_start', conn.info)
+
+        self.assertIn("SELECT ?",
+                      [query.sql for query in slow_queries.recent()])
+
+    def test_admin_page(self):
+        """Test that only admins can see the slow queries page"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/admin/slow-queries", follow_redirects=True)
+            self.assertIn("Access unauthorized.", resp.get_data(as_text=True))
+
+            app.config['ADMIN_USER_IDS'] = {self.u1_id}
+
+            resp = c.get("/admin/slow-queries")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Slow queries", html)
+            self.assertIn("FROM users", html)
+
+    def test_admin_page_by_id(self):
+        """Test that admin access goes with the admin's id, not a username
+        that can be changed and claimed by someone else"""
+
+        app.config['ADMIN_USER_IDS'] = {self.u1_id}
+        User.query.get(self.u1_id).username = "renamed"
+        User.query.get(self.u2_id).username = "u1"
+        db.session.commit()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            resp = c.get("/admin/slow-queries", follow_redirects=True)
+            self.assertIn("Access unauthorized.", resp.get_data(as_text=True))
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/admin/slow-queries")
+            self.assertEqual(resp.status_code, 200)
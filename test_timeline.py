@@ -0,0 +1,311 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from timeline import (get_home_timeline,
+                      rebuild_timelines,
+                      format_cursor,
+                      count_unseen_messages,
+)
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineBaseTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 10_000
+        app.config['TIMELINE_FANOUT_HYSTERESIS'] = 0.1
+        app.config['TIMELINE_BACKFILL_SIZE'] = 100
+        app.config['TIMELINE_PAGE_SIZE'] = 100
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def post_as(self, c, user_id, text):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        c.post("/messages/new", data={"text": text})
+
+        return Message.query.filter_by(text=text).one().id
+
+    def follow_as(self, c, user_id, follow_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        c.post(f"/users/follow/{follow_id}")
+
+    def timeline_ids(self, user_id):
+        return [m.id for m in get_home_timeline(User.query.get(user_id))]
+
+
+class TimelineTestCase(TimelineBaseTestCase):
+    def test_message_fans_out_to_followers(self):
+        """Test that a new message is written to each follower's timeline"""
+
+        with app.test_client() as c:
+            self.follow_as(c, self.u2_id, self.u1_id)
+            m_id = self.post_as(c, self.u1_id, "hello followers")
+
+        self.assertEqual(self.timeline_ids(self.u1_id), [m_id])
+        self.assertEqual(self.timeline_ids(self.u2_id), [m_id])
+        self.assertEqual(self.timeline_ids(self.u3_id), [])
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        """Test that following copies in recent messages and unfollowing
+        removes them"""
+
+        with app.test_client() as c:
+            m_id = self.post_as(c, self.u1_id, "before the follow")
+
+            self.follow_as(c, self.u2_id, self.u1_id)
+            self.assertEqual(self.timeline_ids(self.u2_id), [m_id])
+
+            c.post(f"/users/stop-following/{self.u1_id}")
+            self.assertEqual(self.timeline_ids(self.u2_id), [])
+
+    def test_delete_message_removes_entries(self):
+        """Test that deleting a message removes it from every timeline"""
+
+        with app.test_client() as c:
+            self.follow_as(c, self.u2_id, self.u1_id)
+            m_id = self.post_as(c, self.u1_id, "short lived")
+
+            c.post(f"/messages/{m_id}/delete")
+
+        self.assertEqual(
+            TimelineEntry.query.filter_by(message_id=m_id).count(), 0)
+
+    def test_high_fanout_author_merged_on_read(self):
+        """Test that authors over the fan-out limit are read-merged"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 2
+
+        with app.test_client() as c:
+            self.follow_as(c, self.u2_id, self.u1_id)
+            self.follow_as(c, self.u3_id, self.u1_id)
+            m1_id = self.post_as(c, self.u1_id, "big announcement")
+            m2_id = self.post_as(c, self.u2_id, "small reply")
+
+        self.assertEqual(
+            TimelineEntry.query.filter_by(message_id=m1_id).count(), 1)
+        self.assertTrue(User.query.get(self.u1_id).fanout_on_read)
+        self.assertEqual(self.timeline_ids(self.u2_id), [m2_id, m1_id])
+        self.assertEqual(self.timeline_ids(self.u3_id), [m1_id])
+
+    def test_author_back_under_fanout_limit(self):
+        """Test that messages merged on read aren't lost when the author
+        goes back to fan-out on write"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 2
+
+        with app.test_client() as c:
+            self.follow_as(c, self.u2_id, self.u1_id)
+            self.follow_as(c, self.u3_id, self.u1_id)
+            m1_id = self.post_as(c, self.u1_id, "while merged on read")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u3_id
+
+            c.post(f"/users/stop-following/{self.u1_id}")
+            m2_id = self.post_as(c, self.u1_id, "back to fan-out")
+
+        self.assertFalse(User.query.get(self.u1_id).fanout_on_read)
+        self.assertEqual(self.timeline_ids(self.u2_id), [m2_id, m1_id])
+        self.assertEqual(self.timeline_ids(self.u3_id), [])
+
+    def test_back_under_fanout_limit_backfill_size(self):
+        """Test that going back to fan-out on write only copies in recent
+        messages, and only once well under the limit"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 2
+        app.config['TIMELINE_FANOUT_HYSTERESIS'] = 0.5
+        app.config['TIMELINE_BACKFILL_SIZE'] = 2
+
+        with app.test_client() as c:
+            self.follow_as(c, self.u2_id, self.u1_id)
+            self.follow_as(c, self.u3_id, self.u1_id)
+            self.post_as(c, self.u1_id, "too old")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u3_id
+
+            c.post(f"/users/stop-following/{self.u1_id}")
+
+            # One follower isn't under half the limit yet
+            m1_id = self.post_as(c, self.u1_id, "still merged")
+            self.assertTrue(User.query.get(self.u1_id).fanout_on_read)
+
+            app.config['TIMELINE_FANOUT_HYSTERESIS'] = 0.1
+            m2_id = self.post_as(c, self.u1_id, "back to fan-out")
+
+        self.assertFalse(User.query.get(self.u1_id).fanout_on_read)
+        self.assertEqual(self.timeline_ids(self.u2_id), [m2_id, m1_id])
+
+    def test_rebuild_timelines(self):
+        """Test that rebuilding matches the fanned-out timelines"""
+
+        with app.test_client() as c:
+            self.follow_as(c, self.u2_id, self.u1_id)
+            m_id = self.post_as(c, self.u1_id, "rebuild me")
+
+        TimelineEntry.query.delete()
+        rebuild_timelines()
+        db.session.commit()
+
+        self.assertEqual(self.timeline_ids(self.u2_id), [m_id])
+        self.assertEqual(self.timeline_ids(self.u3_id), [])
+
+    def test_self_follow(self):
+        """Test that users can't follow themselves, and that self-follows
+        made before that was refused don't break their timeline"""
+
+        with app.test_client() as c:
+            self.follow_as(c, self.u1_id, self.u1_id)
+            self.assertIsNone(db.session.get(Follow, (self.u1_id, self.u1_id)))
+
+            db.session.add(Follow(user_being_followed_id=self.u1_id,
+                                  user_following_id=self.u1_id))
+            db.session.commit()
+
+            m1_id = self.post_as(c, self.u1_id, "fanned out")
+
+            # Back from being merged on read, which backfills followers
+            User.query.get(self.u1_id).fanout_on_read = True
+            db.session.commit()
+            m2_id = self.post_as(c, self.u1_id, "backfilled")
+
+        self.assertEqual(self.timeline_ids(self.u1_id), [m2_id, m1_id])
+
+        rebuild_timelines()
+        db.session.commit()
+
+        self.assertEqual(self.timeline_ids(self.u1_id), [m2_id, m1_id])
+
+
+class TimelinePaginationTestCase(TimelineBaseTestCase):
+    def test_load_older_pages(self):
+        """Test that the `before` cursor pages back through the timeline"""
+
+        app.config['TIMELINE_PAGE_SIZE'] = 2
+
+        with app.test_client() as c:
+            for text in ["first", "second", "third"]:
+                self.post_as(c, self.u1_id, text)
+
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("third", html)
+            self.assertIn("second", html)
+            self.assertNotIn("first", html)
+            self.assertIn("Load older warbles", html)
+
+            second = Message.query.filter_by(text="second").one()
+            resp = c.get("/", query_string={
+                "before": format_cursor(second),
+                "partial": 1,
+            })
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("first", html)
+            self.assertNotIn("second", html)
+            self.assertNotIn("Load older warbles", html)
+            self.assertNotIn("<html", html)
+
+    def test_bad_cursor(self):
+        """Test that a malformed cursor is a bad request"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/?before=yesterday")
+
+            self.assertEqual(resp.status_code, 400)
+
+
+class TimelineUnseenTestCase(TimelineBaseTestCase):
+    def test_count_unseen_messages(self):
+        """Test that messages by others since the home page was last viewed
+        are counted, up to one past the cap"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 2
+
+        with app.test_client() as c:
+            self.follow_as(c, self.u2_id, self.u1_id)
+            self.follow_as(c, self.u3_id, self.u1_id)
+            self.follow_as(c, self.u2_id, self.u3_id)
+
+            c.get("/")
+
+            self.post_as(c, self.u1_id, "merged on read")
+            self.post_as(c, self.u3_id, "fanned out")
+            self.post_as(c, self.u2_id, "their own")
+
+            u2 = User.query.get(self.u2_id)
+            self.assertTrue(User.query.get(self.u1_id).fanout_on_read)
+            self.assertEqual(count_unseen_messages(u2, cap=99), 2)
+            self.assertEqual(count_unseen_messages(u2, cap=1), 2)
+            self.assertEqual(count_unseen_messages(u2, cap=0), 1)
+
+            c.get("/")
+
+            self.assertEqual(count_unseen_messages(u2, cap=99), 0)
+
+    def test_count_author_gone_high_fanout(self):
+        """Test that a message fanned out before its author went high
+        fan-out is only counted once"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 2
+
+        with app.test_client() as c:
+            self.follow_as(c, self.u2_id, self.u1_id)
+            self.post_as(c, self.u1_id, "fanned out")
+
+            self.follow_as(c, self.u3_id, self.u1_id)
+            self.post_as(c, self.u1_id, "merged on read")
+
+        u2 = User.query.get(self.u2_id)
+        self.assertTrue(User.query.get(self.u1_id).fanout_on_read)
+        self.assertEqual(count_unseen_messages(u2, cap=99), 2)
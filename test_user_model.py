@@ -163,6 +163,24 @@ class UserModelTestCase(TestCase):
 
         self.assertFalse(test_user_1.is_followed_by(test_user_2))
 
+    def test_get_followed_user_ids(self):
+        """
+        Ensures that get_followed_user_ids finds just the followed users
+        """
+
+        test_user_1 = User.query.get(self.u1_id)
+        test_user_2 = User.query.get(self.u2_id)
+
+        test_user_1.following.append(test_user_2)
+        db.session.commit()
+
+        self.assertEqual(
+            test_user_1.get_followed_user_ids([test_user_1, test_user_2]),
+            {self.u2_id},
+        )
+        self.assertEqual(test_user_2.get_followed_user_ids([test_user_1]), set())
+        self.assertEqual(test_user_1.get_followed_user_ids([]), set())
+
 
     def test_authenticate_positive(self):
         """
@@ -198,3 +216,50 @@ class UserModelTestCase(TestCase):
         bad_username = test_user_1.username + "s"
 
         self.assertFalse(User.authenticate(bad_username, test_user_1.password))
+
+
+class UserSearchTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        for username in ["annabel", "ann", "joanna", "hannah", "bob",
+                         "an_na", "anxna"]:
+            db.session.add(User(
+                username=username,
+                email=f"{username}@email.com",
+                password="not-a-hash",
+            ))
+
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def search(self, term, limit=50):
+        return [user.username for user in User.search(term, limit)]
+
+    def test_search_ranks_prefix_matches_first(self):
+        """Prefix matches come first alphabetically, then other matches
+        shortest first"""
+
+        self.assertEqual(
+            self.search("ANN"),
+            ["ann", "annabel", "hannah", "joanna"],
+        )
+
+    def test_search_limit(self):
+        """Only `limit` users are returned, best first"""
+
+        self.assertEqual(self.search("ann", limit=2), ["ann", "annabel"])
+
+    def test_search_short_term_is_prefix_only(self):
+        """Terms too short for the trigram index only match prefixes"""
+
+        self.assertEqual(self.search("an"), ["an_na", "ann", "annabel",
+                                             "anxna"])
+
+    def test_search_escapes_wildcards(self):
+        """LIKE wildcards in the term match literally"""
+
+        self.assertEqual(self.search("n_n"), ["an_na"])
+        self.assertEqual(self.search("an_"), ["an_na"])
@@ -0,0 +1,326 @@
+"""User View tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_user_views.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from account_purge import purge_deleted_users
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UserBaseViewTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u1.id)
+        m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.add_all([m1, m2])
+        u1.messages_count = 1
+        u2.messages_count = 1
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+        self.m2_id = m2.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+
+class UserCountsViewTestCase(UserBaseViewTestCase):
+    def counts(self, user_id):
+        user = User.query.get(user_id)
+
+        return (
+            user.messages_count,
+            user.followers_count,
+            user.following_count,
+            user.likes_count,
+        )
+
+    def test_follow_and_unfollow_counts(self):
+        """Test that following updates both users' counts"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+
+            c.post(f"/users/follow/{self.u2_id}")
+            self.assertEqual(self.counts(self.u1_id), (1, 0, 1, 0))
+            self.assertEqual(self.counts(self.u2_id), (1, 1, 0, 0))
+
+            c.post(f"/users/stop-following/{self.u2_id}")
+            self.assertEqual(self.counts(self.u1_id), (1, 0, 0, 0))
+            self.assertEqual(self.counts(self.u2_id), (1, 0, 0, 0))
+
+    def test_repeated_writes_change_nothing(self):
+        """Test that following or liking twice (or undoing either twice)
+        counts once"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+
+            for _ in range(2):
+                c.post(f"/users/follow/{self.u2_id}")
+                c.post(f"/messages/{self.m2_id}/like")
+            self.assertEqual(self.counts(self.u1_id), (1, 0, 1, 1))
+            self.assertEqual(self.counts(self.u2_id), (1, 1, 0, 0))
+
+            for _ in range(2):
+                resp = c.post(f"/users/stop-following/{self.u2_id}")
+                c.post(f"/messages/{self.m2_id}/unlike")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(self.counts(self.u1_id), (1, 0, 0, 0))
+            self.assertEqual(self.counts(self.u2_id), (1, 0, 0, 0))
+
+    def test_follow_json(self):
+        """Test that the follow toggles get the new state and counts"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+
+            resp = c.post(f"/users/follow/{self.u2_id}",
+                          headers={"Accept": "application/json"})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json["following"], True)
+            self.assertIn(
+                {"id": self.u2_id, "messages_count": 1, "followers_count": 1,
+                 "following_count": 0, "likes_count": 0},
+                resp.json["users"],
+            )
+
+            resp = c.post(f"/users/stop-following/{self.u2_id}",
+                          headers={"Accept": "application/json"})
+
+            self.assertEqual(resp.json["following"], False)
+            self.assertEqual(
+                {user["id"]: user["following_count"]
+                 for user in resp.json["users"]},
+                {self.u1_id: 0, self.u2_id: 0},
+            )
+
+    def test_follow_json_unauthorized(self):
+        """Test that a logged out toggle gets a 403, not a redirect"""
+
+        with app.test_client() as c:
+            resp = c.post(f"/users/follow/{self.u2_id}",
+                          headers={"Accept": "application/json"})
+
+        self.assertEqual(resp.status_code, 403)
+        self.assertEqual(resp.json, {"error": "Access unauthorized."})
+
+    def test_message_and_like_counts(self):
+        """Test that messages and likes update counts"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+
+            c.post("/messages/new", data={"text": "another"})
+            c.post(f"/messages/{self.m2_id}/like")
+            self.assertEqual(self.counts(self.u1_id), (2, 0, 0, 1))
+
+            c.post(f"/messages/{self.m2_id}/unlike")
+            self.assertEqual(self.counts(self.u1_id), (2, 0, 0, 0))
+
+            c.post(f"/messages/{self.m2_id}/like")
+            self.login(c, self.u2_id)
+            c.post(f"/messages/{self.m2_id}/delete")
+
+            self.assertEqual(self.counts(self.u1_id), (2, 0, 0, 0))
+            self.assertEqual(self.counts(self.u2_id), (0, 0, 0, 0))
+
+    def test_delete_user_counts(self):
+        """Test that deleting a user takes them off everyone else's counts"""
+
+        with app.test_client() as c:
+            self.login(c, self.u2_id)
+            c.post(f"/users/follow/{self.u1_id}")
+            c.post(f"/messages/{self.m1_id}/like")
+
+            self.login(c, self.u1_id)
+            c.post("/messages/new", data={"text": "another"})
+            c.post(f"/users/follow/{self.u2_id}")
+
+            self.login(c, self.u2_id)
+            another = Message.query.filter_by(text="another").one()
+            c.post(f"/messages/{another.id}/like")
+            self.assertEqual(self.counts(self.u2_id), (1, 1, 1, 2))
+
+            self.login(c, self.u1_id)
+            c.post("/users/delete")
+
+        # Counts change as the purge removes the rows they count
+        self.assertEqual(self.counts(self.u2_id), (1, 1, 1, 2))
+
+        purge_deleted_users(batch_size=1)
+        self.assertEqual(self.counts(self.u2_id), (1, 0, 0, 0))
+
+    def test_deleted_user_hidden_from_lists(self):
+        """Test that a deleted user is left off follow and likes lists
+        before they're purged"""
+
+        with app.test_client() as c:
+            self.login(c, self.u2_id)
+            c.post(f"/users/follow/{self.u1_id}")
+            c.post(f"/messages/{self.m1_id}/like")
+
+            self.login(c, self.u1_id)
+            c.post(f"/users/follow/{self.u2_id}")
+            c.post("/users/delete")
+
+            self.login(c, self.u2_id)
+
+            for url in [f"/users/{self.u2_id}/following",
+                        f"/users/{self.u2_id}/followers",
+                        f"/users/{self.u2_id}/likes",
+                        f"/api/v1/users/{self.u2_id}/likes"]:
+                resp = c.get(url)
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertNotIn("u1", resp.get_data(as_text=True))
+                self.assertNotIn("m1-text", resp.get_data(as_text=True))
+
+    def test_stats_show_counts(self):
+        """Test that the profile page renders the stored counts"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+
+            resp = c.get(f"/users/{self.u2_id}")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("m2-text", html)
+
+    def test_reconcile_counts(self):
+        """Test that drifted counts are repaired"""
+
+        u1 = User.query.get(self.u1_id)
+        u1.messages_count = 10
+        u1.likes_count = -3
+        db.session.commit()
+
+        self.assertEqual(User.reconcile_counts(), 1)
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.u1_id), (1, 0, 0, 0))
+        self.assertEqual(User.reconcile_counts(), 0)
+
+
+class UserLikesViewTestCase(UserBaseViewTestCase):
+    def test_like_buttons_use_liked_ids(self):
+        """Test that liked messages render an unlike button and others a
+        like button"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+            c.post(f"/messages/{self.m2_id}/like")
+
+            resp = c.get(f"/users/{self.u2_id}")
+            html = resp.get_data(as_text=True)
+            self.assertIn(f"/messages/{self.m2_id}/unlike", html)
+
+            resp = c.get(f"/messages/{self.m2_id}")
+            html = resp.get_data(as_text=True)
+            self.assertIn(f"/messages/{self.m2_id}/unlike", html)
+
+            c.post(f"/messages/{self.m2_id}/unlike")
+
+            resp = c.get(f"/users/{self.u2_id}")
+            html = resp.get_data(as_text=True)
+            self.assertIn(f"/messages/{self.m2_id}/like", html)
+            self.assertNotIn(f"/messages/{self.m2_id}/unlike", html)
+
+    def test_get_liked_message_ids(self):
+        """Test that only the viewer's likes among the given messages are
+        returned"""
+
+        u1 = User.query.get(self.u1_id)
+        m1 = Message.query.get(self.m1_id)
+        m2 = Message.query.get(self.m2_id)
+
+        u1.liked_messages.append(m2)
+        db.session.commit()
+
+        self.assertEqual(u1.get_liked_message_ids([m1, m2]), {self.m2_id})
+        self.assertEqual(u1.get_liked_message_ids([m1]), set())
+        self.assertEqual(u1.get_liked_message_ids([]), set())
+
+
+class UserListViewTestCase(UserBaseViewTestCase):
+    def test_list_users_pages(self):
+        """Test that the directory pages through users by username"""
+
+        with app.test_client() as c:
+            self.login(c, self.u1_id)
+
+            resp = c.get("/users?per_page=1")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("@u1", html)
+            self.assertNotIn("@u2", html)
+            self.assertIn("after=u1", html)
+
+            resp = c.get("/users?per_page=1&after=u1")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("@u2", html)
+            self.assertNotIn("@u1<", html)
+            self.assertNotIn("More users", html)
+
+    def test_list_users_streamed(self):
+        """Test that the directory can be streamed"""
+
+        app.config['USERS_STREAM_TEMPLATE'] = True
+
+        try:
+            with app.test_client() as c:
+                self.login(c, self.u1_id)
+
+                resp = c.get("/users")
+
+                self.assertTrue(resp.is_streamed)
+                self.assertIn("@u2", resp.get_data(as_text=True))
+        finally:
+            app.config['USERS_STREAM_TEMPLATE'] = False
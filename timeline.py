@@ -0,0 +1,375 @@
+"""Precomputed home timelines for Warbler.
+
+Messages are copied into `timeline_entries` for the author and each of their
+followers when they are posted (fan-out on write). Authors with more than
+TIMELINE_FANOUT_LIMIT followers are skipped on write and their messages are
+merged in when a timeline is read instead, so one post never turns into an
+unbounded number of inserts.
+"""
+
+from datetime import datetime
+
+from flask import current_app
+
+from models import db, Follow, Message, TimelineEntry, User
+
+
+def get_fanout_resume_limit():
+    """The follower count a high fan-out author must drop below to go back
+    to fan-out on write.
+
+    It's under TIMELINE_FANOUT_LIMIT by TIMELINE_FANOUT_HYSTERESIS (a
+    fraction of it), so an author hovering around the limit doesn't flip
+    back and forth, backfilling their followers every time.
+    """
+
+    config = current_app.config
+
+    return (config['TIMELINE_FANOUT_LIMIT']
+            * (1 - config['TIMELINE_FANOUT_HYSTERESIS']))
+
+
+def is_high_fanout(user):
+    """Does this user have too many followers to fan out on write?"""
+
+    if user.fanout_on_read:
+        return user.followers_count >= get_fanout_resume_limit()
+
+    return user.followers_count >= current_app.config['TIMELINE_FANOUT_LIMIT']
+
+
+def fan_out_message(message):
+    """Deliver a newly added message to the home timelines that show it.
+
+    The author always gets the message. Followers get it too unless the
+    author is high fan-out, in which case it is merged in on read.
+    Call this before committing the session the message was added in.
+    """
+
+    db.session.flush()
+
+    author = db.session.get(User, message.user_id)
+    was_fanout_on_read = author.fanout_on_read
+    author.fanout_on_read = is_high_fanout(author)
+
+    db.session.add(TimelineEntry(
+        user_id=author.id,
+        message_id=message.id,
+        author_id=author.id,
+        timestamp=message.timestamp,
+    ))
+
+    if author.fanout_on_read:
+        return
+
+    # Messages posted (and follows made) while the author was merged on
+    # read were never copied into their followers' timelines; copy in the
+    # recent ones, this message included, now that they won't be merged
+    # any more
+    if was_fanout_on_read:
+        backfill_followers(author.id)
+        return
+
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'],
+            db.select(
+                Follow.user_following_id,
+                db.literal(message.id),
+                db.literal(author.id),
+                db.literal(message.timestamp),
+            )
+            .where(Follow.user_being_followed_id == author.id)
+            # Their own entry is added above, even if they follow themselves
+            .where(Follow.user_following_id != author.id)
+        )
+    )
+
+
+def backfill_followers(author_id):
+    """Copy an author's recent messages into any of their followers'
+    timelines that are missing them.
+
+    Like a new follow, only the TIMELINE_BACKFILL_SIZE most recent are
+    copied, so this is bounded however long the author was merged on read.
+    """
+
+    recent_messages = (
+        db.select(Message.id, Message.user_id, Message.timestamp)
+        .where(Message.user_id == author_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(current_app.config['TIMELINE_BACKFILL_SIZE'])
+        .subquery()
+    )
+
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'],
+            db.select(
+                Follow.user_following_id,
+                recent_messages.c.id,
+                recent_messages.c.user_id,
+                recent_messages.c.timestamp,
+            )
+            .join(recent_messages, db.true())
+            .where(Follow.user_being_followed_id == author_id)
+            .where(Follow.user_following_id != author_id)
+            .where(~db.exists()
+                   .where(TimelineEntry.user_id == Follow.user_following_id)
+                   .where(TimelineEntry.message_id == recent_messages.c.id))
+        )
+    )
+
+
+def add_follow_to_timeline(follower_id, followed_id):
+    """Backfill a follower's timeline with the recent messages of a newly
+    followed user.
+
+    High fan-out users are skipped; their messages are merged in on read.
+    """
+
+    followed_user = db.session.get(User, followed_id)
+
+    if followed_user.fanout_on_read:
+        return
+
+    recent_messages = (
+        db.select(
+            db.literal(follower_id),
+            Message.id,
+            Message.user_id,
+            Message.timestamp,
+        )
+        .where(Message.user_id == followed_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(current_app.config['TIMELINE_BACKFILL_SIZE'])
+    )
+
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'],
+            recent_messages,
+        )
+    )
+
+
+def remove_follow_from_timeline(follower_id, followed_id):
+    """Remove an unfollowed user's messages from a follower's timeline."""
+
+    db.session.execute(
+        db.delete(TimelineEntry)
+        .where(TimelineEntry.user_id == follower_id)
+        .where(TimelineEntry.author_id == followed_id)
+    )
+
+
+def format_cursor(message):
+    """Make a `before` cursor pointing just past this message.
+
+    Cursors are "<ISO timestamp>,<message id>", matching the (timestamp, id)
+    order timelines are read in.
+    """
+
+    return f"{message.timestamp.isoformat()},{message.id}"
+
+
+def parse_cursor(cursor):
+    """Parse a `before` cursor into a (timestamp, message id) tuple.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    timestamp, message_id = cursor.rsplit(",", 1)
+
+    return datetime.fromisoformat(timestamp), int(message_id)
+
+
+def _get_high_fanout_ids(user):
+    """Subquery for the high fan-out users `user` follows, whose messages
+    are merged into their timeline on read."""
+
+    return (
+        db.select(Follow.user_being_followed_id)
+        .join(User, User.id == Follow.user_being_followed_id)
+        .where(Follow.user_following_id == user.id)
+        .where(Follow.user_being_followed_id != user.id)
+        .where(User.fanout_on_read.is_(True))
+    )
+
+
+def get_home_timeline(user, limit=100, before=None, after=None):
+    """Get the `limit` most recent messages for a user's home timeline.
+
+    Reads the user's precomputed entries and merges in recent messages from
+    any followed high fan-out authors. If `before` is a (timestamp, id)
+    cursor, only messages older than it are returned, so every page is the
+    same indexed range read no matter how deep it is; likewise `after` only
+    returns messages newer than its cursor. Messages by deleted accounts are
+    left out until they are purged.
+    """
+
+    entries = (
+        db.select(Message)
+        .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+        .join(Message.user)
+        .options(db.contains_eager(Message.user))
+        .where(User.deleted_at.is_(None))
+    )
+
+    if before:
+        entries = entries.where(
+            db.tuple_(TimelineEntry.timestamp, TimelineEntry.message_id)
+            < db.tuple_(*before))
+
+    if after:
+        entries = entries.where(
+            db.tuple_(TimelineEntry.timestamp, TimelineEntry.message_id)
+            > db.tuple_(*after))
+
+    messages = (
+        db.session.scalars(
+            entries
+            .where(TimelineEntry.user_id == user.id)
+            .order_by(
+                TimelineEntry.timestamp.desc(),
+                TimelineEntry.message_id.desc(),
+            )
+            .limit(limit)
+        )
+        .all()
+    )
+
+    merged = (
+        db.select(Message)
+        .join(Message.user)
+        .options(db.contains_eager(Message.user))
+        .where(User.deleted_at.is_(None))
+    )
+
+    if before:
+        merged = merged.where(
+            db.tuple_(Message.timestamp, Message.id) < db.tuple_(*before))
+
+    if after:
+        merged = merged.where(
+            db.tuple_(Message.timestamp, Message.id) > db.tuple_(*after))
+
+    merged_messages = (
+        db.session.scalars(
+            merged
+            .where(Message.user_id.in_(_get_high_fanout_ids(user)))
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(limit)
+        )
+        .all()
+    )
+
+    if not merged_messages:
+        return messages
+
+    # A message can be in both lists if its author became high fan-out
+    # after it was posted
+    by_id = {message.id: message for message in messages + merged_messages}
+
+    return sorted(
+        by_id.values(),
+        key=lambda message: (message.timestamp, message.id),
+        reverse=True,
+    )[:limit]
+
+
+def count_unseen_messages(user, cap):
+    """Count the messages by other users in a user's home timeline that
+    are newer than the last one they were shown there.
+
+    Counts at most `cap` + 1 of them, so one more than `cap` means "more
+    than `cap`", and the work is bounded however long they've been away:
+    at most that many of their timeline entries, and an index-only range
+    of each followed high fan-out author's messages. Messages by deleted
+    accounts are counted until they are purged.
+    """
+
+    last_seen_id = (
+        db.select(db.func.coalesce(User.last_seen_message_id, 0))
+        .where(User.id == user.id)
+        .scalar_subquery()
+    )
+
+    entries = (
+        db.select(TimelineEntry.message_id)
+        .where(TimelineEntry.user_id == user.id)
+        .where(TimelineEntry.message_id > last_seen_id)
+        .where(TimelineEntry.author_id != user.id)
+        .limit(cap + 1)
+    )
+
+    merged = (
+        db.select(Message.id)
+        .where(Message.user_id.in_(_get_high_fanout_ids(user)))
+        .where(Message.id > last_seen_id)
+        .limit(cap + 1)
+    )
+
+    # An author who became high fan-out after posting has messages on both
+    # sides, so count them once
+    count = db.session.scalar(
+        db.select(db.func.count())
+        .select_from(db.union(entries.subquery().select(),
+                              merged.subquery().select()).subquery())
+    )
+
+    return min(count, cap + 1)
+
+
+def rebuild_timelines():
+    """Rebuild every home timeline from the messages and follows tables.
+
+    Used after bulk loads and to repair timelines if the fan-out limit
+    changes. Relies on the users' follower counts being accurate.
+    """
+
+    db.session.execute(db.delete(TimelineEntry))
+
+    # As is_high_fanout(), keeping authors between the two limits as they
+    # are
+    db.session.execute(
+        db.update(User).values(
+            fanout_on_read=db.or_(
+                User.followers_count
+                >= current_app.config['TIMELINE_FANOUT_LIMIT'],
+                db.and_(
+                    User.fanout_on_read.is_(True),
+                    User.followers_count >= get_fanout_resume_limit(),
+                ),
+            )
+        )
+    )
+
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'],
+            db.select(
+                Message.user_id,
+                Message.id,
+                Message.user_id,
+                Message.timestamp,
+            )
+        )
+    )
+
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'],
+            db.select(
+                Follow.user_following_id,
+                Message.id,
+                Message.user_id,
+                Message.timestamp,
+            )
+            .join(Message, Message.user_id == Follow.user_being_followed_id)
+            .join(User, User.id == Message.user_id)
+            .where(User.fanout_on_read.is_(False))
+            # Authors already have their own messages, from above
+            .where(Follow.user_following_id != Follow.user_being_followed_id)
+        )
+    )